@@ -128,6 +128,11 @@ class PblInstallCommand(LibPebbleCommand):
         parser.add_argument('--direct', action='store_true', help='Install directly on watch. Default is to send the'
                 'complete bundle to the phone and have it send the pieces of the bundle to the watch. '
                 'WARNING: This option won\'t work for PBWs with javascript in them.')
+        parser.add_argument('--putbytes_window', type=int, metavar='CHUNKS',
+                help='Number of PutBytes chunks to send before waiting for the watch to ack them. '
+                'Only use more than 1 (the default) with watches known to accept it.')
+        parser.add_argument('--putbytes_chunk_size', type=int, metavar='BYTES',
+                help='Size of each PutBytes chunk (default 2000).')
 
     def run(self, args):
         LibPebbleCommand.run(self, args)
@@ -139,6 +144,9 @@ class PblInstallCommand(LibPebbleCommand):
         if args.logs:
             self.pebble.app_log_enable()
 
+        self.pebble.putbytes_window = args.putbytes_window
+        self.pebble.putbytes_chunk_size = args.putbytes_chunk_size
+
         if args.bundle_path.lower().endswith(".pbw"):
             success = self.pebble.install_app(args.bundle_path, direct=args.direct)
         elif args.bundle_path.lower().endswith(".pbz"):
@@ -295,6 +303,8 @@ class PblCoreDumpCommand(LibPebbleCommand):
         parser.add_argument('--generate', action='store_true', help='If specified, generate a core dump image on the '
                 'watch. Wait for the watch to reboot and issue the coredump command again without --generate to '
                 'then fetch it.')
+        parser.add_argument('--resume', metavar='FILE', help='Continue an interrupted download into FILE '
+                'rather than starting a new file.')
 
     def run(self, args):
         LibPebbleCommand.run(self, args)
@@ -309,15 +319,13 @@ class PblCoreDumpCommand(LibPebbleCommand):
         def progress_callback(amount):
             logging.info("%.2f%% done..." % (amount*100.0))
 
-        blob = self.pebble.coredump(progress_callback)
-        name = time.strftime("pebble-coredump_%Y-%m-%d_%H-%M-%S.bin")
-        if len(blob) == 0:
-            logging.error("Error fetching core dump")
-            return
+        name = args.resume or time.strftime("pebble-coredump_%Y-%m-%d_%H-%M-%S.bin")
         try:
-            with open(name, 'w') as f:
-                f.write(blob)
-        except:
+            self.pebble.coredump(progress_callback, name)
+        except libpebble.PebbleError:
+            if os.path.exists(libpebble.CoreDumpSync.progress_path(name)):
+                logging.error("Core dump download was interrupted. Run this command again with --resume %s "
+                              "to continue it." % name)
             raise
 
         logging.info("Core dump saved to %s" % name)
@@ -9,6 +9,8 @@ import sys
 import PblAnalytics
 from PblCommand import PblCommand
 from PblProjectCreator import requires_project_dir
+from PblBuildTimer import PblBuildTimer
+from PblProjectScanner import PblProjectScanner
 from LibPebblesCommand import (NoCompilerException, BuildErrorException,
                                AppTooBigException)
 
@@ -86,60 +88,30 @@ class PblWafCommand(PblCommand):
 
 
     ###########################################################################
-    def _count_lines(self, path, exts):
-        """ Count number of lines of source code in the given path. This will
-        recurse into subdirectories as well. 
-        
-        Parameters:
-        --------------------------------------------------------------------
-        path: directory name to search
-        exts: list of extensions to include in the search, i.e. ['.c', '.h']
-        """
-        
-        srcLines = 0
-        files = os.listdir(path)
-        for name in files:
-            if name.startswith('.'):
-                continue
-            if os.path.isdir(os.path.join(path, name)):
-                if not os.path.islink(os.path.join(path, name)):
-                    srcLines += self._count_lines(os.path.join(path, name), exts)
-                continue
-            ext = os.path.splitext(name)[1]
-            if ext in exts:
-                srcLines += sum(1 for line in open(os.path.join(path, name)))
-        return srcLines
-    
-
-    ###########################################################################
-    def _send_line_counts(self, args, appInfo):
+    def _send_line_counts(self, args, appInfo, scanner):
         """ Send app line counts up to analytics 
         
         Parameters:
         --------------------------------------------------------------------
         args: the args passed to the run() method
         appInfo: the applications appInfo
+        scanner: a PblProjectScanner that has scanned the project
         """
         
-        c_line_count = 0
-        js_line_count = 0
-        if os.path.exists('src'):
-            c_line_count += self._count_lines('src', ['.h', '.c'])
-            js_line_count += self._count_lines('src', ['.js'])
-
         PblAnalytics.code_line_count_evt(uuid=appInfo["uuid"], 
-                                c_line_count = c_line_count,
-                                js_line_count = js_line_count)
+                                c_line_count = scanner.line_counts['c'],
+                                js_line_count = scanner.line_counts['js'])
 
 
     ###########################################################################
-    def _send_resource_usage(self, args, appInfo):
+    def _send_resource_usage(self, args, appInfo, scanner):
         """ Send app resource usage up to analytics 
         
         Parameters:
         --------------------------------------------------------------------
         args: the args passed to the run() method
         appInfo: the applications appInfo
+        scanner: a PblProjectScanner that has scanned the project
         """
         
         # Collect the number and total size of each class of resource:
@@ -158,20 +130,9 @@ class PblWafCommand(PblCommand):
                                 (resDict["type"]))
 
             # Look for the generated blob in the build/resource directory.
-            # As far as we can tell, the generated blob always starts with
-            # the original filename and adds an extension to it, or (for
-            # fonts), a name and extension. 
-            (dirName, fileName) = os.path.split(resDict["file"])
-            dirToSearch = os.path.join("build", "resources", dirName)
-            found = False
-            for name in os.listdir(dirToSearch):
-                if (type == "raw" and name == fileName) \
-                    or (type != 'raw' and name.startswith(fileName) 
-                        and name != fileName):
-                    size = os.path.getsize(os.path.join(dirToSearch, name))
-                    found = True
-                    break
-            if not found:
+            size = scanner.generated_resource_size(resDict["file"],
+                                                   raw=(type == "raw"))
+            if size is None:
                 raise RuntimeError("Could not find generated resource "
                             "corresponding to %s." % (resDict["file"]))
                 
@@ -184,9 +145,36 @@ class PblWafCommand(PblCommand):
                                  resSizes = resSizes)
                 
 
+    ###########################################################################
+    def _report_timings(self, args, timer):
+        """ Print the build phase summary and/or write the Chrome trace, as
+        requested on the command line
+        
+        Parameters:
+        --------------------------------------------------------------------
+        args: the args passed to the run() method
+        timer: the PblBuildTimer the build was timed with
+        """
+        
+        if args.timings:
+            print timer.summary()
+        if args.trace is not None:
+            timer.write_chrome_trace(args.trace)
+            logging.info("Wrote build trace to %s" % args.trace)
+
+
     ###########################################################################
     @requires_project_dir
     def run(self, args):
+        timer = PblBuildTimer()
+        try:
+            return self._run_waf(args, timer)
+        finally:
+            self._report_timings(args, timer)
+
+
+    ###########################################################################
+    def _run_waf(self, args, timer):
         self.add_arm_tools_to_path(args)
         
         # If python3 is the default and python2 is available, then plug in
@@ -206,7 +194,9 @@ class PblWafCommand(PblCommand):
             
         # Execute the build command
         cmdLine = '"%s" %s' % (self.waf_path(args), self.waf_cmds)
-        retval = subprocess.call(cmdLine, shell=True)
+        with timer.trace_tools():
+            with timer.phase('waf %s' % self.waf_cmds, 'waf'):
+                retval = subprocess.call(cmdLine, shell=True)
         
         # If an error occurred, we need to do some sleuthing to determine a
         # cause. This allows the caller to post more useful information to
@@ -241,9 +231,14 @@ class PblWafCommand(PblCommand):
             # Read in the appinfo.json to get the list of resources
             try:
                 appInfo = json.load(open("appinfo.json"))
-                self._send_memory_usage(args, appInfo)
-                self._send_resource_usage(args, appInfo)
-                self._send_line_counts(args, appInfo)
+                with timer.phase('memory usage', 'analytics'):
+                    self._send_memory_usage(args, appInfo)
+                with timer.phase('project scan', 'analytics'):
+                    scanner = PblProjectScanner().scan()
+                with timer.phase('resource usage', 'analytics'):
+                    self._send_resource_usage(args, appInfo, scanner)
+                with timer.phase('line counts', 'analytics'):
+                    self._send_line_counts(args, appInfo, scanner)
                 hasJS = os.path.exists(os.path.join('src', 'js'))
                 PblAnalytics.code_has_java_script_evt(uuid=appInfo["uuid"],
                                          hasJS=hasJS)
@@ -257,6 +252,11 @@ class PblWafCommand(PblCommand):
     ###########################################################################
     def configure_subparser(self, parser):
         PblCommand.configure_subparser(self, parser)
+        parser.add_argument('--timings', action='store_true',
+                help='Print how long each build phase took')
+        parser.add_argument('--trace', type=str, metavar='FILE',
+                help='Write the build phase timings to FILE as a Chrome '
+                     'trace (load it in chrome://tracing)')
 
 
 ###########################################################################
@@ -284,6 +284,15 @@ class PblAnalyzeSizeCommand(PblCommand):
                 help='Path to the elf file to analyze')
         parser.add_argument('--summary', action='store_true', help='Display a single line per section')
         parser.add_argument('--verbose', action='store_true', help='Display a per-symbol breakdown')
+        parser.add_argument('--top', type=int, default=0, metavar='N',
+                help='Also list the N largest symbols of each section')
+        parser.add_argument('--snapshot', type=str,
+                help='Save the sizes to this file, to --compare against later')
+        parser.add_argument('--compare', type=str,
+                help='Show the changes since the sizes saved in this snapshot')
+        parser.add_argument('--budget', type=str, action='append', default=[],
+                help='Fail if a section grew more than allowed since the --compare snapshot, '
+                     'e.g. text=512 or bss=2%%. May be given once per section.')
 
     @requires_project_dir
     def run(self, args):
@@ -292,9 +301,34 @@ class PblAnalyzeSizeCommand(PblCommand):
 
         import binutils
 
-        sections = binutils.analyze_elf(args.elf_path, 'bdt', use_fast_nm=True)
+        budgets = [binutils.parse_size_budget(x) for x in args.budget]
+        if budgets and args.compare is None:
+            logging.error("--budget needs a snapshot to --compare against")
+            return 1
+
+        table = binutils.symbol_table(args.elf_path, use_fast_nm=True)
+        sections = table.section_infos('bdt')
+        if args.top:
+            table.pprint_largest(args.top, 'tdb')
+
+        if args.snapshot is not None:
+            binutils.write_size_snapshot(args.snapshot, {args.elf_path: sections})
+
+        if args.compare is None:
+            for s in sections.itervalues():
+                s.pprint(args.summary, args.verbose)
+            return
+
+        old_sections = binutils.snapshot_sections_for(
+                binutils.read_size_snapshot(args.compare), args.elf_path, args.compare)
+        diffs = binutils.diff_sections(old_sections, sections)
+        for d in diffs.itervalues():
+            d.pprint(args.summary, args.verbose)
 
-        for s in sections.itervalues():
-            s.pprint(args.summary, args.verbose)
+        violations = binutils.size_budget_violations(diffs, budgets)
+        for violation in violations:
+            logging.error("Size budget exceeded: {}".format(violation))
+        if violations:
+            return 1
 
 
@@ -0,0 +1,145 @@
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+
+# The SDK's resource tools (bitmapgen, fontgen, pbpack, ...) append their
+# own timing records to the file named by build_trace.TRACE_ENV_VAR. See
+# Pebble/common/tools/build_trace.py for the record format.
+TOOLS_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'tools'))
+if TOOLS_PATH not in sys.path:
+    sys.path.append(TOOLS_PATH)
+
+from build_trace import TRACE_ENV_VAR, cpu_time
+
+
+####################################################################
+####################################################################
+class PblBuildTimer(object):
+    """ Records wall and CPU time for each phase of a build, along with the
+    records written by the resource tools waf runs, and exports them as a
+    Chrome trace (chrome://tracing) or a summary table. """
+
+    ####################################################################
+    def __init__(self):
+        self.events = []
+        self._tool_trace_path = None
+
+
+    ####################################################################
+    @contextmanager
+    def phase(self, name, category='build', **args):
+        """ Time the body of the with statement as one phase """
+
+        start = time.time()
+        start_cpu = cpu_time()
+        try:
+            yield
+        finally:
+            self.events.append({'name': name,
+                                'cat': category,
+                                'ts': start,
+                                'wall': time.time() - start,
+                                'cpu': cpu_time() - start_cpu,
+                                'pid': os.getpid(),
+                                'args': args})
+
+
+    ####################################################################
+    @contextmanager
+    def trace_tools(self):
+        """ Have the SDK tools run within the with statement record their
+        own phases, and collect them afterwards """
+
+        (fd, self._tool_trace_path) = tempfile.mkstemp(prefix='pebble-build-',
+                                                       suffix='.trace')
+        os.close(fd)
+        previous = os.environ.get(TRACE_ENV_VAR)
+        os.environ[TRACE_ENV_VAR] = self._tool_trace_path
+        try:
+            yield
+        finally:
+            if previous is None:
+                del os.environ[TRACE_ENV_VAR]
+            else:
+                os.environ[TRACE_ENV_VAR] = previous
+            self._load_tool_events()
+
+
+    ####################################################################
+    def _load_tool_events(self):
+        try:
+            with open(self._tool_trace_path) as fd:
+                for line in fd:
+                    try:
+                        self.events.append(json.loads(line))
+                    except ValueError:
+                        # A tool killed mid-write leaves a partial line
+                        logging.debug("Ignoring bad trace record: %r" % line)
+        finally:
+            os.remove(self._tool_trace_path)
+            self._tool_trace_path = None
+
+
+    ####################################################################
+    def chrome_trace(self):
+        """ Return the events in Chrome's trace event format. Each process
+        gets its own row, so parallel tool runs show up side by side. """
+
+        events = sorted(self.events, key=lambda e: e['ts'])
+        origin = events[0]['ts'] if events else 0
+        trace_events = []
+        for e in events:
+            args = dict(e['args'])
+            args['cpu_ms'] = round(e['cpu'] * 1000, 3)
+            trace_events.append({'name': e['name'],
+                                 'cat': e['cat'],
+                                 'ph': 'X',
+                                 'ts': int((e['ts'] - origin) * 1e6),
+                                 'dur': int(e['wall'] * 1e6),
+                                 'pid': e['pid'],
+                                 'tid': e['pid'],
+                                 'args': args})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+    ####################################################################
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as fd:
+            json.dump(self.chrome_trace(), fd)
+
+
+    ####################################################################
+    def summary(self):
+        """ Return a table of the phases, slowest first. Repeated phases
+        (e.g. one bitmapgen run per image) are totalled together. """
+
+        totals = {}
+        for e in self.events:
+            total = totals.setdefault(e['name'], {'count': 0, 'wall': 0.0,
+                                                  'cpu': 0.0, 'max': 0.0,
+                                                  'slowest': ''})
+            total['count'] += 1
+            total['wall'] += e['wall']
+            total['cpu'] += e['cpu']
+            if e['wall'] >= total['max']:
+                total['max'] = e['wall']
+                total['slowest'] = e['args'].get('file', '')
+
+        name_width = max([len(name) for name in totals] + [len('phase')])
+        row = "{:<%d} {:>5} {:>9} {:>9} {:>9}  {}" % name_width
+        lines = [row.format('phase', 'runs', 'wall (s)', 'cpu (s)', 'max (s)',
+                            'slowest')]
+        for (name, total) in sorted(totals.iteritems(),
+                                    key=lambda item: -item[1]['wall']):
+            lines.append(row.format(name, total['count'],
+                                    '%.3f' % total['wall'],
+                                    '%.3f' % total['cpu'],
+                                    '%.3f' % total['max'],
+                                    total['slowest']))
+        return '\n'.join(lines)
@@ -0,0 +1,172 @@
+
+import json
+import logging
+import os
+
+
+# Source file extensions we count lines for, and the language they count as
+SOURCE_LANGUAGES = {'.h': 'c', '.c': 'c', '.js': 'js'}
+
+# Where the scanner keeps its per-file line counts between builds
+CACHE_FILE = os.path.join('build', '.pbl_scan_cache.json')
+CACHE_VERSION = 1
+
+
+####################################################################
+def _count_file_lines(path):
+    """ Count the lines in a file the same way iterating over it would,
+    i.e. a trailing line without a newline still counts as a line """
+
+    lines = 0
+    last = ''
+    with open(path, 'rb') as fd:
+        while True:
+            chunk = fd.read(65536)
+            if not chunk:
+                break
+            lines += chunk.count('\n')
+            last = chunk[-1]
+    if last and last != '\n':
+        lines += 1
+    return lines
+
+
+####################################################################
+####################################################################
+class PblProjectScanner(object):
+    """ Walks a project's src and build/resources trees once, collecting
+    source line counts and generated resource sizes together.
+
+    Line counts are cached per file, keyed by mtime and size, in
+    build/.pbl_scan_cache.json so repeated builds only re-read the files
+    that changed.
+    """
+
+    ####################################################################
+    def __init__(self, project_dir='.'):
+        self.project_dir = project_dir
+        self.line_counts = {'c': 0, 'js': 0}
+        self.resources = {}
+        self._cache = None
+        self._cache_dirty = False
+
+
+    ####################################################################
+    def _path(self, *parts):
+        return os.path.join(self.project_dir, *parts)
+
+
+    ####################################################################
+    def _load_cache(self):
+        self._cache = {}
+        try:
+            with open(self._path(CACHE_FILE)) as fd:
+                contents = json.load(fd)
+            if contents.get('version') == CACHE_VERSION:
+                self._cache = contents['files']
+        except (IOError, ValueError, KeyError, AttributeError):
+            pass
+
+
+    ####################################################################
+    def _save_cache(self):
+        if not self._cache_dirty or not os.path.isdir(self._path('build')):
+            return
+        try:
+            with open(self._path(CACHE_FILE), 'w') as fd:
+                json.dump({'version': CACHE_VERSION, 'files': self._cache}, fd)
+            self._cache_dirty = False
+        except IOError as e:
+            logging.debug("Could not write scan cache: %s" % str(e))
+
+
+    ####################################################################
+    def _cached_line_count(self, path):
+        """ Return the number of lines in path, reading the file only if
+        its mtime or size changed since the last scan """
+
+        st = os.stat(path)
+        key = [st.st_mtime, st.st_size]
+        entry = self._cache.get(path)
+        if entry is not None and entry[:2] == key:
+            return entry[2]
+
+        lines = _count_file_lines(path)
+        self._cache[path] = key + [lines]
+        self._cache_dirty = True
+        return lines
+
+
+    ####################################################################
+    def _scan_sources(self):
+        """ Count C and JS lines under src in one walk. Names starting with
+        '.' are skipped and symlinked directories are not followed. """
+
+        seen = set()
+        for dirpath, dirnames, filenames in os.walk(self._path('src')):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                language = SOURCE_LANGUAGES.get(os.path.splitext(name)[1])
+                if language is None:
+                    continue
+                path = os.path.join(dirpath, name)
+                seen.add(path)
+                self.line_counts[language] += self._cached_line_count(path)
+
+        # Forget files that no longer exist so the cache doesn't grow forever
+        for path in self._cache.keys():
+            if path not in seen:
+                del self._cache[path]
+                self._cache_dirty = True
+
+
+    ####################################################################
+    def _scan_resources(self, rel_dir=''):
+        """ Index build/resources as {relative dir: [(name, size), ...]},
+        keeping each directory's listing order """
+
+        dir_path = self._path('build', 'resources', rel_dir)
+        if not os.path.isdir(dir_path):
+            return
+        entries = []
+        for name in os.listdir(dir_path):
+            path = os.path.join(dir_path, name)
+            if os.path.isdir(path):
+                self._scan_resources(os.path.join(rel_dir, name))
+            else:
+                entries.append((name, os.path.getsize(path)))
+        self.resources[rel_dir] = entries
+
+
+    ####################################################################
+    def scan(self):
+        """ Scan the project and return self """
+
+        self._load_cache()
+        if os.path.exists(self._path('src')):
+            self._scan_sources()
+        self._scan_resources()
+        self._save_cache()
+        return self
+
+
+    ####################################################################
+    def generated_resource_size(self, res_file, raw):
+        """ Return the size of the generated blob for the resource at
+        res_file, or None if there isn't one.
+
+        Raw resources are copied under their own name. Everything else
+        gets the original filename plus an extension (or, for fonts, a
+        name and extension) appended to it.
+        """
+
+        (dir_name, file_name) = os.path.split(res_file)
+        for (name, size) in self.resources.get(os.path.normpath(dir_name)
+                                               if dir_name else '', []):
+            if (raw and name == file_name) \
+                or (not raw and name.startswith(file_name)
+                    and name != file_name):
+                return size
+        return None
@@ -4,6 +4,9 @@ import time
 import socket
 import select
 import os
+from collections import deque
+
+from framing import QemuFramer
 
 # These protocol IDs are defined in qemu_serial.h in the tintin project
 QemuProtocol_SPP = 1                    # Send SPP data (used for Pebble protocol)
@@ -32,7 +35,11 @@ class QemuPebble(object):
         self.hdr_size = struct.calcsize(self.hdr_format)
         self.footer_size = struct.calcsize(self.footer_format)
         self.max_packet_size = QEMU_MAX_DATA_LEN + self.hdr_size + self.footer_size
-        self.assembled_data = ''
+        # Read as much as is waiting, so a burst of packets takes one recv
+        self.recv_size = 64 * 1024
+        self.framer = QemuFramer(QEMU_HEADER_SIGNATURE, QEMU_MAX_DATA_LEN,
+                                 self.hdr_format, self.footer_format)
+        self.pending_packets = deque()
         self.trace_enabled = False
 
     def enable_trace(self, setting):
@@ -81,57 +88,42 @@ class QemuPebble(object):
             if source is 'qemu', then topic is the QemuProtocol_.* enum
 
         """
+        # Hand out packets already received in an earlier burst before
+        # waiting on the socket again
+        if not self.pending_packets:
+            self._receive()
+        if not self.pending_packets:
+            return (None, None, None, None)
+
+        (protocol, data) = self.pending_packets.popleft()
+
+        # Ignore everything but SPP protocol for now
+        if protocol == QemuProtocol_SPP:
+            return ('watch', 'Pebble Protocol', data, data)
+        else:
+            return ('qemu', protocol, data, data)
+
+    def _receive(self):
+        """ Wait for data from the emulator and queue up every complete packet in it """
         # socket timeouts for asynchronous operation is normal.  In this
-        # case we shall return all None to let the caller know.
+        # case we just return with nothing queued.
         try:
             readable, writable, errored = select.select([self.socket], [], [], self.timeout)
         except select.error:
-            return (None, None, None, None)
+            return
 
         if not readable:
-            return (None, None, None, None)
+            return
 
-        data = self.socket.recv(self.max_packet_size)
+        data = self.socket.recv(self.recv_size)
         if not data:
             logging.error("emulator disconnected")
             os._exit(-1)
 
         if self.trace_enabled:
             logging.debug('rcv<<< ' + data.encode('hex'))
-        self.assembled_data += data
-
-        # Look for a complete packet
-        while len(self.assembled_data) >= self.hdr_size:
-            (signature, protocol, data_len) = struct.unpack(self.hdr_format,
-                                                      self.assembled_data[0:self.hdr_size])
-            if signature != QEMU_HEADER_SIGNATURE:
-                self.assembled_data = self.assembled_data[1:]
-                logging.debug("Skipping garbage byte")
-                continue
-
-            # Check for valid data len
-            if data_len > QEMU_MAX_DATA_LEN:
-                logging.warning("Invalid packet len detected: %d" % data_len)
-                # Skip past this header and look for another one
-                self.assembled_data = self.assembled_data[1:]
-                continue
-
-            # If not a complete packet, break out
-            if len(self.assembled_data) < self.hdr_size + data_len + self.footer_size:
-                break
-
-            # Pull out the packet
-            data = self.assembled_data[self.hdr_size:data_len+self.hdr_size]
-            self.assembled_data = self.assembled_data[self.hdr_size + data_len + self.footer_size:]
-
-            # Ignore everything but SPP protocol for now
-            if protocol == QemuProtocol_SPP:
-                return ('watch', 'Pebble Protocol', data, data)
-            else:
-                return ('qemu', protocol, data, data)
-
-        # If we broke out, we don't have a complete packet yet
-        return (None, None, None, None)
+        self.framer.feed(data)
+        self.pending_packets.extend(self.framer.packets())
 
     def close(self):
         """ Closes the socket connection. """
@@ -0,0 +1,141 @@
+import logging
+import struct
+
+
+class ByteBuffer(object):
+    """
+    A bytearray with a read cursor, for reassembling packets from a stream.
+
+    Consuming data only moves the cursor. The consumed bytes are dropped when new
+    data is fed in and they make up at least half the buffer, so every byte is
+    moved at most once on average no matter how many packets it is split into.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._data) - self._pos
+
+    def feed(self, data):
+        if self._pos and self._pos * 2 >= len(self._data):
+            self._compact()
+        try:
+            self._data.extend(data)
+        except BufferError:
+            # Someone still holds a view of a packet; leave them the old bytearray.
+            self._data = self._data[self._pos:] + data
+            self._pos = 0
+
+    def _compact(self):
+        try:
+            del self._data[:self._pos]
+        except BufferError:
+            self._data = self._data[self._pos:]
+        self._pos = 0
+
+    def unpack_from(self, fmt, offset=0):
+        """ struct-unpack the (pre-compiled) struct.Struct fmt at offset without copying """
+        return fmt.unpack_from(self._data, self._pos + offset)
+
+    def find(self, sub, start=0):
+        index = self._data.find(sub, self._pos + start)
+        return index - self._pos if index >= 0 else -1
+
+    def view(self, offset, size):
+        """
+        A memoryview of size bytes at offset. It is only valid until the next feed();
+        use .tobytes() to keep the data.
+        """
+        start = self._pos + offset
+        return memoryview(self._data)[start:start + size]
+
+    def skip(self, count):
+        self._pos += min(count, len(self))
+
+
+class PebbleProtocolFramer(object):
+    """ Splits a stream of Pebble Protocol data into (endpoint, payload) frames. """
+
+    header = struct.Struct("!HH")
+
+    def __init__(self):
+        self.buffer = ByteBuffer()
+
+    def feed(self, data):
+        self.buffer.feed(data)
+
+    def frames(self):
+        """
+        Yields (endpoint, payload) for every complete frame received so far. Payloads
+        are memoryviews into the buffer, only valid until the next feed().
+        """
+        # This is on the path of every byte received, so it works on the
+        # buffer's internals directly rather than through its methods.
+        buf = self.buffer
+        data = buf._data
+        unpack_from = self.header.unpack_from
+        header_size = self.header.size
+        end = len(data)
+        pos = buf._pos
+        view = memoryview(data)
+        while end - pos >= header_size:
+            size, endpoint = unpack_from(data, pos)
+            start = pos + header_size
+            pos = start + size
+            if pos > end:
+                return
+            buf._pos = pos
+            yield endpoint, view[start:pos]
+
+
+class QemuFramer(object):
+    """
+    Splits the stream from the emulator's serial socket into (protocol, payload)
+    packets, skipping over any garbage between them.
+    """
+
+    def __init__(self, header_signature, max_data_len, hdr_format="!HHH", footer_format="!H"):
+        self.buffer = ByteBuffer()
+        self.header = struct.Struct(hdr_format)
+        self.footer_size = struct.calcsize(footer_format)
+        self.signature = struct.pack("!H", header_signature)
+        self.max_data_len = max_data_len
+
+    def feed(self, data):
+        self.buffer.feed(data)
+
+    def _resync(self, start):
+        """ Drop everything before the next header signature at or after start """
+        buf = self.buffer
+        index = buf.find(self.signature, start)
+        if index < 0:
+            # Keep the last byte, it could be the first half of a signature
+            index = max(len(buf) - 1, 0)
+        if index:
+            logging.debug("Skipping %d garbage bytes" % index)
+        buf.skip(index)
+
+    def packets(self):
+        """ Yields (protocol, payload) for every complete packet received so far """
+        buf = self.buffer
+        header = self.header
+        while True:
+            self._resync(0)
+            if len(buf) < header.size:
+                return
+            (signature, protocol, data_len) = buf.unpack_from(header)
+            if data_len > self.max_data_len:
+                logging.warning("Invalid packet len detected: %d" % data_len)
+                # Skip past this header and look for another one
+                self._resync(1)
+                continue
+
+            # If not a complete packet, wait for more data
+            if len(buf) < header.size + data_len + self.footer_size:
+                return
+
+            payload = buf.view(header.size, data_len).tobytes()
+            buf.skip(header.size + data_len + self.footer_size)
+            yield protocol, payload
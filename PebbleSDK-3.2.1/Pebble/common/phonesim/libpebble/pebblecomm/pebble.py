@@ -12,12 +12,12 @@ import PebbleUtil as util
 import png
 import random
 import re
-import sh
 import signal
 import socket
 import speex
 import stm32_crc
 import struct
+import sys
 import threading
 import time
 import traceback
@@ -27,13 +27,16 @@ import QemuPebble
 import zipfile
 
 from AppStore import AppStoreClient
-from collections import OrderedDict
+from framing import PebbleProtocolFramer
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from struct import pack, unpack
 
 DEFAULT_PEBBLE_ID = None #Triggers autodetection on unix-like systems
 DEFAULT_WEBSOCKET_PORT = 9000
 DEBUG_PROTOCOL = False
 APP_ELF_PATH = 'build/pebble-app.elf'
+TOOLS_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'tools'))
 
 class PebbleHardware(object):
     UNKNOWN = 0
@@ -100,6 +103,11 @@ class PebbleBundle(object):
             '16s'   # uuid
     ]
 
+    # The last bundle opened with open(), as ((path, hardware), stamp, bundle).
+    # Only one is kept: installs go through one bundle at a time.
+    _cached = None
+    _cache_lock = threading.Lock()
+
     def __init__(self, bundle_path, hardware=PebbleHardware.UNKNOWN):
         self.hardware = hardware
         bundle_abs_path = os.path.abspath(bundle_path)
@@ -107,26 +115,80 @@ class PebbleBundle(object):
             raise Exception("Bundle does not exist: " + bundle_path)
 
         self.zip = zipfile.ZipFile(bundle_abs_path)
+        self._zip_lock = threading.Lock()
         self.path = bundle_abs_path
         self.manifest = None
         self.header = None
         self._zip_contents = set(self.zip.namelist())
+        self._real_paths = {}
 
         self.app_metadata_struct = struct.Struct(''.join(self.STRUCT_DEFINITION))
         self.app_metadata_length_bytes = self.app_metadata_struct.size
 
         self.print_pbl_logs = False
 
+    @classmethod
+    def open(cls, bundle_path, hardware=PebbleHardware.UNKNOWN):
+        """
+        Returns a PebbleBundle for bundle_path, reusing the one opened earlier
+        (with its parsed manifest and metadata) if the file hasn't changed since.
+        """
+        bundle_abs_path = os.path.abspath(bundle_path)
+        if not os.path.exists(bundle_abs_path):
+            raise Exception("Bundle does not exist: " + bundle_path)
+        stat = os.stat(bundle_abs_path)
+        stamp = (stat.st_mtime, stat.st_size)
+        key = (bundle_abs_path, hardware)
+
+        with cls._cache_lock:
+            if cls._cached is not None and cls._cached[:2] == (key, stamp):
+                return cls._cached[2]
+            # The bundle this replaces isn't closed: another caller or a preload
+            # thread may still be reading it, and it closes its zip once collected.
+            bundle = cls(bundle_abs_path, hardware)
+            cls._cached = (key, stamp, bundle)
+        return bundle
+
     def get_real_path(self, path):
         if path in self.UNIVERSAL_FILES:
             return path
-        else:
+        if path not in self._real_paths:
+            self._real_paths[path] = None
             prefixes = PebbleHardware.prefixes_for_hardware(self.hardware)
             for prefix in prefixes:
                 real_path = prefix + path
                 if real_path in self._zip_contents:
-                    return real_path
-            return None
+                    self._real_paths[path] = real_path
+                    break
+        return self._real_paths[path]
+
+    def read(self, path):
+        """ Returns the contents of the zip member path """
+        # ZipFile shares one file handle between all its members
+        with self._zip_lock:
+            return self.zip.read(path)
+
+    def preload(self, paths):
+        """
+        Starts inflating and CRCing the zip members paths, in order, on a
+        background thread. Returns a Completion per path, whose result is
+        (data, crc), so the next part is ready by the time the current
+        transfer finishes.
+        """
+        completions = [Completion() for _ in paths]
+
+        def load():
+            for path, completion in zip(paths, completions):
+                try:
+                    data = self.read(path)
+                    completion.set_result((data, stm32_crc.crc32(data)))
+                except Exception as e:
+                    completion.set_error(e)
+
+        thread = threading.Thread(target=load, name="bundle preload")
+        thread.setDaemon(True)
+        thread.start()
+        return completions
 
 
     def get_manifest(self):
@@ -136,7 +198,7 @@ class PebbleBundle(object):
         if self.MANIFEST_FILENAME not in self.zip.namelist():
             raise Exception("Could not find {}; are you sure this is a PebbleBundle?".format(self.MANIFEST_FILENAME))
 
-        self.manifest = json.loads(self.zip.read(self.get_real_path(self.MANIFEST_FILENAME)))
+        self.manifest = json.loads(self.read(self.get_real_path(self.MANIFEST_FILENAME)))
         return self.manifest
 
     def get_app_metadata(self):
@@ -145,9 +207,9 @@ class PebbleBundle(object):
 
         app_manifest = self.get_manifest()['application']
 
-        app_bin = self.zip.open(app_manifest['name']).read()
-
-        header = app_bin[0:self.app_metadata_length_bytes]
+        # Only inflate as much of the binary as the header needs
+        with self._zip_lock:
+            header = self.zip.open(app_manifest['name']).read(self.app_metadata_length_bytes)
         values = self.app_metadata_struct.unpack(header)
         self.header = {
                 'sentinel' : values[0],
@@ -222,38 +284,137 @@ class PebbleBundle(object):
         return self.get_real_path(self.get_worker_info()['name'])
 
 
+class Completion(object):
+    """
+    The outcome of something the reader thread finishes on our behalf: the
+    endpoint handler calls set_result() or set_error(), the waiting thread
+    calls result().
+
+    Waiting wakes within 50ms of the handler completing it, without spinning.
+    It is done in slices of wait_slice seconds, because Python 2 doesn't
+    deliver Ctrl-C to a thread blocked in an untimed Event.wait. A wait that
+    times out completes with a PebbleTimeoutError, so timeouts are reported
+    separately from errors the handler set.
+    """
+
+    wait_slice = 0.5
+
+    def __init__(self, timeout_message="Timed out... Is the Pebble phone app connected/direct BT connection up?"):
+        self.timeout_message = timeout_message
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._error = None
+
+    def _complete(self, result, error):
+        """ Only the first outcome counts """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._result = result
+            self._error = error
+            self._event.set()
+            return True
+
+    def set_result(self, result=None):
+        return self._complete(result, None)
+
+    def set_error(self, error):
+        return self._complete(None, error)
+
+    def _expire(self):
+        self.set_error(PebbleTimeoutError(None, self.timeout_message))
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait_until(self, deadline):
+        """ Blocks until completed or time.time() reaches deadline, and returns whether it completed """
+        while not self._event.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._event.wait(min(remaining, self.wait_slice))
+        return True
+
+    def wait(self, timeout=None):
+        """ Blocks until completed, or timed out after timeout seconds """
+        if timeout is None:
+            while not self.wait_until(time.time() + self.wait_slice):
+                pass
+        elif not self.wait_until(time.time() + timeout):
+            self._expire()
+
+    def result(self, timeout=None):
+        """ Returns the result, or raises the error or a PebbleTimeoutError """
+        self.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def _screenshot_bits_table():
+    """ Each byte of a 1-bit image as its eight pixels, 0 or 1, LSB first """
+    return [''.join(chr(byte >> bit & 0x01) for bit in xrange(8)) for byte in xrange(256)]
+
+def _screenshot_channel_table(shift):
+    """ A str.translate table taking an 8-bit pixel to one of its colour channels """
+    return ''.join(chr((pixel >> shift & 0x03) * 85) for pixel in xrange(256))
+
+
 class ScreenshotSync():
     timeout = 60
     SCREENSHOT_OK = 0
     SCREENSHOT_MALFORMED_COMMAND = 1
     SCREENSHOT_OOM_ERROR = 2
 
+    # Image format version -> bits per pixel
+    BITS_PER_PIXEL = {
+        1: 1,  # black and white, LSB first
+        2: 8,  # 0bAARRGGBB
+    }
+
+    BYTE_TO_BITS = _screenshot_bits_table()
+
+    # The red, green and blue of each 8-bit pixel
+    PIXEL_TO_CHANNEL = [_screenshot_channel_table(shift) for shift in (4, 2, 0)]
+
     def __init__(self, pebble, endpoint, progress_callback):
-        self.marker = threading.Event()
-        self.data = ''
+        self.completion = Completion()
+        self.data = None
         self.have_read_header = False
-        self.length_received = 0
+        self.bytes_received = 0
         self.progress_callback = progress_callback
         pebble.register_endpoint(endpoint, self.message_callback)
 
     # Received a reply message from the watch. We expect several of these...
     def message_callback(self, endpoint, data):
-        if not self.have_read_header:
-            data = self.read_header(data)
-            self.have_read_header = True
+        try:
+            if not self.have_read_header:
+                data = self.read_header(data)
+                self.have_read_header = True
+                if len(self.data) == 0:
+                    # A 0x0 image has no pixels to wait for
+                    self.completion.set_result()
+                    return
 
-        self.data += data
-        self.length_received += len(data) * 8 # in bits
-        self.progress_callback(float(self.length_received)/self.total_length)
-        if self.length_received >= self.total_length:
-            self.marker.set()
+            # Drop anything past the end of the image rather than growing the buffer
+            end = min(self.bytes_received + len(data), len(self.data))
+            self.data[self.bytes_received:end] = data[:end - self.bytes_received]
+            self.bytes_received = end
+            self.progress_callback(float(self.bytes_received) / len(self.data))
+        except PebbleError as e:
+            self.completion.set_error(e)
+            return
+        if self.bytes_received >= len(self.data):
+            self.completion.set_result()
 
     def read_header(self, data):
         image_header = struct.Struct("!BIII")
         header_len = image_header.size
         header_data = data[:header_len]
         data = data[header_len:]
-        response_code, version, self.width, self.height = \
+        response_code, self.version, self.width, self.height = \
           image_header.unpack(header_data)
 
         if response_code is not ScreenshotSync.SCREENSHOT_OK:
@@ -261,43 +422,34 @@ class ScreenshotSync():
                 "code %d, signaling an error on the watch side." %
                 response_code)
 
-        if version is not 1:
+        if self.version not in self.BITS_PER_PIXEL:
             raise PebbleError(None, "Received unrecognized image format "
                 "version %d from watch. Maybe your libpebble is out of "
-                "sync with your firmware version?" % version)
+                "sync with your firmware version?" % self.version)
 
-        self.total_length = self.width * self.height
+        total_bits = self.width * self.height * self.BITS_PER_PIXEL[self.version]
+        self.data = bytearray((total_bits + 7) // 8)
         return data
 
     def get_data_array(self):
-        """ splits data in pure binary into a 2D array of bits of length N """
-        # break data into bytes
-        data_bytes_iter = (ord(ch) for ch in self.data)
-
-        # separate each byte into 8 one-bit entries - IE, 0xf0 --> [1,1,1,1,0,0,0,0]
-        data_bits_iter = (byte >> bit_order & 0x01
-            for byte in data_bytes_iter for bit_order in xrange(8))
-
-        # pack 1-d bit array of size w*h into h arrays of size w, pad w/ zeros
-        output_bitmap = []
-        while True:
-            try:
-                new_row = []
-                for _ in xrange(self.width):
-                    new_row.append(data_bits_iter.next())
-                output_bitmap.append(new_row)
-            except StopIteration:
-                # add part of the last row anyway
-                if new_row:
-                    output_bitmap.append(new_row)
-                return output_bitmap
+        """ splits a 1-bit image into a list of rows of 0s and 1s """
+        pixels = bytearray(''.join(map(self.BYTE_TO_BITS.__getitem__, self.data)))
+        return [pixels[i:i + self.width] for i in xrange(0, self.width * self.height, self.width)]
+
+    def get_rgb_array(self):
+        """ splits an 8-bit image into a list of rows of R, G, B values """
+        pixels = str(self.data)
+        rgb = bytearray(len(pixels) * 3)
+        for channel, table in enumerate(self.PIXEL_TO_CHANNEL):
+            rgb[channel::3] = pixels.translate(table)
+        row_len = self.width * 3
+        return [rgb[i:i + row_len] for i in xrange(0, len(rgb), row_len)]
 
     def get_data(self):
-        try:
-            self.marker.wait(timeout=self.timeout)
+        self.completion.result(self.timeout)
+        if self.version == 1:
             return png.from_array(self.get_data_array(), mode='L;1')
-        except:
-            raise PebbleError(None, "Timed out... Is the Pebble phone app connected/direct BT connection up?")
+        return png.from_array(self.get_rgb_array(), mode='RGB;8')
 
 
 class CoreDumpSync():
@@ -318,17 +470,62 @@ class CoreDumpSync():
     COREDUMP_CMD_RSP_CORE_DUMP_IMAGE_DATA = 2
     COREDUMP_TRANSACTION_ID = 0x42
 
-    def __init__(self, pebble, endpoint, progress_callback):
-        self.marker = threading.Event()
-        self.data = ''
+    def __init__(self, pebble, endpoint, progress_callback, path=None):
+        """
+        Downloads into memory, or straight into the file at path if given. A
+        download to a file that was interrupted keeps the bytes it got, as
+        recorded in progress_path(path), as long as they match what the
+        watch sends this time.
+        """
+        self.completion = Completion()
+        self.path = path
+        self.file = None
+        self.data = None
         self.have_read_header = False
         self.length_received = 0
+        self.resume_offset = 0
+        self.resume_length = None
+        self.start_time = None
+        self.bytes_per_second = 0.0
         self.progress_callback = progress_callback
         self.error_code = 0;
+        if path is not None:
+            self._load_progress()
         pebble.register_endpoint(endpoint, self.message_callback)
 
+    @staticmethod
+    def progress_path(path):
+        return path + '.progress'
+
+    def _load_progress(self):
+        try:
+            with open(self.progress_path(self.path)) as f:
+                progress = json.load(f)
+            if os.path.exists(self.path):
+                self.resume_offset = progress['offset']
+                self.resume_length = progress['total_length']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def _save_progress(self):
+        """ Records how much of the file is good, so the next download can pick up from there """
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        with open(self.progress_path(self.path), 'w') as f:
+            json.dump({'total_length': self.total_length,
+                       'offset': max(self.length_received, self.resume_offset)}, f)
+
     # Received a reply message from the watch. We expect several of these...
     def message_callback(self, endpoint, data):
+        try:
+            self._handle_message(data)
+        except (PebbleError, IOError) as e:
+            self._save_progress()
+            self.completion.set_error(e if isinstance(e, PebbleError) else PebbleError(None, str(e)))
+
+    def _handle_message(self, data):
         if not self.have_read_header:
             self.read_header(data)
             self.have_read_header = True
@@ -353,12 +550,70 @@ class CoreDumpSync():
             raise PebbleError(None, "Expected next data with byte offset 0x%x but got byte offset 0x%x" %
                               (self.length_received, byte_offset))
 
-        self.data += data
-        self.length_received += len(data)
-        print "received 0x%x bytes, length received: 0x%x" % (len(data), self.length_received)
+        end = byte_offset + len(data)
+        if end > self.total_length:
+            self.error_code = -1
+            raise PebbleError(None, "Pebble sent data up to byte offset 0x%x of a 0x%x byte core dump" %
+                              (end, self.total_length))
+
+        # Anything before resume_offset is already on disk from an earlier
+        # download. The watch sends it again anyway, so check it matches
+        # rather than trusting that it was the same core dump.
+        skip = 0
+        if byte_offset < self.resume_offset:
+            skip = min(self.resume_offset - byte_offset, len(data))
+            self.file.seek(byte_offset)
+            if self.file.read(skip) != data[:skip]:
+                log.warning("%s holds a different core dump, downloading from scratch" % self.path)
+                self.resume_offset = 0
+                skip = 0
+        if skip < len(data):
+            self._store(byte_offset + skip, data[skip:])
+        self.length_received = end
+
+        elapsed = time.time() - self.start_time
+        self.bytes_per_second = self.length_received / elapsed if elapsed else 0.0
+        log.debug("received 0x%x bytes at offset 0x%x (%.1f KB/s)" %
+                  (len(data), byte_offset, self.bytes_per_second / 1024))
         self.progress_callback(float(self.length_received) / self.total_length)
         if self.length_received >= self.total_length:
-            self.marker.set()
+            log.info("Received 0x%x byte core dump in %.1fs (%.1f KB/s)" %
+                     (self.total_length, elapsed, self.bytes_per_second / 1024))
+            self.completion.set_result(self._finish())
+
+    def _store(self, offset, data):
+        if self.file is not None:
+            self.file.seek(offset)
+            self.file.write(data)
+        else:
+            self.data[offset:offset + len(data)] = data
+
+    def _finish(self):
+        if self.file is None:
+            return str(self.data)
+        self.file.close()
+        self.file = None
+        if os.path.exists(self.progress_path(self.path)):
+            os.remove(self.progress_path(self.path))
+        return self.path
+
+    def _open(self):
+        """ Sets up the buffer or file the core dump is written into, once its length is known """
+        self.start_time = time.time()
+        if self.path is None:
+            self.data = bytearray(self.total_length)
+            return
+
+        if self.resume_length != self.total_length:
+            # Nothing downloaded yet, or it was from a different core dump
+            self.resume_offset = 0
+        elif self.resume_offset:
+            # The watch always sends the image from the start, so the bytes up
+            # to resume_offset are checked against it as they arrive.
+            log.info("Resuming core dump download into %s from offset 0x%x" % (self.path, self.resume_offset))
+        self.file = open(self.path, 'r+b' if self.resume_offset else 'wb')
+        # Preallocate the whole file (sparsely, where the filesystem allows)
+        self.file.truncate(self.total_length)
 
     def read_header(self, data):
         core_dump_header = struct.Struct("!BBBI")
@@ -369,9 +624,10 @@ class CoreDumpSync():
             core_dump_header.unpack(header_data)
 
         if response_code == self.response_codes["DOES_NOT_EXIST"]:
+            self.error_code = response_code
             raise PebbleError(None, "No coredumps found on watch")
 
-        print "total length of core dump: 0x%x" % (self.total_length)
+        log.info("total length of core dump: 0x%x" % (self.total_length))
 
         if op_code != 1:
             self.error_code = -1
@@ -386,20 +642,16 @@ class CoreDumpSync():
             raise PebbleError(None, "Pebble responded with nonzero response "
                 "code %d, signaling an error on the watch side." % response_code)
 
+        self._open()
         return data
 
     def get_data(self):
-        if self.error_code != 0:
-            raise PebbleError(None, "Received error code %d from Pebble" % (self.error_code))
+        """ Returns the core dump, or the path it was written to """
         try:
-            self.marker.wait(timeout=self.timeout_sec)
-            if self.length_received < self.total_length:
-                raise PebbleError(None, "Timed out... Is the Pebble phone app connected/direct BT connection up?")
-            return self.data
-        except:
-            print "Got Error"
-            raise PebbleError(None, "Timed out... Is the Pebble phone app connected/direct BT connection up?")
-        return None
+            return self.completion.result(self.timeout_sec)
+        except PebbleTimeoutError:
+            self._save_progress()
+            raise
 
 class AudioSync():
 
@@ -407,13 +659,25 @@ class AudioSync():
     MSG_ID_DATA = 0x02
     MSG_ID_STOP = 0x03
 
-    def __init__(self, pebble, endpoint, timeout=60):
+    def __init__(self, pebble, endpoint, timeout=60, filename=None):
+        """
+        Collects the recording's frames, or streams them to an Ogg/Speex file
+        if filename is given. Gives up once nothing has arrived for timeout
+        seconds.
+        """
         self.timeout = timeout
-        self.marker = threading.Event()
+        self.filename = filename
+        self.writer = None
+        # The writer is closed from get_data() if the recording times out
+        self.writer_lock = threading.Lock()
+        self.frames = []
+        self.completion = Completion()
         self.recording = False
+        self.last_packet_time = time.time()
         pebble.register_endpoint(endpoint, self.packet_callback)
 
     def packet_callback(self, endpoint, data):
+        self.last_packet_time = time.time()
         packet_id, = unpack('B', data[0])
         if packet_id == AudioSync.MSG_ID_START:
             self.process_start_packet(data)
@@ -427,6 +691,8 @@ class AudioSync():
         if encoder_id == 1:
             print 'Receiving audio data... Encoded with Speex {}'.format(data[10:30].strip())
         self.frames = []
+        if self.filename is not None:
+            self.writer = speex.OggSpeexWriter(self.filename, self.sample_rate)
         self.recording = True
 
     def process_data_packet(self, data):
@@ -434,55 +700,61 @@ class AudioSync():
         while index < len(data):
             frame_length, = unpack('B', data[index])
             index += 1
-            if self.recording:
+            if self.filename is not None:
+                with self.writer_lock:
+                    if self.writer is not None:
+                        self.writer.add_frame(data[index:index + frame_length])
+            elif self.recording:
                 self.frames.append(data[index:index + frame_length])
             index += frame_length
 
     def process_stop_packet(self, data):
-        self.marker.set()
         self.recording = False
+        self._close_writer()
+        self.completion.set_result()
+
+    def _close_writer(self):
+        with self.writer_lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
 
     def get_data(self):
+        """ Returns the frames and sample rate. The frames are empty if they were written to filename. """
         try:
-            self.marker.wait(self.timeout)
-            return self.frames, self.sample_rate
-        except:
-            raise PebbleError(None, "Timed out... Is the Pebble phone app connected/direct BT connection up?")
+            # Recordings can run for longer than the timeout, so it counts from the last packet
+            while not self.completion.wait_until(self.last_packet_time + self.timeout):
+                if time.time() - self.last_packet_time >= self.timeout:
+                    self.completion.set_error(PebbleTimeoutError(None, self.completion.timeout_message))
+            self.completion.result()
+        finally:
+            self._close_writer()
+        return self.frames, self.sample_rate
 
 class EndpointSync():
     def __init__(self, pebble, endpoint, timeout=10):
-        self.marker = threading.Event()
+        self.completion = Completion()
         self.timeout = timeout
         pebble.register_endpoint(endpoint, self.callback)
 
     def callback(self, endpoint, response):
-        self.data = response
-        self.marker.set()
+        self.completion.set_result(response)
 
     def get_data(self):
-        try:
-            self.marker.wait(timeout=self.timeout)
-            return self.data
-        except:
-            raise PebbleError(None, "Timed out... Is the Pebble phone app connected/direct BT connection up?")
+        return self.completion.result(self.timeout)
 
 class QemuEndpointSync():
     timeout = 10
 
     def __init__(self, pebble, endpoint_id):
-        self.marker = threading.Event()
+        self.completion = Completion("Timed out... Is QEMU connected?")
         pebble.register_qemu_endpoint(endpoint_id, self.callback)
 
     def callback(self, endpoint, response):
-        self.data = response
-        self.marker.set()
+        self.completion.set_result(response)
 
     def get_data(self):
-        try:
-            self.marker.wait(timeout=self.timeout)
-            return self.data
-        except:
-            raise PebbleError(None, "Timed out... Is QEMU connected?")
+        return self.completion.result(self.timeout)
 
 class PebbleError(Exception):
     def __init__(self, id, message):
@@ -492,6 +764,9 @@ class PebbleError(Exception):
     def __str__(self):
         return "%s (ID:%s)" % (self._message, self._id)
 
+class PebbleTimeoutError(PebbleError):
+    """ The watch (or the phone app, or QEMU) didn't answer in time """
+
 class Pebble(object):
     """
     A connection to a Pebble watch; data and commands may be sent
@@ -535,6 +810,16 @@ class Pebble(object):
             250: "V"
     }
 
+    # Seconds to wait for the watch to answer each step of an app install,
+    # and for each PutBytes transfer to complete
+    install_step_timeout = 10
+    install_transfer_timeout = 120
+
+    # PutBytes chunks kept in flight and their size, for every transfer (None
+    # uses PutBytesClient's defaults, one 2000 byte chunk at a time)
+    putbytes_window = None
+    putbytes_chunk_size = None
+
 
     @staticmethod
     def AutodetectDevice():
@@ -585,8 +870,11 @@ class Pebble(object):
         self._qemu_internal_endpoint_handlers = {
             QemuPebble.QemuProtocol_VibrationNotification: self._qemu_vibration_notification,
         }
-        self.pebble_protocol_reassembly_buffer = ''
+        self.pebble_protocol_framer = PebbleProtocolFramer()
         self.watch_fw_version = None
+        # Seconds spent in each phase of the last app install
+        self.install_timings = OrderedDict()
+        self._symbolizer = None
 
     def init_reader(self):
         try:
@@ -677,17 +965,13 @@ class Pebble(object):
             pass
 
     def _parse_received_pebble_protocol_data(self):
-        while True:
-            if len(self.pebble_protocol_reassembly_buffer) < 4:
-                return
-            header = self.pebble_protocol_reassembly_buffer[0:4]
-            tail = self.pebble_protocol_reassembly_buffer[4:]
-            size, endpoint = unpack("!HH", header)
-            if len(tail) < size:
-                return
-            payload = tail[0:size]
-            self.pebble_protocol_reassembly_buffer = self.pebble_protocol_reassembly_buffer[4 + size:]
+        for endpoint, view in self.pebble_protocol_framer.frames():
+            if endpoint not in self._internal_endpoint_handlers and endpoint not in self._endpoint_handlers:
+                continue
 
+            # The handlers slice, concatenate and hex-encode their payloads, which
+            # memoryviews can't do in python 2, so give them one copy each.
+            payload = view.tobytes()
             if endpoint in self._internal_endpoint_handlers:
                 payload = self._internal_endpoint_handlers[endpoint](endpoint, payload)
 
@@ -723,7 +1007,7 @@ class Pebble(object):
                         self._qemu_endpoint_handlers[endpoint](endpoint, resp)
 
                 elif source == 'watch':
-                    self.pebble_protocol_reassembly_buffer += resp
+                    self.pebble_protocol_framer.feed(resp)
                     self._parse_received_pebble_protocol_data()
 
                 else:
@@ -757,8 +1041,10 @@ class Pebble(object):
         if endpoint not in self.endpoints:
             raise PebbleError(self.id, "Invalid endpoint specified")
 
-        msg = self._build_message(self.endpoints[endpoint], data)
+        self._send_frame(self._build_message(self.endpoints[endpoint], data))
 
+    def _send_frame(self, msg):
+        """ Sends an already framed Pebble Protocol message """
         if DEBUG_PROTOCOL:
             log.debug('>>> ' + msg.encode('hex'))
 
@@ -832,11 +1118,12 @@ class Pebble(object):
         self._send_message("MUSIC_CONTROL", self._pack_message_data(16, parts))
 
     def screenshot(self, progress_callback):
+        session = ScreenshotSync(self, "SCREENSHOT", progress_callback)
         self._send_message("SCREENSHOT", "\x00")
-        return ScreenshotSync(self, "SCREENSHOT", progress_callback).get_data()
+        return session.get_data()
 
-    def coredump(self, progress_callback):
-        session = CoreDumpSync(self, "COREDUMP", progress_callback);
+    def coredump(self, progress_callback, path=None):
+        session = CoreDumpSync(self, "COREDUMP", progress_callback, path);
         self._send_message("COREDUMP", "%c%c" % (CoreDumpSync.COREDUMP_CMD_REQ_CORE_DUMP_IMAGE, CoreDumpSync.COREDUMP_TRANSACTION_ID))
         return session.get_data()
 
@@ -891,10 +1178,10 @@ class Pebble(object):
         This is particularly useful when trying to locate a
         free app-bank to use when installing a new watch-app.
         """
-        self._send_message("APP_MANAGER", "\x01")
-
-        if not async:
-            apps = EndpointSync(self, "APP_MANAGER").get_data()
+        if async:
+            self._send_message("APP_MANAGER", "\x01")
+        else:
+            apps = self._request("APP_MANAGER", "\x01")
             return apps if type(apps) is dict else { 'apps': [] }
 
     def remove_app(self, appid, index, async=False):
@@ -917,10 +1204,10 @@ class Pebble(object):
         # else, assume it's a byte array
 
         data = pack("b", 0x02) + str(uuid_to_remove)
-        self._send_message("APP_MANAGER", data)
-
-        if not async:
-            return EndpointSync(self, "APP_MANAGER").get_data()
+        if async:
+            self._send_message("APP_MANAGER", data)
+        else:
+            return self._request("APP_MANAGER", data)
 
     def get_time(self, async = False):
 
@@ -936,8 +1223,7 @@ class Pebble(object):
         """Decode and store audio data streamed from Pebble"""
 
         try:
-            frames, sample_rate = AudioSync(self, "AUDIO").get_data()
-            speex.store_data(frames, name, sample_rate)
+            AudioSync(self, "AUDIO", filename=name).get_data()
             print "Recording stored in", name
         except PebbleError as e:
             print e
@@ -956,8 +1242,7 @@ class Pebble(object):
         data = f.read()
         self._ser.write(data, ws_cmd=WebSocketPebble.WS_CMD_BUNDLE_INSTALL)
         self._ws_client.listen()
-        while not self._ws_client._received and not self._ws_client._error:
-            pass
+        self._ws_client.wait()
         if self._ws_client._topic == 'status' \
                 and self._ws_client._response == 0:
             log.info("Installation successful")
@@ -980,8 +1265,7 @@ class Pebble(object):
         data = pack("!b", 0)
         self._ser.write(data, ws_cmd=WebSocketPebble.WS_CMD_PHONE_INFO)
         self._ws_client.listen()
-        while not self._ws_client._received and not self._ws_client._error:
-          pass
+        self._ws_client.wait()
         if self._ws_client._topic == 'phoneInfo':
           return self._ws_client._response
         else:
@@ -989,19 +1273,25 @@ class Pebble(object):
           return 'Unknown'
 
     def install_app_pebble_protocol_2_x(self, pbw_path, launch_on_install=True):
-        device_version = self.get_versions()
+        self.install_timings = OrderedDict()
+        with self._install_phase("versions"):
+            device_version = self.get_versions()
         hardware_version = device_version['normal_fw']['hardware_platform']
 
-        bundle = PebbleBundle(pbw_path, hardware_version)
+        bundle = PebbleBundle.open(pbw_path, hardware_version)
         if not bundle.is_app_bundle():
             raise PebbleError(self.id, "This is not an app bundle")
+        parts = self._preload_app_parts(bundle)
 
         app_metadata = bundle.get_app_metadata()
-        self.remove_app_by_uuid(app_metadata['uuid'].bytes, uuid_is_string=False)
-        time.sleep(1)  # If this isn't here then the next operation may timeout if the app is already installed.
-
-        apps = self.get_appbank_status()
-        if not apps:
+        with self._install_phase("remove"):
+            self.remove_app_by_uuid(app_metadata['uuid'].bytes, uuid_is_string=False)
+
+        # A watch that is still busy removing the app can drop the request, so
+        # ask again rather than waiting out a fixed delay first.
+        with self._install_phase("appbank_status"):
+            apps = self._request("APP_MANAGER", "\x01", timeout=2, attempts=5)
+        if type(apps) is not dict or "banks" not in apps:
             raise PebbleError(self.id, "could not obtain app list; try again")
 
         first_free = 0
@@ -1012,60 +1302,32 @@ class Pebble(object):
             raise PebbleError(self.id, "All %d app banks are full" % apps["banks"])
         log.debug("Attempting to add app to bank %d of %d" % (first_free, apps["banks"]))
 
-        # Install the app code
-        app_info = bundle.get_application_info()
-        binary = bundle.zip.read(bundle.get_app_path())
-        if bundle.has_resources():
-            resources = bundle.zip.read(bundle.get_resource_path())
-        else:
-            resources = None
-
-        client = PutBytesClient(self, first_free, "BINARY", binary)
-        self.register_endpoint("PUTBYTES", client.handle_message)
-        client.init()
-        while not client._done and not client._error:
-            time.sleep(0.5)
-        if client._error:
-            raise PebbleError(self.id, "Failed to send application binary %s/pebble-app.bin" % pbw_path)
-
-        # Install the resources
-        if resources:
-            client = PutBytesClient(self, first_free, "RESOURCES", resources)
-            self.register_endpoint("PUTBYTES", client.handle_message)
-            client.init()
-            while not client._done and not client._error:
-                time.sleep(0.5)
-            if client._error:
-                raise PebbleError(self.id, "Failed to send application resources %s/app_resources.pbpack" % pbw_path)
-
-        # Is there a worker to install?
-        worker_info = bundle.get_worker_info()
-        if worker_info is not None:
-          binary = bundle.zip.read(bundle.get_worker_path())
-          client = PutBytesClient(self, first_free, "WORKER", binary)
-          self.register_endpoint("PUTBYTES", client.handle_message)
-          client.init()
-          while not client._done and not client._error:
-              time.sleep(0.5)
-          if client._error:
-              raise PebbleError(self.id, "Failed to send worker binary %s/%s" % (pbw_path, worker_info['name']))
-
+        self._put_app_parts(pbw_path, parts, first_free)
 
-        time.sleep(2)
-        self._add_app(first_free)
-        time.sleep(2)
+        with self._install_phase("add"):
+            result = self._add_app(first_free)
+        if result != "success":
+            raise PebbleError(self.id, "Failed to add app to bank %d: %s" % (first_free, result))
 
         if launch_on_install:
             self.launcher_message(app_metadata['uuid'].bytes, "RUNNING", uuid_is_string=False, async=True)
 
+        self._log_install_timings()
+
         # If we have not thrown an exception, we succeeded
         return True
 
     def install_app_pebble_protocol_3_x(self, pbw_path, launch_on_install=True):
+        self.install_timings = OrderedDict()
+        with self._install_phase("versions"):
+            device_version = self.get_versions()
+        hardware_version = device_version['normal_fw']['hardware_platform']
 
-        bundle = PebbleBundle(pbw_path)
+        bundle = PebbleBundle.open(pbw_path, hardware_version)
         if not bundle.is_app_bundle():
             raise PebbleError(self.id, "This is not an app bundle")
+        # Inflate the parts while the watch asks for the app
+        parts = self._preload_app_parts(bundle)
 
         app_metadata = bundle.get_app_metadata()
 
@@ -1083,26 +1345,27 @@ class Pebble(object):
             app_metadata['app_name']
         )
 
-        resp = metadata_blob.send()
+        with self._install_phase("metadata"):
+            resp = metadata_blob.send()
         if resp is not "SUCCESS":
             print "Error: " + resp
 
-        # launch application
-        self.launcher_message(app_metadata['uuid'].bytes, "RUNNING", uuid_is_string=False, async = True)
-
-        # listen for app fetch
-        app_fetch = EndpointSync(self, "APP_FETCH").get_data()
+        # launch application, which makes the watch fetch it from us
+        with self._install_phase("app_fetch"):
+            app_fetch = EndpointSync(self, "APP_FETCH", self.install_step_timeout)
+            self.launcher_message(app_metadata['uuid'].bytes, "RUNNING", uuid_is_string=False, async = True)
+            app_fetch = app_fetch.get_data()
 
         command, app_uuid, app_id = unpack("<B16sI", app_fetch)
         uuid_str = str(uuid.UUID(bytes=app_uuid))
 
-        # send ACK, no response comes back
+        # send ACK, no response comes back. The watch answers the first
+        # PutBytes request once it is ready for it.
         resp = pack("BB", 1, 1) # APP_FETCH_INSTALL_RESPONSE, SUCCESS
         self._send_message("APP_FETCH", resp)
 
-        time.sleep(1)
-
-        self.install_app_binaries_pebble_protocol(pbw_path, app_id)
+        self._put_app_parts(pbw_path, parts, app_id, has_cookie=True)
+        self._log_install_timings()
 
     def install_app_pebble_protocol(self, pbw_path, launch_on_install=True):
 
@@ -1118,53 +1381,60 @@ class Pebble(object):
         return True
 
     def install_app_binaries_pebble_protocol(self, pbw_path, app_id):
+        self.install_timings = OrderedDict()
         device_version = self.get_versions()
         hardware_version = device_version['normal_fw']['hardware_platform']
 
-        bundle = PebbleBundle(pbw_path, hardware_version)
+        bundle = PebbleBundle.open(pbw_path, hardware_version)
         if not bundle.is_app_bundle():
             raise PebbleError(self.id, "This is not an app bundle")
 
-        # Install the app code
-        binary = bundle.zip.read(bundle.get_app_path())
-        if bundle.has_resources():
-            resources = bundle.zip.read(bundle.get_resource_path())
-        else:
-            resources = None
-
-        client = PutBytesClient(self, app_id, "BINARY", binary, has_cookie=True)
-        self.register_endpoint("PUTBYTES", client.handle_message)
-        client.init()
-        while not client._done and not client._error:
-            time.sleep(0.5)
-        if client._error:
-            raise PebbleError(self.id, "Failed to send application binary %s/pebble-app.bin" % pbw_path)
-
-        # Install the resources
-        if resources:
-            client = PutBytesClient(self, app_id, "RESOURCES", resources, has_cookie=True)
-            self.register_endpoint("PUTBYTES", client.handle_message)
-            client.init()
-            while not client._done and not client._error:
-                time.sleep(0.5)
-            if client._error:
-                raise PebbleError(self.id, "Failed to send application resources %s/app_resources.pbpack" % pbw_path)
-
-        # Is there a worker to install?
-        worker_info = bundle.get_worker_info()
-        if worker_info is not None:
-          binary = bundle.zip.read(bundle.get_worker_path())
-          client = PutBytesClient(self, app_id, "WORKER", binary, has_cookie=True)
-          self.register_endpoint("PUTBYTES", client.handle_message)
-          client.init()
-          while not client._done and not client._error:
-              time.sleep(0.5)
-          if client._error:
-              raise PebbleError(self.id, "Failed to send worker binary %s/%s" % (pbw_path, bundle.get_worker_path()))
+        self._put_app_parts(pbw_path, self._preload_app_parts(bundle), app_id, has_cookie=True)
+        self._log_install_timings()
 
         # If we have not thrown an exception, we succeeded
         return True
 
+    def _preload_app_parts(self, bundle):
+        """
+        Starts inflating the app binary, resources and worker of bundle in the
+        background. Returns (transfer type, description, path, Completion) for
+        each part the bundle has, in the order they are installed.
+        """
+        parts = [("BINARY", "application binary", bundle.get_app_path())]
+        if bundle.has_resources():
+            parts.append(("RESOURCES", "application resources", bundle.get_resource_path()))
+        if bundle.get_worker_info() is not None:
+            parts.append(("WORKER", "worker binary", bundle.get_worker_path()))
+        completions = bundle.preload([path for _, _, path in parts])
+        return [part + (completion,) for part, completion in zip(parts, completions)]
+
+    def _put_app_parts(self, pbw_path, parts, index, has_cookie=False):
+        """ Sends the parts from _preload_app_parts, each as soon as it is ready """
+        for transfer_type, description, path, completion in parts:
+            with self._install_phase("inflate_" + transfer_type.lower()):
+                data, crc = completion.result()
+            with self._install_phase("putbytes_" + transfer_type.lower()):
+                client = self._put_bytes_client(index, transfer_type, data, has_cookie=has_cookie, crc=crc)
+                self.register_endpoint("PUTBYTES", client.handle_message)
+                client.init()
+                if not client.wait(self.install_transfer_timeout):
+                    raise PebbleError(self.id, "Failed to send %s %s/%s" % (description, pbw_path, path))
+
+    @contextmanager
+    def _install_phase(self, name):
+        """ Records how long the body of the with statement takes in install_timings """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.install_timings[name] = time.time() - start
+
+    def _log_install_timings(self):
+        for name, seconds in self.install_timings.iteritems():
+            log.debug("%-22s %.3fs" % (name, seconds))
+        log.info("Installed in %.3fs" % sum(self.install_timings.values()))
+
     def install_app(self, pbw_path, launch_on_install=True, direct=False):
 
         """Install an app bundle (*.pbw) to the target Pebble."""
@@ -1239,33 +1509,48 @@ class Pebble(object):
         print reminder.id
         return reminder
 
+    def _request(self, endpoint, data, timeout=10, attempts=1):
+        """
+        Sends data to endpoint and returns the watch's response. The response
+        handler is registered first, so a quick answer can't be missed. The
+        request is sent up to attempts times if no answer comes within timeout.
+        """
+        for attempt in xrange(attempts):
+            sync = EndpointSync(self, endpoint, timeout)
+            self._send_message(endpoint, data)
+            try:
+                return sync.get_data()
+            except PebbleTimeoutError:
+                if attempt + 1 == attempts:
+                    raise
+                log.debug("No response on %s after %ss, asking again" % (endpoint, timeout))
+
     def _raw_blob_db_insert(self, db, key, value):
         db = BlobDB(db)
         data = db.insert(key, value)
-        self._send_message("BLOB_DB", data)
-        return EndpointSync(self, "BLOB_DB").get_data()
+        return self._request("BLOB_DB", data)
 
     def _raw_blob_db_delete(self, db, key):
         db = BlobDB(db)
         data = db.delete(key)
-        self._send_message("BLOB_DB", data)
-        return EndpointSync(self, "BLOB_DB").get_data()
+        return self._request("BLOB_DB", data)
 
     def _raw_blob_db_clear(self, db):
         db = BlobDB(db)
         data = db.clear()
-        self._send_message("BLOB_DB", data)
-        return EndpointSync(self, "BLOB_DB").get_data()
+        return self._request("BLOB_DB", data)
+
 
+    def _put_bytes_client(self, index, transfer_type, data, filename="", has_cookie=False, crc=None):
+        return PutBytesClient(self, index, transfer_type, data, filename, has_cookie,
+                              chunk_size=self.putbytes_chunk_size, window=self.putbytes_window, crc=crc)
 
     def send_file(self, file_path, name):
         data = open(file_path, 'r').read()
-        client = PutBytesClient(self, 0, "FILE", data, name)
+        client = self._put_bytes_client(0, "FILE", data, name)
         self.register_endpoint("PUTBYTES", client.handle_message)
         client.init()
-        while not client._done and not client._error:
-            pass
-        if client._error:
+        if not client.wait():
             raise PebbleError(self.id, "Failed to send file %s" % file_path)
         log.info("File transfer succesful")
 
@@ -1283,21 +1568,17 @@ class Pebble(object):
         time.sleep(2)
 
         if resources:
-            client = PutBytesClient(self, 0, "SYS_RESOURCES", resources)
+            client = self._put_bytes_client(0, "SYS_RESOURCES", resources)
             self.register_endpoint("PUTBYTES", client.handle_message)
             client.init()
-            while not client._done and not client._error:
-                pass
-            if client._error:
+            if not client.wait():
                 raise PebbleError(self.id, "Failed to send firmware resources %s/system_resources.pbpack" % pbz_path)
 
 
-        client = PutBytesClient(self, 0, "RECOVERY" if recovery else "FIRMWARE", binary)
+        client = self._put_bytes_client(0, "RECOVERY" if recovery else "FIRMWARE", binary)
         self.register_endpoint("PUTBYTES", client.handle_message)
         client.init()
-        while not client._done and not client._error:
-            pass
-        if client._error:
+        if not client.wait():
             raise PebbleError(self.id, "Failed to send firmware binary %s/tintin_fw.bin" % pbz_path)
 
         log.info("Installation successful")
@@ -1585,7 +1866,7 @@ class Pebble(object):
 
         class LogDumpClient(object):
             def __init__(self, pebble):
-                self.done = False
+                self.completion = Completion()
                 self._pebble = pebble
 
             def parse_log_dump_response(self, endpoint, data):
@@ -1595,12 +1876,12 @@ class Pebble(object):
 
                 response_type, response_cookie = unpack("!BI", data[:5])
                 if response_type == 0x81:
-                    self.done = True
+                    self.completion.set_result()
                     return
                 elif response_type != 0x80 or response_cookie != cookie:
                     log.info("Received unexpected message with type 0x%x cookie %u expected 0x80 %u" %
                         (response_type, response_cookie, cookie))
-                    self.done = True
+                    self.completion.set_result()
                     return
 
                 timestamp, str_level, filename, linenumber, message = self._pebble._parse_log_response(data[5:])
@@ -1616,8 +1897,7 @@ class Pebble(object):
         cookie = random.randint(0, pow(2, 32) - 1)
         self._send_message("LOG_DUMP", pack("!BBI", 0x10, generation_number, cookie))
 
-        while not client.done:
-            time.sleep(1)
+        client.completion.wait()
 
     def app_log_enable(self):
         self._app_log_enabled = True
@@ -1635,13 +1915,15 @@ class Pebble(object):
 
         self._alive = False
         self._ser.close()
+        if self._symbolizer is not None:
+            self._symbolizer.close()
 
     def set_print_pbl_logs(self, value):
         self.print_pbl_logs = value
 
     def _add_app(self, index):
         data = pack("!bI", 3, index)
-        self._send_message("APP_MANAGER", data)
+        return self._request("APP_MANAGER", data, timeout=self.install_step_timeout)
 
     def _screenshot_response(self, endpoint, data):
         return data
@@ -1739,8 +2021,7 @@ class Pebble(object):
 
                 result = '???'
             else:
-                result = sh.arm_none_eabi_addr2line(addr_str, exe=APP_ELF_PATH,
-                                                    _tty_out=False).strip()
+                result = self._get_symbolizer().lookup(APP_ELF_PATH, int(addr_str, 16))
 
             log.warn("%24s %10s %s", register_name + ':', addr_str, result)
 
@@ -1748,6 +2029,15 @@ class Pebble(object):
         print_register("Link Register (LR)", crashed_lr)
 
 
+    def _get_symbolizer(self):
+        # Kept for the whole connection so repeated crashes don't re-read the .elf
+        if self._symbolizer is None:
+            if TOOLS_PATH not in sys.path:
+                sys.path.append(TOOLS_PATH)
+            import binutils
+            self._symbolizer = binutils.Symbolizer()
+        return self._symbolizer
+
     def _app_log_response(self, endpoint, data):
         if (len(data) < 8):
             log.warn("Unable to decode log message (length %d is less than 8)" % len(data))
@@ -2009,6 +2299,7 @@ class WSClient(object):
       self._topic = None
       self._received = False
       self._error = False
+      self.completion = Completion("Timed out waiting for the phone app")
       # Call the timeout handler after the timeout.
       self._timer = threading.Timer(90.0, self.timeout)
       self._timer.setDaemon(True)
@@ -2020,6 +2311,7 @@ class WSClient(object):
       self._error = True
       self._received = False
       self._state = self.states["IDLE"]
+      self.completion.set_error(PebbleTimeoutError(None, self.completion.timeout_message))
 
     def listen(self):
       self._state = self.states["LISTENING"]
@@ -2036,8 +2328,23 @@ class WSClient(object):
       self._topic = topic
       self._response = response;
       self._received = True
+      self.completion.set_result(response)
+
+    def wait(self):
+      """ Blocks until a response arrives or the timeout handler runs """
+      self.completion.wait()
 
 class PutBytesClient(object):
+    """
+    Sends a buffer over the PutBytes endpoint.
+
+    Chunks of `chunk_size` bytes are sent one at a time, each waiting for the
+    watch's ack. Passing a `window` greater than 1 keeps that many chunks in
+    flight instead, for watches known to accept them (Pebble.putbytes_window,
+    `pebble install --putbytes_window`); it relies on the watch acking chunks
+    in order. The commit is sent once the last chunk has been acked. Call
+    wait() to block until the transfer finishes.
+    """
     states = {
             "NOT_STARTED": 0,
             "WAIT_FOR_TOKEN": 1,
@@ -2057,7 +2364,16 @@ class PutBytesClient(object):
             "WORKER": 7,
     }
 
-    def __init__(self, pebble, index, transfer_type, buffer, filename="", has_cookie=False):
+    chunk_size = 2000
+    window = 1
+
+    # Pebble Protocol header followed by the PutBytes put header
+    put_header = struct.Struct("!HHbII")
+    # The largest chunk whose message length still fits the Pebble Protocol header
+    max_chunk_size = 0xFFFF - (put_header.size - 4)
+
+    def __init__(self, pebble, index, transfer_type, buffer, filename="", has_cookie=False,
+                 chunk_size=None, window=None, crc=None):
         if len(filename) > 255:
             raise Exception("Filename too long (>255 chars) " + filename)
 
@@ -2068,8 +2384,26 @@ class PutBytesClient(object):
         self._index = index
         self._done = False
         self._error = False
+        self.completion = Completion()
         self._filename = filename + '\0'
         self._has_cookie = has_cookie
+        # The STM32 CRC of buffer, if the caller already worked it out
+        self._crc = crc
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        if window is not None:
+            self.window = window
+        if self.window < 1:
+            raise ValueError("PutBytes window must be at least 1, not %d" % self.window)
+        if not 0 < self.chunk_size <= self.max_chunk_size:
+            raise ValueError("PutBytes chunk size must be between 1 and %d, not %d" %
+                             (self.max_chunk_size, self.chunk_size))
+        self._sent = 0
+        self._acked = 0
+        # The length of each chunk sent but not yet acked, oldest first
+        self._in_flight = deque()
+        self._start_time = None
+        self._end_time = None
 
     def init(self):
         if self._has_cookie:
@@ -2081,14 +2415,27 @@ class PutBytesClient(object):
         self._pebble._send_message("PUTBYTES", data)
         self._state = self.states["WAIT_FOR_TOKEN"]
 
+    def wait(self, timeout=None):
+        """
+        Blocks until the transfer completes or fails and returns whether it
+        completed. Raises PebbleTimeoutError if it does neither in time.
+        """
+        try:
+            self.completion.result(timeout)
+        except PebbleTimeoutError:
+            raise
+        except PebbleError as e:
+            log.debug(str(e))
+        return self._done
+
     def wait_for_token(self, resp):
         res, = unpack("!b", resp[0])
         if res != 1:
             log.error("init failed with code %d" % res)
-            self._error = True
+            self._fail()
             return
         self._token, = unpack("!I", resp[1:])
-        self._left = len(self._buffer)
+        self._start_time = time.time()
         self._state = self.states["IN_PROGRESS"]
         self.send()
 
@@ -2097,15 +2444,21 @@ class PutBytesClient(object):
         if res != 1:
             self.abort()
             return
-        if self._left > 0:
+        if not self._in_flight:
+            log.warning("Ignoring a PutBytes ack for a chunk that wasn't sent")
+            return
+        self._acked += self._in_flight.popleft()
+        if self._sent < len(self._buffer):
             self.send()
-            log.info("Sent %d of %d bytes" % (len(self._buffer)-self._left, len(self._buffer)))
-        else:
+            log.info("Sent %d of %d bytes" % (self._acked, len(self._buffer)))
+        elif not self._in_flight:
             self._state = self.states["COMMIT"]
             self.commit()
 
     def commit(self):
-        data = pack("!bII", 3, self._token & 0xFFFFFFFF, stm32_crc.crc32(self._buffer))
+        if self._crc is None:
+            self._crc = stm32_crc.crc32(self._buffer)
+        data = pack("!bII", 3, self._token & 0xFFFFFFFF, self._crc)
         self._pebble._send_message("PUTBYTES", data)
 
     def handle_commit(self, resp):
@@ -2113,6 +2466,7 @@ class PutBytesClient(object):
         if res != 1:
             self.abort()
             return
+        self._end_time = time.time()
         self._state = self.states["COMPLETE"]
         self.complete()
 
@@ -2125,20 +2479,50 @@ class PutBytesClient(object):
         if res != 1:
             self.abort()
             return
+        stats = self.stats()
+        log.info("Sent %d bytes in %.2fs (%.1f KB/s)" % (stats['bytes'], stats['seconds'],
+                                                        stats['bytes_per_second'] / 1024))
         self._done = True
+        self.completion.set_result()
 
     def abort(self):
         msgdata = pack("!bI", 4, self._token & 0xFFFFFFFF)
         self._pebble._send_message("PUTBYTES", msgdata)
+        self._fail()
+
+    def _fail(self):
+        self._state = self.states["FAILED"]
         self._error = True
+        self.completion.set_error(PebbleError(None, "PutBytes transfer failed"))
 
     def send(self):
-        datalen =  min(self._left, 2000)
-        rg = len(self._buffer)-self._left
-        msgdata = pack("!bII", 2, self._token & 0xFFFFFFFF, datalen)
-        msgdata += self._buffer[rg:rg+datalen]
-        self._pebble._send_message("PUTBYTES", msgdata)
-        self._left -= datalen
+        """ Sends chunks until the window is full or the buffer has all been sent """
+        total = len(self._buffer)
+        while len(self._in_flight) < self.window and self._sent < total:
+            datalen = min(total - self._sent, self.chunk_size)
+            msg = self.put_header.pack(datalen + self.put_header.size - 4,
+                                       self._pebble.endpoints["PUTBYTES"], 2,
+                                       self._token & 0xFFFFFFFF, datalen)
+            # CPython extends a str it holds the only reference to in place, so
+            # this copies the chunk out of the buffer once
+            msg += self._buffer[self._sent:self._sent + datalen]
+            self._pebble._send_frame(msg)
+            self._sent += datalen
+            self._in_flight.append(datalen)
+
+    def stats(self):
+        """ Bytes acked so far, how long the transfer has been running and its throughput """
+        if self._start_time is None:
+            seconds = 0.0
+        else:
+            seconds = (self._end_time or time.time()) - self._start_time
+        return {
+            'bytes': self._acked,
+            'seconds': seconds,
+            'bytes_per_second': self._acked / seconds if seconds else 0.0,
+            'chunk_size': self.chunk_size,
+            'window': self.window,
+        }
 
     def handle_message(self, endpoint, resp):
         if self._state == self.states["WAIT_FOR_TOKEN"]:
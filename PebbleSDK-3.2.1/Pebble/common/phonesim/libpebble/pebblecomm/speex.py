@@ -3,6 +3,7 @@ import argparse
 import array
 import struct
 import binascii
+import zlib
 
 MAX_FRAME_LEN = 255
 MAX_FRAME_COUNT = 255
@@ -10,29 +11,40 @@ MAX_FRAME_COUNT = 255
 bitswap = b''.join(chr(sum(((val >> i) & 1) << (7 - i) for i in range(8))) for val in range(256))
 to_uint_be = lambda data: struct.pack('>I', data)
 
-def create_ogg_packet(bos, eos, granule, serial_no, packet_no, segments):
+# capture pattern, version, header type, granule position, bitstream serial no,
+# page sequence no, crc, number of segments
+OGG_PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+OGG_CRC_OFFSET = 22
+
+def ogg_crc(data):
+    """ The Ogg page checksum of data (a str or bytearray).
+
+    This is the MSB first CRC-32 with polynomial 0x04C11DB7, no initial value
+    and no final xor. zlib.crc32 computes the LSB first version of the same
+    CRC in C, so it is fed each byte bit reversed and its result is reversed.
+    """
+    crc = (~zlib.crc32(buffer(data.translate(bitswap)), -1)) & 0xffffffff
+    return struct.unpack('<I', to_uint_be(crc).translate(bitswap))[0]
+
+def create_ogg_page(bos, eos, granule, serial_no, page_no, segments):
+    """ Returns the page as a bytearray, built in place with a single header pack """
     header_type = (1 << 1) if bos else 0    # b_o_s
     header_type |= (1 << 2) if eos else 0   # e_o_s
 
-    ogg = 'OggS'                            # 4
-    ogg += struct.pack('B', 0)              # 1, version - must be 0
-    ogg += struct.pack('B', header_type)    # 1, Header type
-    ogg += struct.pack('q', granule)        # 8, granule position
-    ogg += struct.pack('I', serial_no)      # 4, bitstream serial no
-    ogg += struct.pack('I', packet_no)      # 4, packet number
-    ogg += struct.pack('i', 0)              # 4, crc - evaluated later
-    ogg += struct.pack('B', len(segments))  # 1, Number of segments
-    for s in segments:                      # add length of each segment
-        ogg += struct.pack('B', len(s))     # 1, length of segment
-    ogg += ''.join(segments)
-
-    # crc = binascii.crc32(ogg) & 0xffffffff  # calulate crc over whole packet
+    segment_table = bytearray(len(s) for s in segments)
+    header_size = OGG_PAGE_HEADER.size + len(segment_table)
+    page = bytearray(header_size + sum(segment_table))
+    OGG_PAGE_HEADER.pack_into(page, 0, 'OggS', 0, header_type, granule, serial_no, page_no,
+                              0,    # crc - evaluated once the page is filled in
+                              len(segment_table))
+    page[OGG_PAGE_HEADER.size:header_size] = segment_table
+    page[header_size:] = ''.join(segments)
 
-    import zlib
-    crc = (~zlib.crc32(ogg.translate(bitswap), -1)) & 0xffffffff
-    crc = to_uint_be(crc).translate(bitswap)
+    struct.pack_into('<I', page, OGG_CRC_OFFSET, ogg_crc(page))
+    return page
 
-    return ogg[:22] + crc + ogg[26:]
+def create_ogg_packet(bos, eos, granule, serial_no, packet_no, segments):
+    return str(create_ogg_page(bos, eos, granule, serial_no, packet_no, segments))
 
 def create_speex_header(version, rate, frame_sz):
     bitstream_version  = 4
@@ -71,33 +83,53 @@ def create_vorbis_comment(vendor, user_comments):
     return comment
 
 
+class OggSpeexWriter(object):
+    """ Writes Speex frames to an Ogg file as they arrive, a page at a time,
+    so only the frames of the page being filled are kept in memory """
+
+    def __init__(self, filename, rate, version="1.2rc1", serial_no=0x42E296FC):
+        self.filename = filename
+        self.frame_sz = (rate / 1000) * 20
+        self.serial_no = serial_no
+        self.frames = []
+        self.page_no = 0
+        self.granules = 0
+
+        self.file = open(filename, 'wb')
+        spx = create_speex_header(version, rate, self.frame_sz)
+        self._write_page(True, False, 0, [spx])
+        comment = create_vorbis_comment('Encoded with Speex ' + version, [])
+        self._write_page(False, False, 0, [comment])
+
+    def _write_page(self, bos, eos, granule, segments):
+        self.file.write(create_ogg_page(bos, eos, granule, self.serial_no, self.page_no, segments))
+        self.page_no += 1
+
+    def _write_frames(self, eos):
+        self.granules += len(self.frames) * self.frame_sz
+        self._write_page(False, eos, self.granules - self.frame_sz, self.frames)
+        self.frames = []
+
+    def add_frame(self, frame):
+        # A full page is only written once another frame arrives, as the last
+        # page has to be marked as the end of the stream.
+        if len(self.frames) == MAX_FRAME_COUNT:
+            self._write_frames(False)
+        self.frames.append(frame)
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.frames:
+            self._write_frames(True)
+        self.file.close()
+        self.file = None
+
+
 def store_data(frames, filename, rate):
-    frame_sz = (rate / 1000) * 20
-    version = "1.2rc1"
-    serial_no = 0x42E296FC
-
-    spx = create_speex_header(version, rate, frame_sz)
-    ogg = create_ogg_packet(True, False, 0, serial_no, 0, [spx])
-    comment = create_vorbis_comment('Encoded with Speex ' + version, [])
-    ogg += create_ogg_packet(False, False, 0, serial_no, 1, [comment])
-
-    packet_no = 2
-    tot_granules = 0
-    while (len(frames) > 0):
-        packet_frames = min(len(frames), MAX_FRAME_COUNT)
-        last_packet = (len(frames) == packet_frames)
-
-        tot_granules += packet_frames * frame_sz
-        granule_pos = tot_granules - frame_sz
-        
-        ogg += create_ogg_packet(False, last_packet, granule_pos, serial_no, packet_no, frames[:packet_frames])
-        
-        frames = frames[packet_frames:]
-        packet_no += 1
-
-    with open(filename, 'wb') as f:
-        f.write(ogg)
-        f.close()
+    writer = OggSpeexWriter(filename, rate)
+    for frame in frames:
+        writer.add_frame(frame)
+    writer.close()
 
     return filename
-
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+""" Replays a 180x180 colour screenshot transfer through the Pebble Protocol
+reassembly, comparing the old str buffer with PebbleProtocolFramer.
+
+The stream is synthesised the way the watch sends it: a screenshot header in
+the first frame, then the 8-bit pixels split over many frames. It is fed in
+reads of various sizes, since the old buffer's cost grows with how many frames
+arrive in one read.
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, root_dir)
+
+from pebblecomm.framing import PebbleProtocolFramer
+
+SCREENSHOT_ENDPOINT = 8000
+WIDTH = HEIGHT = 180
+
+
+def screenshot_stream(frame_payload_size):
+    rand = random.Random(180)
+    pixels = ''.join(chr(rand.randint(0xc0, 0xff)) for _ in xrange(WIDTH * HEIGHT))
+    data = struct.pack("!BIII", 0, 2, WIDTH, HEIGHT) + pixels
+    frames = []
+    for i in xrange(0, len(data), frame_payload_size):
+        payload = data[i:i + frame_payload_size]
+        frames.append(struct.pack("!HH", len(payload), SCREENSHOT_ENDPOINT) + payload)
+    return ''.join(frames)
+
+
+def reads(stream, read_size):
+    return [stream[i:i + read_size] for i in xrange(0, len(stream), read_size)]
+
+
+def str_reassembly(chunks):
+    """ The reassembly Pebble._parse_received_pebble_protocol_data used to do """
+    buf = ''
+    received = 0
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= 4:
+            size, endpoint = struct.unpack("!HH", buf[0:4])
+            tail = buf[4:]
+            if len(tail) < size:
+                break
+            payload = tail[0:size]
+            buf = buf[4 + size:]
+            received += len(payload)
+    return received
+
+
+def dispatch(framer):
+    # Like Pebble._parse_received_pebble_protocol_data, nothing holds on to a
+    # payload view once its frame has been handled.
+    received = 0
+    for endpoint, payload in framer.frames():
+        received += len(payload.tobytes())
+    return received
+
+
+def framer_reassembly(chunks):
+    framer = PebbleProtocolFramer()
+    received = 0
+    for chunk in chunks:
+        framer.feed(chunk)
+        received += dispatch(framer)
+    return received
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frame_size', type=int, default=200,
+                        help='Pebble Protocol payload bytes per frame')
+    parser.add_argument('--screenshots', type=int, default=1,
+                        help='Replay this many screenshots back to back')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    stream = screenshot_stream(args.frame_size) * args.screenshots
+    print "%d byte stream, %d byte frames" % (len(stream), args.frame_size)
+    print "%10s %12s %12s %8s" % ('read size', 'str (ms)', 'framer (ms)', 'speedup')
+    for read_size in (256, 2048, 16384, len(stream)):
+        chunks = reads(stream, read_size)
+        old_time, old_received = best_of(args.repeat, str_reassembly, chunks)
+        new_time, new_received = best_of(args.repeat, framer_reassembly, chunks)
+        assert old_received == new_received == (WIDTH * HEIGHT + 13) * args.screenshots
+        print "%10d %12.2f %12.2f %7.1fx" % (read_size, old_time * 1000, new_time * 1000,
+                                           old_time / new_time)
+
+
+if __name__ == '__main__':
+    main()
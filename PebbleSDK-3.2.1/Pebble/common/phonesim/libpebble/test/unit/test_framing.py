@@ -0,0 +1,103 @@
+import os
+import struct
+import sys
+import unittest
+
+
+# Allow us to run even if not at the root libpebble directory.
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir,
+                                        os.pardir))
+sys.path.insert(0, root_dir)
+
+from pebblecomm.framing import ByteBuffer, PebbleProtocolFramer, QemuFramer
+
+
+def frame(endpoint, payload):
+    return struct.pack("!HH", len(payload), endpoint) + payload
+
+
+def qemu_packet(protocol, payload):
+    return struct.pack("!HHH", 0xFEED, protocol, len(payload)) + payload + '\xbe\xef'
+
+
+class TestByteBuffer(unittest.TestCase):
+
+    def test_compacts_consumed_data(self):
+        buf = ByteBuffer()
+        buf.feed('a' * 10)
+        buf.skip(6)
+        buf.feed('b' * 2)
+        self.assertEqual(len(buf), 6)
+        self.assertEqual(buf.view(0, 6).tobytes(), 'aaaabb')
+        self.assertEqual(len(buf._data), 6)
+
+    def test_feed_while_a_view_is_held(self):
+        buf = ByteBuffer()
+        buf.feed('abcdef')
+        view = buf.view(1, 2)
+        buf.skip(4)
+        buf.feed('gh')
+        self.assertEqual(view.tobytes(), 'bc')
+        self.assertEqual(buf.view(0, 4).tobytes(), 'efgh')
+
+    def test_find_is_relative_to_the_cursor(self):
+        buf = ByteBuffer()
+        buf.feed('xx\xfe\xedyy\xfe\xed')
+        buf.skip(3)
+        self.assertEqual(buf.find('\xfe\xed'), 3)
+        self.assertEqual(buf.find('zz'), -1)
+
+
+class TestPebbleProtocolFramer(unittest.TestCase):
+
+    def test_frames_split_across_reads(self):
+        stream = frame(8000, 'x' * 300) + frame(2000, '') + frame(11, 'hello')
+        framer = PebbleProtocolFramer()
+        frames = []
+        for i in xrange(0, len(stream), 7):
+            framer.feed(stream[i:i + 7])
+            frames.extend((endpoint, payload.tobytes())
+                          for endpoint, payload in framer.frames())
+        self.assertEqual(frames, [(8000, 'x' * 300), (2000, ''), (11, 'hello')])
+        self.assertEqual(len(framer.buffer), 0)
+
+    def test_incomplete_frame_is_kept(self):
+        framer = PebbleProtocolFramer()
+        framer.feed(frame(11, 'hello')[:-1])
+        self.assertEqual(list(framer.frames()), [])
+        framer.feed('o')
+        self.assertEqual([(e, p.tobytes()) for e, p in framer.frames()],
+                         [(11, 'hello')])
+
+
+class TestQemuFramer(unittest.TestCase):
+
+    def setUp(self):
+        self.framer = QemuFramer(0xFEED, 2048)
+
+    def test_all_buffered_packets_come_out(self):
+        self.framer.feed(qemu_packet(1, 'abc') + qemu_packet(7, '\x01') + qemu_packet(1, ''))
+        self.assertEqual(list(self.framer.packets()), [(1, 'abc'), (7, '\x01'), (1, '')])
+
+    def test_resyncs_past_garbage(self):
+        self.framer.feed('garbage\xfe' + qemu_packet(1, 'abc') + 'more\xfe')
+        self.assertEqual(list(self.framer.packets()), [(1, 'abc')])
+        # The trailing '\xfe' could start the next header, so it is kept
+        self.framer.feed('\xed' + qemu_packet(1, 'xyz')[2:])
+        self.assertEqual(list(self.framer.packets()), [(1, 'xyz')])
+
+    def test_skips_header_with_bad_length(self):
+        bogus = struct.pack("!HHH", 0xFEED, 1, 5000)
+        self.framer.feed(bogus + qemu_packet(1, 'ok'))
+        self.assertEqual(list(self.framer.packets()), [(1, 'ok')])
+
+    def test_waits_for_a_split_packet(self):
+        packet = qemu_packet(1, 'hello')
+        self.framer.feed(packet[:5])
+        self.assertEqual(list(self.framer.packets()), [])
+        self.framer.feed(packet[5:])
+        self.assertEqual(list(self.framer.packets()), [(1, 'hello')])
+
+
+if __name__ == '__main__':
+    unittest.main()
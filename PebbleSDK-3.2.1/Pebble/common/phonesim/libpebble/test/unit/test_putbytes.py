@@ -0,0 +1,86 @@
+import os
+import struct
+import sys
+import unittest
+
+
+# Allow us to run even if not at the root libpebble directory.
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir,
+                                        os.pardir))
+sys.path.insert(0, root_dir)
+
+from pebblecomm.pebble import PutBytesClient
+
+
+class FakePebble(object):
+    endpoints = {"PUTBYTES": 48879}
+
+    def __init__(self):
+        self.frames = []
+        self.messages = []
+
+    def _send_frame(self, frame):
+        self.frames.append(frame)
+
+    def _send_message(self, endpoint, data):
+        self.messages.append(data)
+
+
+def ack():
+    return '\x01'
+
+
+def chunks(frames):
+    """ The (token, payload) of each framed PUT message """
+    result = []
+    for frame in frames:
+        length, endpoint, command, token, size = PutBytesClient.put_header.unpack_from(frame)
+        payload = frame[PutBytesClient.put_header.size:]
+        assert (length, endpoint, command, size) == (len(frame) - 4, 48879, 2, len(payload))
+        result.append((token, payload))
+    return result
+
+
+class TestPutBytesClient(unittest.TestCase):
+
+    def start(self, data, **kwargs):
+        pebble = FakePebble()
+        client = PutBytesClient(pebble, 0, "FILE", data, "file", **kwargs)
+        client.init()
+        client.handle_message(None, ack() + struct.pack('!I', 7))
+        return pebble, client
+
+    def test_stop_and_wait_by_default(self):
+        pebble, client = self.start('x' * 4500)
+        self.assertEqual(len(pebble.frames), 1)
+        client.handle_message(None, ack())
+        self.assertEqual(len(pebble.frames), 2)
+
+    def test_window_and_chunk_size(self):
+        data = ''.join(chr(i % 256) for i in xrange(1000))
+        pebble, client = self.start(data, window=3, chunk_size=300)
+        self.assertEqual(len(pebble.frames), 3)
+        while client._state == client.states["IN_PROGRESS"]:
+            client.handle_message(None, ack())
+        sent = chunks(pebble.frames)
+        self.assertEqual([len(payload) for _, payload in sent], [300, 300, 300, 100])
+        self.assertEqual(''.join(payload for _, payload in sent), data)
+        self.assertEqual(set(token for token, _ in sent), set([7]))
+        self.assertEqual(client._state, client.states["COMMIT"])
+        self.assertEqual(client.stats()['bytes'], 1000)
+
+    def test_stray_ack_is_ignored(self):
+        pebble, client = self.start('x' * 10)
+        client._state = client.states["IN_PROGRESS"]
+        client.in_progress(ack())
+        client.in_progress(ack())
+        self.assertEqual(client.stats()['bytes'], 10)
+
+    def test_rejects_bad_settings(self):
+        self.assertRaises(ValueError, PutBytesClient, FakePebble(), 0, "FILE", 'x', window=0)
+        self.assertRaises(ValueError, PutBytesClient, FakePebble(), 0, "FILE", 'x',
+                          chunk_size=PutBytesClient.max_chunk_size + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+# Allow us to run even if not at the root libpebble directory.
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir,
+                                        os.pardir))
+sys.path.insert(0, root_dir)
+
+from pebblecomm import speex
+
+
+def ogg_pages(data):
+    pages = []
+    offset = 0
+    while offset < len(data):
+        header = speex.OGG_PAGE_HEADER.unpack_from(data, offset)
+        segment_count = header[-1]
+        header_size = speex.OGG_PAGE_HEADER.size + segment_count
+        lacing = bytearray(data[offset + speex.OGG_PAGE_HEADER.size:offset + header_size])
+        size = header_size + sum(lacing)
+        pages.append((header, data[offset:offset + size]))
+        offset += size
+    return pages
+
+
+class TestOggSpeexWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recording.ogg')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ogg_crc(self):
+        # Test vector for the Ogg CRC (polynomial 0x04c11db7, no reflection)
+        self.assertEqual(speex.ogg_crc(bytearray('123456789')), 0x89a1897f)
+
+    def test_pages_are_valid(self):
+        frames = [chr(i % 256) * 38 for i in xrange(600)]
+        writer = speex.OggSpeexWriter(self.path, 16000)
+        for frame in frames:
+            writer.add_frame(frame)
+        writer.close()
+
+        pages = ogg_pages(open(self.path, 'rb').read())
+        # Speex header, comment, then three pages of frames
+        self.assertEqual(len(pages), 5)
+        for page_no, (header, page) in enumerate(pages):
+            self.assertEqual(header[0], 'OggS')
+            self.assertEqual(header[5], page_no)
+            page = bytearray(page)
+            crc = header[6]
+            page[speex.OGG_CRC_OFFSET:speex.OGG_CRC_OFFSET + 4] = '\0' * 4
+            self.assertEqual(speex.ogg_crc(page), crc)
+        flags = [page_header[2] for page_header, _ in pages]
+        self.assertEqual(flags, [2, 0, 0, 0, 4])
+
+    def test_matches_store_data(self):
+        frames = [chr(i % 256) * 20 for i in xrange(255 * 2)]
+        writer = speex.OggSpeexWriter(self.path, 8000)
+        for frame in frames:
+            writer.add_frame(frame)
+        writer.close()
+        reference = os.path.join(self.directory, 'reference.ogg')
+        speex.store_data(frames, reference, 8000)
+        self.assertEqual(open(self.path, 'rb').read(), open(reference, 'rb').read())
+
+
+if __name__ == '__main__':
+    unittest.main()
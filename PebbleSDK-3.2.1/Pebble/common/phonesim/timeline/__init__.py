@@ -6,7 +6,9 @@ import dateutil.parser
 import gevent
 import json
 import logging
+import os
 import requests
+import sys
 import traceback
 import uuid
 
@@ -17,6 +19,15 @@ import model
 from model import TimelineItem, TimelineState, TimelineSubscription, PinTopic
 from websync import TimelineWebSync
 
+# The URI index format belongs to the SDK's tools/timeline_uri_index.py
+_tools_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'tools')
+if _tools_path not in sys.path:
+    sys.path.append(_tools_path)
+try:
+    import timeline_uri_index
+except ImportError:
+    timeline_uri_index = None
+
 
 class PebbleTimeline(object):
     def __init__(self, runner, oauth=None, persist=None, layout_file=None):
@@ -37,14 +48,36 @@ class PebbleTimeline(object):
     @property
     def fw_map(self):
         if self._fw_map_cache is None:
-            if self._layout_file_path is not None:
-                with open(self._layout_file_path) as f:
-                    self._fw_map_cache = json.load(f)
-            else:
-                with open('timeline/layouts.json') as f:
-                    self._fw_map_cache = json.load(f)
+            layout_file_path = self._layout_file_path or 'timeline/layouts.json'
+            with open(layout_file_path, 'rb') as f:
+                layouts = f.read()
+            self._fw_map_cache = json.loads(layouts)
+            resource_index = self._load_resource_index(layout_file_path, layouts)
+            if resource_index is not None:
+                self._fw_map_cache['resources'] = resource_index
         return self._fw_map_cache
 
+    def _load_resource_index(self, layout_file_path, layouts):
+        # Pins look resources up in the index generate_resource_code.py made of the layouts
+        # file, if there is one and it was made from these layouts. Otherwise the layouts'
+        # own 'resources' dict will do.
+        if timeline_uri_index is None:
+            return None
+        index_path = timeline_uri_index.index_path(layout_file_path)
+        if not os.path.exists(index_path):
+            return None
+        try:
+            index = timeline_uri_index.TimelineUriIndex(index_path)
+        except (IOError, ValueError) as e:
+            self.logger.warning("Couldn't read timeline URI index %s: %s", index_path, e)
+            return None
+        if not index.made_from(layouts):
+            self.logger.warning("Timeline URI index %s is out of date, regenerate it with "
+                                "generate_resource_code.py timeline_uri_index", index_path)
+            index.close()
+            return None
+        return index
+
     def perform_sync(self):
         sync = TimelineWebSync(self.runner.urls, self.oauth)
         for type, pin in sync.update_iter():
@@ -4,7 +4,6 @@ import calendar
 import dateutil.parser
 import logging
 import struct
-import urlparse
 
 from libpebble2.protocol.timeline import TimelineAttribute
 
@@ -56,10 +55,10 @@ class TimelineAttributeSet(object):
         return conversion_methods[attribute_info['type']](value, attribute_info)
 
     def _uri_lookup(self, value, attribute_info):
-        url = urlparse.urlparse(value)
-        if url.scheme == 'system':
-            if value in self.fw_mapping['resources']:
-                res_id = self.fw_mapping['resources'][value]
+        if value.startswith('system://'):
+            # 'resources' is layouts.json's dict, or the TimelineUriIndex made from it
+            res_id = self.fw_mapping['resources'].get(value)
+            if res_id is not None:
                 logger.debug("got res_id %s (%s)", res_id, res_id | (1 << 31))
                 return struct.pack("<I", res_id | (1 << 31))
         # We'll need to handle app resources here, when we know what they look like.
@@ -1,3 +1,10 @@
+import array
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import multiprocessing
 import os.path
 import re
 import sh
@@ -5,6 +12,13 @@ import subprocess
 import sys
 import tempfile
 
+import elf_reader
+import stm32_crc
+
+
+SECTION_NAMES = {'b': '.bss', 'd': '.data', 't': '.text'}
+FINGERPRINT_SECTIONS = ('.text', '.data')
+SIZE_SNAPSHOT_VERSION = 1
 
 NM_LINE_PATTERN = re.compile(r"""([0-9a-f]+)\s+ # address
                              ([0-9a-f]+)\s+ # size
@@ -15,6 +29,8 @@ NM_LINE_PATTERN = re.compile(r"""([0-9a-f]+)\s+ # address
 
 
 class Symbol(object):
+    __slots__ = ('name', 'size')
+
     def __init__(self, name, size):
         self.name = name
         self.size = size
@@ -24,36 +40,46 @@ class Symbol(object):
 
 
 class FileInfo(object):
+    __slots__ = ('filename', 'size', 'symbol_sizes')
+
     def __init__(self, filename):
         self.filename = filename
         self.size = 0
-        self.symbols = {}
+        self.symbol_sizes = {}
+
+    @property
+    def symbols(self):
+        """ {symbol name: Symbol}, made on demand from symbol_sizes. """
+        return dict((name, Symbol(name, size)) for name, size in self.symbol_sizes.iteritems())
 
     def add_entry(self, symbol_name, size):
-        if symbol_name in self.symbols:
+        if symbol_name in self.symbol_sizes:
             return
 
         self.size += size
-        self.symbols[symbol_name] = Symbol(symbol_name, size)
+        self.symbol_sizes[symbol_name] = size
 
     def remove_entry(self, symbol_name):
-        result = self.symbols.pop(symbol_name, None)
-        if result is not None:
-            self.size -= result.size
-        return result
+        size = self.symbol_sizes.pop(symbol_name, None)
+        if size is None:
+            return None
+        self.size -= size
+        return Symbol(symbol_name, size)
 
     def pprint(self, verbose):
         print '  %s: size %u' % (self.filename, self.size)
         if verbose:
-            l = sorted(self.symbols.itervalues(), key=lambda x: -x.size)
-            for s in l:
-                print '    %6u %-36s' % (s.size, s.name)
+            l = sorted(self.symbol_sizes.iteritems(), key=lambda x: -x[1])
+            for name, size in l:
+                print '    %6u %-36s' % (size, name)
 
     def __str__(self):
         return '<FileInfo %s: %u>' % (self.filename, self.size)
 
 
 class SectionInfo(object):
+    __slots__ = ('name', 'count', 'size', 'files')
+
     def __init__(self, name):
         self.name = name
         self.count = 0
@@ -90,46 +116,423 @@ class SectionInfo(object):
                 f.pprint(verbose)
 
 
-def analyze_elf(elf_file_path, sections_letters, use_fast_nm):
-    """ Analyzes the elf file, using binutils.
-        section_letters -- string of letters representing the sections to
-                           analyze, e.g. 'tbd' => text, bss and data.
-        use_fast_nm -- If False, a slow lookup method is used to avoid a bug in
-                    `nm`. If True, the faster `nm -S -l` is used.
-        Returns a dictionary with SectionInfo objects for each section.
+class SymbolTable(object):
+    """ All the symbols of an .elf in one column per field, with the file names
+        interned. Much cheaper to build than SectionInfo objects for firmware sized
+        .elf files, and every report on an .elf can be made from the one table.
     """
-    def make_sections_dict(sections_letters):
+    __slots__ = ('names', 'sections', 'files', 'sizes', 'filenames', '_file_indexes')
+
+    def __init__(self):
+        self.names = []
+        self.sections = array.array('c')
+        self.files = array.array('l')  # indexes into self.filenames
+        self.sizes = array.array('l')
+        self.filenames = []
+        self._file_indexes = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_entry(self, section, symbol_name, filename, size):
+        file_index = self._file_indexes.get(filename)
+        if file_index is None:
+            file_index = self._file_indexes[filename] = len(self.filenames)
+            self.filenames.append(filename)
+        self.names.append(symbol_name)
+        self.sections.append(str(section))
+        self.files.append(file_index)
+        self.sizes.append(size)
+
+    def _rows(self, section=None, filename=None):
+        rows = xrange(len(self.names))
+        if section is not None:
+            rows = [i for i in rows if self.sections[i] == section]
+        if filename is not None:
+            file_index = self._file_indexes.get(filename)
+            rows = [i for i in rows if self.files[i] == file_index]
+        return rows
+
+    def group_by(self, key, section=None, n=None):
+        """ Totals the symbols by 'section', 'file' or 'symbol' name.
+            Returns [(key value, count, size)], the largest first, at most n of them.
+        """
+        if key == 'section':
+            values = self.sections
+        elif key == 'file':
+            values = [self.filenames[i] for i in self.files]
+        elif key == 'symbol':
+            values = self.names
+        else:
+            raise Exception('Invalid key <%s>, must be one of section, file or '
+                            'symbol\n' % key)
+
+        counts = {}
+        sizes = {}
+        for i in self._rows(section):
+            value = values[i]
+            counts[value] = counts.get(value, 0) + 1
+            sizes[value] = sizes.get(value, 0) + self.sizes[i]
+        groups = [(group, counts[group], size) for group, size in sizes.iteritems()]
+        if n is None:
+            return sorted(groups, key=lambda x: -x[2])
+        return heapq.nlargest(n, groups, key=lambda x: x[2])
+
+    def largest_symbols(self, n, section=None, filename=None):
+        """ Returns [(symbol name, filename, size)] of the n largest symbols. """
+        rows = heapq.nlargest(n, self._rows(section, filename), key=self.sizes.__getitem__)
+        return [(self.names[i], self.filenames[self.files[i]], self.sizes[i]) for i in rows]
+
+    def pprint_largest(self, n, sections_letters):
+        for letter in sections_letters:
+            print '%s: largest %u symbols' % (SECTION_NAMES[letter], n)
+            for name, filename, size in self.largest_symbols(n, letter):
+                print '  %6u %-36s %s' % (size, name, filename)
+
+    def section_infos(self, sections_letters):
+        """ Returns a dictionary with SectionInfo objects for each section, see
+            analyze_elf().
+        """
         sections = {}
         for s in sections_letters:
-            if s == 'b':
-                sections['b'] = SectionInfo('.bss')
-            elif s == 'd':
-                sections['d'] = SectionInfo('.data')
-            elif s == 't':
-                sections['t'] = SectionInfo('.text')
+            if s in SECTION_NAMES:
+                sections[s] = SectionInfo(SECTION_NAMES[s])
             else:
                 raise Exception('Invalid section <%s>, must be a combination'
                                 ' of [bdt] characters\n' % s)
+
+        # SectionInfo.add_entry() and FileInfo.add_entry(), inlined: this runs once per
+        # symbol of the .elf
+        file_infos = {}
+        for letter, name, file_index, size in itertools.izip(self.sections, self.names,
+                                                             self.files, self.sizes):
+            section = sections.get(letter)
+            if section is None:
+                continue
+            section.count += 1
+            section.size += size
+
+            file_info = file_infos.get((letter, file_index))
+            if file_info is None:
+                filename = self.filenames[file_index]
+                file_info = section.files[filename] = FileInfo(filename)
+                file_infos[(letter, file_index)] = file_info
+            if name not in file_info.symbol_sizes:
+                file_info.size += size
+                file_info.symbol_sizes[name] = size
         return sections
-    sections = make_sections_dict(sections_letters)
 
-    generator = nm_generator(elf_file_path, use_fast_nm)
-    for (_, section, symbol_name, filename, line, size) in generator:
-        if not filename:
-            filename = 'Unknown'
-        if section in sections:
-            sections[section].add_entry(symbol_name, filename, size)
 
+class SizeChange(object):
+    def __init__(self, name, old_size, new_size):
+        self.name = name
+        self.old_size = old_size
+        self.new_size = new_size
+        self.delta = new_size - old_size
+
+
+class SectionDiff(SizeChange):
+    """ The change of one section between two analyze_elf() results, with the
+        changed files and the changed symbols of each file.
+    """
+    def __init__(self, name, old_section, new_section):
+        old_files = old_section.files if old_section else {}
+        new_files = new_section.files if new_section else {}
+        SizeChange.__init__(self, name, old_section.size if old_section else 0,
+                            new_section.size if new_section else 0)
+
+        self.files = []
+        for filename in set(old_files) | set(new_files):
+            old_symbols = old_files[filename].symbol_sizes if filename in old_files else {}
+            new_symbols = new_files[filename].symbol_sizes if filename in new_files else {}
+            symbols = []
+            for symbol_name in set(old_symbols) | set(new_symbols):
+                old_size = old_symbols.get(symbol_name, 0)
+                new_size = new_symbols.get(symbol_name, 0)
+                if old_size != new_size:
+                    symbols.append(SizeChange(symbol_name, old_size, new_size))
+            if symbols:
+                file_change = SizeChange(filename,
+                                         old_files[filename].size if filename in old_files else 0,
+                                         new_files[filename].size if filename in new_files else 0)
+                file_change.symbols = sorted(symbols, key=lambda x: -abs(x.delta))
+                self.files.append(file_change)
+        self.files.sort(key=lambda x: -abs(x.delta))
+
+    def pprint(self, summary, verbose):
+        print '%s: size %u -> %u (%+d)' % (self.name, self.old_size, self.new_size, self.delta)
+
+        if not summary:
+            for f in self.files:
+                print '  %s: size %u -> %u (%+d)' % (f.name, f.old_size, f.new_size, f.delta)
+                if verbose:
+                    for s in f.symbols:
+                        print '    %+6d %-36s' % (s.delta, s.name)
+
+
+def diff_sections(old_sections, new_sections):
+    """ Compares two analyze_elf() results (or snapshots of them).
+        Returns a dictionary with a SectionDiff for each section in either.
+    """
+    return dict((letter, SectionDiff((new_sections.get(letter) or old_sections[letter]).name,
+                                     old_sections.get(letter), new_sections.get(letter)))
+                for letter in set(old_sections) | set(new_sections))
+
+
+def size_snapshot(sections):
+    """ Returns analyze_elf() results as a compact, json-able dictionary. """
+    return dict((s.name, {'count': s.count,
+                          'size': s.size,
+                          'files': dict((f.filename, f.symbol_sizes)
+                                        for f in s.files.itervalues())})
+                for s in sections.itervalues())
+
+
+def sections_from_snapshot(snapshot):
+    """ The inverse of size_snapshot(). """
+    letters = dict((name, letter) for letter, name in SECTION_NAMES.iteritems())
+    sections = {}
+    for name, section_snapshot in snapshot.iteritems():
+        section = SectionInfo(name)
+        for filename, symbols in section_snapshot['files'].iteritems():
+            for symbol_name, size in symbols.iteritems():
+                section.add_entry(symbol_name, filename, size)
+        section.count = section_snapshot['count']
+        section.size = section_snapshot['size']
+        sections[letters.get(name, name)] = section
     return sections
 
 
-def nm_generator(elf_path, use_fast_nm=True):
+def write_size_snapshot(path, builds):
+    """ Writes {elf path: analyze_elf() results} to a json snapshot file. """
+    snapshot = {'version': SIZE_SNAPSHOT_VERSION,
+                'builds': dict((elf_path, size_snapshot(sections))
+                               for elf_path, sections in builds.iteritems())}
+    with open(path, 'w') as f:
+        json.dump(snapshot, f, sort_keys=True, separators=(',', ':'))
+
+
+def read_size_snapshot(path):
+    """ Reads a snapshot written by write_size_snapshot().
+        Returns {elf path: sections}, the sections as analyze_elf() returns them.
+    """
+    with open(path) as f:
+        snapshot = json.load(f)
+    if snapshot.get('version') != SIZE_SNAPSHOT_VERSION:
+        raise Exception('Unsupported size snapshot version %s in %s'
+                        % (snapshot.get('version'), path))
+    return dict((str(elf_path), sections_from_snapshot(sections))
+                for elf_path, sections in snapshot['builds'].iteritems())
+
+
+def snapshot_sections_for(builds, elf_path, snapshot_path='the size snapshot'):
+    """ Finds the baseline for elf_path in the builds of a snapshot. Builds are matched on
+        their path only, so each platform is compared against its own build.
+    """
+    wanted = os.path.normpath(elf_path)
+    for path, sections in builds.iteritems():
+        if os.path.normpath(path) == wanted:
+            return sections
+    raise Exception('%s has no size snapshot for %s' % (snapshot_path, elf_path))
+
+
+def parse_size_budget(budget):
+    """ Parses a growth budget such as 'text=512' (bytes) or 'bss=2%' (of the old
+        size). Returns (section letter, limit, is_percentage).
+    """
+    try:
+        section, limit = budget.split('=', 1)
+        section = section.strip().lstrip('.').lower()
+        letter = dict((name[1:], l) for l, name in SECTION_NAMES.iteritems()).get(section, section)
+        if letter not in SECTION_NAMES:
+            raise ValueError
+        is_percentage = limit.endswith('%')
+        return letter, float(limit.rstrip('%')), is_percentage
+    except ValueError:
+        raise Exception('Invalid size budget <%s>, must look like text=512 or bss=2%%'
+                        % budget)
+
+
+def size_budget_violations(diffs, budgets):
+    """ Checks diff_sections() results against parse_size_budget() budgets.
+        Returns a list of messages, one per section that grew past its budget.
+    """
+    violations = []
+    for letter, limit, is_percentage in budgets:
+        diff = diffs.get(letter)
+        if diff is None:
+            continue
+        allowed = diff.old_size * limit / 100 if is_percentage else limit
+        if diff.delta > allowed:
+            violations.append('%s grew by %d bytes (%u -> %u), the budget is %s%s'
+                              % (diff.name, diff.delta, diff.old_size, diff.new_size,
+                                 '%g' % limit, '%' if is_percentage else ' bytes'))
+    return violations
+
+
+def analyze_elf(elf_file_path, sections_letters, use_fast_nm, use_native=True):
+    """ Analyzes the elf file.
+        section_letters -- string of letters representing the sections to
+                           analyze, e.g. 'tbd' => text, bss and data.
+        use_fast_nm -- If False, a slow lookup method is used to avoid a bug in
+                    `nm`. If True, the faster `nm -S -l` is used.
+        use_native -- If True, the symbols are read straight from the .elf
+                    and binutils is only used for files that can't be read.
+        Returns a dictionary with SectionInfo objects for each section.
+    """
+    table = symbol_table(elf_file_path, use_fast_nm, use_native)
+    return table.section_infos(sections_letters)
+
+
+def symbol_table(elf_file_path, use_fast_nm=True, use_native=True):
+    """ Reads the symbols of the elf file into a SymbolTable, see analyze_elf()
+        for the arguments.
+    """
+    table = SymbolTable()
+    generator = nm_generator(elf_file_path, use_fast_nm, use_native)
+    for (_, section, symbol_name, filename, line, size) in generator:
+        table.add_entry(section, symbol_name, filename or 'Unknown', size)
+    return table
+
+
+def nm_generator(elf_path, use_fast_nm=True, use_native=True):
+    if use_native:
+        try:
+            return _nm_generator_native(elf_reader.ElfReader(elf_path))
+        except elf_reader.ElfError:
+            pass
     if use_fast_nm:
         return _nm_generator_fast(elf_path)
     else:
         return _nm_generator_slow(elf_path)
 
 
+class Symbolizer(object):
+    """ Resolves code addresses to 'file:line' strings, the way addr2line does.
+
+        Each .elf is read once with elf_reader, or, if it can't be read natively,
+        handed to one long-lived addr2line process that is fed whole batches of
+        addresses. Results are cached by (.elf modification time, address), so a
+        rebuilt .elf is picked up while repeated crashes cost nothing.
+        Addresses without debug information come back as unknown.
+    """
+    UNKNOWN = '??:0'
+    BATCH_SIZE = 256
+
+    def __init__(self, use_native=True, addr2line='arm-none-eabi-addr2line', unknown=UNKNOWN):
+        self.use_native = use_native
+        self.addr2line = addr2line
+        self.unknown = unknown
+        self._backends = {}  # elf path -> (mtime, ElfReader or addr2line process)
+        self._cache = {}  # (elf path, mtime, address) -> 'file:line'
+
+    def lookup(self, elf_path, address):
+        return self.symbolize(elf_path, [address])[0]
+
+    def symbolize(self, elf_path, addresses):
+        """ Returns a 'file:line' string for each of the addresses, self.unknown for
+            the ones without debug information or that addr2line failed on.
+            Raises OSError if the .elf can only be read by addr2line and that isn't
+            installed.
+        """
+        mtime = os.path.getmtime(elf_path)
+        missing = [a for a in set(addresses) if (elf_path, mtime, a) not in self._cache]
+        if missing:
+            backend = self._backend(elf_path, mtime)
+            if isinstance(backend, elf_reader.ElfReader):
+                results = [self._native_line(backend, a) for a in missing]
+            else:
+                results = self._addr2line_lines(elf_path, missing)
+            for address, result in zip(missing, results):
+                # None is a failed lookup, which is worth trying again next time
+                if result is not None:
+                    self._cache[(elf_path, mtime, address)] = result
+        return [self._cache.get((elf_path, mtime, a), self.unknown) for a in addresses]
+
+    def close(self):
+        for elf_path in self._backends.keys():
+            self._close_backend(elf_path)
+
+    def _backend(self, elf_path, mtime):
+        if elf_path in self._backends:
+            backend_mtime, backend = self._backends[elf_path]
+            if backend_mtime == mtime and not self._exited(backend):
+                return backend
+            self._close_backend(elf_path)
+
+        backend = None
+        if self.use_native:
+            try:
+                backend = elf_reader.ElfReader(elf_path)
+            except elf_reader.ElfError:
+                pass
+        if backend is None:
+            # Nothing reads addr2line's stderr, so a full pipe would stall it
+            with open(os.devnull, 'w') as devnull:
+                backend = subprocess.Popen([self.addr2line, '-e', elf_path],
+                                           stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE,
+                                           stderr=devnull)
+        self._backends[elf_path] = (mtime, backend)
+        return backend
+
+    def _close_backend(self, elf_path):
+        _, backend = self._backends.pop(elf_path)
+        if isinstance(backend, elf_reader.ElfReader):
+            backend.close()
+        elif not self._exited(backend):
+            backend.kill()
+            backend.wait()
+
+    @staticmethod
+    def _exited(backend):
+        return isinstance(backend, subprocess.Popen) and backend.poll() is not None
+
+    def _native_line(self, elf, address):
+        filename, line = elf.source_line(address)
+        if filename is None:
+            return self.unknown
+        return '%s:%u' % (filename, line)
+
+    def _addr2line_lines(self, elf_path, addresses):
+        # addr2line answers every address with exactly one line, so whole batches
+        # can be written before reading; the batches keep both pipes from filling.
+        results = []
+        for start in xrange(0, len(addresses), self.BATCH_SIZE):
+            batch = addresses[start:start + self.BATCH_SIZE]
+            lines = self._addr2line_batch(elf_path, batch)
+            if lines is None:
+                # addr2line died, start it again and give the batch another go
+                self._restart_backend(elf_path)
+                lines = self._addr2line_batch(elf_path, batch)
+            if lines is None:
+                logging.warning("addr2line failed twice on %s, leaving %d addresses unresolved",
+                                elf_path, len(batch))
+                self._restart_backend(elf_path)
+                results.extend([None] * len(batch))
+            else:
+                results.extend(line or self.unknown for line in lines)
+        return results
+
+    def _addr2line_batch(self, elf_path, batch):
+        """ Returns addr2line's stripped line for each address, or None if it died """
+        process = self._backends[elf_path][1]
+        try:
+            process.stdin.write(''.join('0x%x\n' % a for a in batch))
+            process.stdin.flush()
+            lines = [process.stdout.readline() for _ in batch]
+        except IOError:
+            return None
+        if not lines[-1]:
+            # Every answer ends in a newline, so an empty one means addr2line exited
+            return None
+        return [line.strip() for line in lines]
+
+    def _restart_backend(self, elf_path):
+        self._close_backend(elf_path)
+        self._backend(elf_path, os.path.getmtime(elf_path))
+
+
 def _get_symbols_table(f):
     # NOTE: nm crashes when we pass in the -l command line option. As a
     # workaround, we use readelf to get the symbol to address mappings and then
@@ -146,14 +549,9 @@ def _get_symbols_table(f):
                                   (\S+)             # symbol name
                                   """, flags=re.VERBOSE)
 
-    def create_addr2line_process():
-        return subprocess.Popen(['arm-none-eabi-addr2line', '-e', f],
-                                stdin=subprocess.PIPE,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-    addr2line = create_addr2line_process()
-
-    symbols = {}
+    # Symbols without line information are ('?', '0')
+    symbolizer = Symbolizer(use_native=False, unknown='?:0')
+    addresses = {}
     for line_num, line in enumerate(infile):
         if (line_num % 300) == 0:
             sys.stdout.write(".")
@@ -167,29 +565,19 @@ def _get_symbols_table(f):
         type = match.group(4)
         if type not in ['FUNC', 'OBJECT']:
             continue
-        addr = match.group(2)
-        symbol_name = match.group(8)
+        addresses[match.group(8)] = int(match.group(2), 16)
 
-        success = False
-        while not success:
-            try:
-                addr2line.stdin.write("0x%s\n" % addr)
-                success = True
-            except IOError:
-                # This happens if the previous iteration caused an error
-                addr2line = create_addr2line_process()
-
-        src_file_line = addr2line.stdout.readline().strip()
-        if src_file_line:
-            # Some Bluetopia paths start with 'C:\...'
-            components = src_file_line.split(':')
-            src_file = ":".join(components[:-1])
-            line = components[-1:][0]
-        else:
-            (src_file, line) = ('?', '0')
-        symbols[symbol_name] = (src_file, line)
+    names = addresses.keys()
+    lines = symbolizer.symbolize(f, [addresses[name] for name in names])
+    symbolizer.close()
 
-    addr2line.kill()
+    symbols = {}
+    for symbol_name, src_file_line in zip(names, lines):
+        # Some Bluetopia paths start with 'C:\...'
+        components = src_file_line.split(':')
+        src_file = ":".join(components[:-1])
+        line = components[-1:][0]
+        symbols[symbol_name] = (src_file, line)
 
     print
     return symbols
@@ -265,6 +653,20 @@ def _nm_generator_fast(f):
         yield (addr, section, symbol_name, rel_file_path, line, size)
 
 
+def _nm_generator_native(elf):
+    """ Generates the same tuples as _nm_generator_fast() from an ElfReader,
+        without running any of the binutils.
+
+    """
+    with elf:
+        for (addr, section, symbol_name, file_path, line, size) in elf.symbol_table():
+            if section == 'r':
+                section = 't'
+            rel_file_path = os.path.relpath(file_path) if file_path else None
+
+            yield (addr, section, symbol_name, rel_file_path, line, size)
+
+
 def size(elf_path):
     """ Returns size (text, data, bss)
 
@@ -286,8 +688,62 @@ def section_bytes(elf_path, section_name):
     """ Returns the bytes in a section of a given .elf file
 
     """
+    try:
+        with elf_reader.ElfReader(elf_path) as elf:
+            return elf.section_data(section_name)
+    except elf_reader.ElfError:
+        pass
+
     with tempfile.NamedTemporaryFile() as temp:
         sh.arm_none_eabi_objcopy(['-j', section_name, '-O', 'binary',
                                   elf_path, temp.name])
         with open(temp.name) as f:
             return f.read()
+
+
+def section_crcs(elf_path, section_names=FINGERPRINT_SECTIONS):
+    """ Returns {section name: STM32 CRC} of sections of a given .elf file,
+        computed straight from the mapped file. Missing and .bss style sections
+        get the CRC of no data.
+
+    """
+    with elf_reader.ElfReader(elf_path) as elf:
+        return dict((name, stm32_crc.crc32(elf.section_buffer(name)))
+                    for name in section_names)
+
+
+def section_digests(elf_path, section_names=FINGERPRINT_SECTIONS, algorithm='sha1'):
+    """ Returns {section name: hex digest} of sections of a given .elf file, using
+        any hashlib algorithm.
+
+    """
+    digests = {}
+    with elf_reader.ElfReader(elf_path) as elf:
+        for name in section_names:
+            digest = hashlib.new(algorithm)
+            digest.update(elf.section_buffer(name))
+            digests[name] = digest.hexdigest()
+    return digests
+
+
+def elf_fingerprints(elf_paths, section_names=FINGERPRINT_SECTIONS, processes=1):
+    """ Returns {elf path: section_crcs()} for many .elf files, reading them in
+        parallel when processes > 1.
+
+    """
+    jobs = [(elf_path, tuple(section_names)) for elf_path in elf_paths]
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_section_crcs_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_section_crcs_job, jobs)
+    return dict(zip(elf_paths, results))
+
+
+def _section_crcs_job(job):
+    # multiprocessing can only call module level functions
+    return section_crcs(*job)
@@ -2,12 +2,14 @@
 
 import StringIO
 import argparse
+import math
 import os
 import struct
 import sys
 import png
 import itertools
 
+import build_trace
 import generate_c_byte_array
 from pebble_image_routines import rgba32_triplet_to_argb8, num_colors_to_bitdepth, \
     pebble_nearest_color_to_pebble_palette, pebble_truncate_color_to_pebble_palette
@@ -46,6 +48,10 @@ NEAREST = "nearest"
 COLOR_REDUCTION_CHOICES = [TRUNCATE, NEAREST]
 DEFAULT_COLOR_REDUCTION = NEAREST
 
+# most colors an atlas sheet may share before its sprites spill onto another sheet,
+# 16 keeps color sheets at the largest palettized bitdepth (4)
+DEFAULT_ATLAS_MAX_COLORS = 16
+
 # Bitmap struct only contains a color palette for GBitmapFormat(1/2/4)BitPalette
 
 # Bitmap struct (NB: All fields are little-endian)
@@ -64,7 +70,8 @@ DEFAULT_COLOR_REDUCTION = NEAREST
 
 class PebbleBitmap(object):
     def __init__(self, path, color_map=WHITE_COLOR_MAP, bitmap_format=DEFAULT_FORMAT,
-                 color_reduction_method=DEFAULT_COLOR_REDUCTION, crop=True):
+                 color_reduction_method=DEFAULT_COLOR_REDUCTION, crop=True, streaming=False,
+                 pixels=None):
         self.version = 1
         self.path = path
         self.name, _ = os.path.splitext(os.path.basename(path))
@@ -73,15 +80,18 @@ class PebbleBitmap(object):
         self.bitdepth = 0  # number of bits per pixel, 0 for legacy b&w
         self.bitmap_format = bitmap_format
         self.color_reduction_method = color_reduction_method
-        width, height, pixels, metadata = png.Reader(filename=path).asRGBA8()
+        if pixels is not None:
+            # image composed in memory (atlas sheets), path only names the outputs
+            width, height, pixels = pixels
+        else:
+            width, height, pixels, metadata = png.Reader(filename=path).asRGBA8()
 
-        # convert planar boxed row flat pixel to 2d array of (R, G, B, A) 
-        self._im_pixels = []
-        for row in pixels:
-            row_list = []
-            for (r, g, b, a) in grouper(row, 4):
-                row_list.append((r, g, b, a))
-            self._im_pixels.append(row_list)
+        if streaming:
+            # rows are decoded again for every pass, keeping only a few in memory
+            self._im_pixels = None
+        else:
+            # keep each boxed row as a flat (R, G, B, A, R, G, B, A, ...) byte buffer
+            self._im_pixels = [bytearray(row) for row in pixels]
 
         self._im_size = (width, height)
         self._set_bbox(crop)
@@ -91,24 +101,7 @@ class PebbleBitmap(object):
         right, bottom = self._im_size
 
         if crop:
-            alphas = [[p[3] for p in row] for row in self._im_pixels]
-            alphas_transposed = zip(*alphas)
-            for row in alphas:
-                if any(row):
-                    break
-                top += 1
-            for row in reversed(alphas):
-                if any(row):
-                    break
-                bottom -= 1
-            for row in alphas_transposed:
-                if any(row):
-                    break
-                left += 1
-            for row in reversed(alphas_transposed):
-                if any(row):
-                    break
-                right -= 1
+            left, top, right, bottom = alpha_bbox(self._rows(), *self._im_size)
 
         self.x = left
         self.y = top
@@ -146,61 +139,70 @@ class PebbleBitmap(object):
                            self.w,
                            self.h)
 
-    def image_bits_bw(self):
-        """
-        Return a raw b/w bitmap capable of being rendered using Pebble's bitblt graphics routines.
+    def _rows(self):
+        """Return an iterator over all the flat RGBA8 rows of the image."""
+        if self._im_pixels is not None:
+            return iter(self._im_pixels)
 
-        The returned bitmap will always be y * row_size_bytes large.
+        # streaming mode: decode the png again rather than keeping every row around
+        width, height, pixels, metadata = png.Reader(filename=self.path).asRGBA8()
+        return iter(pixels)
+
+    def _cropped_rows(self):
+        """Return an iterator over the flat RGBA8 rows inside the bounding box."""
+        return itertools.islice(self._rows(), self.y, max(self.y, self.y + self.h))
+
+    def image_rows_bw(self):
+        """
+        Yield the raw b/w bitmap one row_size_bytes long row at a time.
         """
 
-        def get_monochrome_value_for_pixel(pixel):
-            if pixel[3] < 127:
-                return self.color_map['transparent']
-            if ((pixel[0] + pixel[1] + pixel[2]) / 3) < 127:
-                return self.color_map['black']
-            return self.color_map['white']
-
-        def pack_pixels_to_bitblt_word(pixels, x_offset, x_max):
-            word = 0
-            for column in xrange(0, 32):
-                x = x_offset + column
-                if (x < x_max):
-                    pixel = pixels[x]
-                    word |= get_monochrome_value_for_pixel(pixel) << (column)
-
-            return struct.pack('<I', word)
-
-        src_pixels = self._im_pixels
-        out_pixels = []
-        row_size_words = self.row_size_bytes() / 4
-
-        for row in xrange(self.y, self.y + self.h):
-            x_max = self._im_size[0]
-            for column_word in xrange(0, row_size_words):
-                x_offset = self.x + column_word * 32
-                out_pixels.append(pack_pixels_to_bitblt_word(src_pixels[row],
-                                                             x_offset,
-                                                             x_max))
-
-        return ''.join(out_pixels)
+        row_size_bytes = self.row_size_bytes()
+        if row_size_bytes <= 0:
+            return
+
+        transparent = str(self.color_map['transparent'])
+        black = str(self.color_map['black'])
+        white = str(self.color_map['white'])
+        row_hex_format = '%0{}x'.format(row_size_bytes * 2)
+
+        for row in self._cropped_rows():
+            # bitblt words are filled LSB-first, so build the row's bit string from the
+            # rightmost pixel and let int() pack the whole row in one go.
+            # (r + g + b) < 381 is the integer form of an average luminance below 127
+            bits = ''.join(transparent if a < 127 else (black if r + g + b < 381 else white)
+                           for (r, g, b, a) in reversed(row_pixels(row, self.x, self.w)))
+            row_value = int(bits, 2) if bits else 0
+            # big-endian hex of the row value, reversed, gives the little-endian words
+            yield (row_hex_format % row_value).decode('hex')[::-1]
 
-    def image_bits_color(self):
+    def image_bits_bw(self):
         """
-        Return a raw color bitmap capable of being rendered using Pebble's bitblt graphics routines.
+        Return a raw b/w bitmap capable of being rendered using Pebble's bitblt graphics routines.
+
+        The returned bitmap will always be y * row_size_bytes large.
         """
+        return ''.join(self.image_rows_bw())
 
+    def prepare_color(self):
+        """Set up the bitdepth and palette that image_rows_color packs against."""
         if self.bitmap_format == FORMAT_COLOR_RAW:
             self.bitdepth = 8  # forced to 8-bit depth for color_raw, no palette
         else:
             self.generate_palette()
 
-        out_pixels = []
-        for row in xrange(self.y, self.y + self.h):
+    def image_rows_color(self):
+        """
+        Yield the raw color bitmap one byte-aligned row at a time.
+
+        prepare_color() must have been called first.
+        """
+
+        for row in self._cropped_rows():
+            out_pixels = []
             packed_count = 0
             packed_value = 0
-            for column in xrange(self.x, self.x + self.w):
-                pixel = self._im_pixels[row][column]
-                r, g, b, a = [pixel[i] for i in range(4)]
+            for (r, g, b, a) in row_pixels(row, self.x, self.w):
                 if a == 0:
                     # clear values in transparent pixels
                     r, g, b = (0, 0, 0)
@@ -234,13 +236,30 @@ class PebbleBitmap(object):
             if (packed_count):
                 out_pixels.append(struct.pack("B", packed_value))
 
-        return ''.join(out_pixels)
+            yield ''.join(out_pixels)
 
-    def image_bits(self):
+    def image_bits_color(self):
+        """
+        Return a raw color bitmap capable of being rendered using Pebble's bitblt graphics routines.
+        """
+        self.prepare_color()
+        return ''.join(self.image_rows_color())
+
+    def image_rows(self):
+        """
+        Return an iterator over the rows of image data.
+
+        Any palette is generated before this returns, so the header can be written while
+        the rows are still being produced.
+        """
         if self.bitmap_format == FORMAT_COLOR or self.bitmap_format == FORMAT_COLOR_RAW:
-            return self.image_bits_color()
+            self.prepare_color()
+            return self.image_rows_color()
         else:
-            return self.image_bits_bw()
+            return self.image_rows_bw()
+
+    def image_bits(self):
+        return ''.join(self.image_rows())
 
     def header(self):
         f = StringIO.StringIO()
@@ -268,10 +287,11 @@ class PebbleBitmap(object):
     def convert_to_pbi(self, pbi_file=None):
         to_file = pbi_file if pbi_file else (os.path.splitext(self.path)[0] + '.pbi')
         with open(to_file, 'wb') as f:
-            image_data = self.image_bits()  # compute before generating header
+            image_rows = self.image_rows()  # compute before generating header
 
             f.write(self.pbi_header())
-            f.write(image_data)
+            for row in image_rows:
+                f.write(row)
             if (self.palette and self.bitdepth < 8):
                 # write out palette, padded to the bitdepth
                 for i in xrange(0, 2 ** self.bitdepth):
@@ -282,50 +302,234 @@ class PebbleBitmap(object):
         return to_file
 
     def generate_palette(self):
-        self.palette = []
-        for row in xrange(self.y, self.y + self.h):
-            for column in xrange(self.x, self.x + self.w):
-                pixel = self._im_pixels[row][column]
-                r, g, b, a = [pixel[i] for i in range(4)]
-
+        palette = set()
+        for row in self._cropped_rows():
+            for (r, g, b, a) in row_pixels(row, self.x, self.w):
                 # convert RGBA 32-bit image colors to pebble color table
                 if self.color_reduction_method == NEAREST:
                     (r, g, b, a) = pebble_nearest_color_to_pebble_palette(r, g, b, a)
                 else:
                     (r, g, b, a) = pebble_truncate_color_to_pebble_palette(r, g, b, a)
 
-                # store color value as ARGB8 entry in the palette
-                self.palette.append(rgba32_triplet_to_argb8(r, g, b, a))
+                # store color value as ARGB8 entry in the palette, dropping duplicates
+                palette.add(rgba32_triplet_to_argb8(r, g, b, a))
 
-        # remove duplicate colors
-        self.palette = list(set(self.palette))
+        self.palette = list(palette)
 
         # get the bitdepth for the number of colors
         self.bitdepth = num_colors_to_bitdepth(len(self.palette))
 
 
+class PebbleBitmapAtlas(object):
+    """
+    Packs the cropped images of several pngs into as few shared bitmap sheets as possible.
+
+    Sprites are grouped onto sheets whose combined palette stays within max_colors, then
+    placed tallest first, left to right, on shelves of the sheet's width. Each sheet is
+    converted like any other PebbleBitmap and the sub-rect of every sprite is written to
+    a C header, so an icon set costs one resource per sheet instead of one per image.
+
+    Sprites are named after their png's file name, which must be unique within the atlas.
+    A fully transparent sprite takes no space and gets an empty rect on the first sheet.
+    """
+
+    def __init__(self, name, paths, color_map=WHITE_COLOR_MAP, bitmap_format=DEFAULT_FORMAT,
+                 color_reduction_method=DEFAULT_COLOR_REDUCTION, crop=True, streaming=False,
+                 sheet_width=None, max_colors=DEFAULT_ATLAS_MAX_COLORS):
+        self.name = name
+        self.color_map = color_map
+        self.bitmap_format = bitmap_format
+        self.color_reduction_method = color_reduction_method
+        self.sprites = [PebbleBitmap(path, color_map, bitmap_format, color_reduction_method,
+                                     crop=crop, streaming=streaming) for path in paths]
+
+        paths_by_name = {}
+        for sprite in self.sprites:
+            if sprite.name in paths_by_name:
+                raise Exception("{} and {} would both be sprite {} of atlas {}, rename one of them"
+                                .format(paths_by_name[sprite.name], sprite.path, sprite.name, name))
+            paths_by_name[sprite.name] = sprite.path
+
+        visible = [sprite for sprite in self.sprites if not self._is_empty(sprite)]
+        if not visible:
+            raise Exception("Every image of atlas {} is fully transparent".format(name))
+
+        # list of (sheet_width, sheet_height, [(sprite, x, y), ...]) per sheet
+        self.sheets = [self._shelf_pack(group, sheet_width)
+                       for group in self._group_sprites(visible, max_colors)]
+
+    @staticmethod
+    def _is_empty(sprite):
+        # cropping a fully transparent image leaves inverted bounds
+        return sprite.w <= 0 or sprite.h <= 0
+
+    def _group_sprites(self, sprites, max_colors):
+        """Split the sprites into groups that can share one sheet's palette."""
+        ordered = sorted(sprites, key=lambda sprite: (-sprite.h, sprite.name))
+        if self.bitmap_format != FORMAT_COLOR:
+            return [ordered]
+
+        groups = []  # list of (palette set, [sprite, ...])
+        for sprite in ordered:
+            sprite.generate_palette()
+            # gaps between sprites are transparent, which is ARGB8 0
+            colors = set(sprite.palette) | set([0])
+            for group_colors, group in groups:
+                if len(group_colors | colors) <= max_colors:
+                    group_colors |= colors
+                    group.append(sprite)
+                    break
+            else:
+                groups.append((colors, [sprite]))
+
+        return [group for _, group in groups]
+
+    @staticmethod
+    def _shelf_pack(sprites, sheet_width=None):
+        """Place the sprites (tallest first) on shelves and return the sheet layout."""
+        widest = max(sprite.w for sprite in sprites)
+        if sheet_width is None:
+            # aim for a roughly square sheet
+            area = sum(sprite.w * sprite.h for sprite in sprites)
+            sheet_width = int(math.ceil(math.sqrt(area)))
+        sheet_width = max(sheet_width, widest)
+
+        placements = []
+        x, y, shelf_height = (0, 0, 0)
+        for sprite in sprites:
+            if x + sprite.w > sheet_width:
+                x, y, shelf_height = (0, y + shelf_height, 0)
+            placements.append((sprite, x, y))
+            x += sprite.w
+            shelf_height = max(shelf_height, sprite.h)
+
+        # trim the width down to what the shelves actually used
+        used_width = max(x + sprite.w for sprite, x, _ in placements)
+        return used_width, y + shelf_height, placements
+
+    def sheet_bitmap(self, index, path):
+        """Return the PebbleBitmap of a sheet, named after path."""
+        width, height, placements = self.sheets[index]
+        rows = [bytearray(width * 4) for _ in xrange(height)]
+        for sprite, x, y in placements:
+            for dy, row in enumerate(sprite._cropped_rows()):
+                rows[y + dy][x * 4:(x + sprite.w) * 4] = \
+                    bytearray(row[sprite.x * 4:(sprite.x + sprite.w) * 4])
+
+        return PebbleBitmap(path, self.color_map, self.bitmap_format, self.color_reduction_method,
+                            crop=False, pixels=(width, height, rows))
+
+    def sprite_rects(self):
+        """Return the sheet and sub-rect of every sprite, in the order they were added."""
+        rects = {}
+        for sheet_index, (_, _, placements) in enumerate(self.sheets):
+            for sprite, x, y in placements:
+                rects[sprite.name] = {
+                    "name": sprite.name,
+                    "sheet": sheet_index,
+                    "rect": (x, y, sprite.w, sprite.h),
+                    "offset": (sprite.x, sprite.y),
+                }
+        empty = {"sheet": 0, "rect": (0, 0, 0, 0), "offset": (0, 0)}
+        return [rects.get(sprite.name, dict(empty, name=sprite.name)) for sprite in self.sprites]
+
+    def convert_to_pbi(self, output_prefix):
+        """Write one <output_prefix>_<n>.pbi per sheet and return their paths."""
+        to_files = []
+        for i in xrange(len(self.sheets)):
+            to_file = "{}_{}.pbi".format(output_prefix, i)
+            self.sheet_bitmap(i, to_file).convert_to_pbi(to_file)
+            to_files.append(to_file)
+        return to_files
+
+    def convert_to_h(self, header_file):
+        import generate_resource_code
+        generate_resource_code.codegen_atlas_header(header_file, self.name, len(self.sheets),
+                                                    self.sprite_rects())
+        return header_file
+
+
+def row_pixels(row, x, w):
+    """Return the (r, g, b, a) pixels of a flat RGBA8 row from column x to x + w."""
+    start = x * 4
+    end = (x + w) * 4
+    return zip(row[start:end:4], row[start + 1:end:4], row[start + 2:end:4], row[start + 3:end:4])
+
+
+def alpha_bbox(rows, width, height):
+    """
+    Return the (left, top, right, bottom) bounds of the non-transparent pixels in the
+    flat RGBA8 rows of an image.
+
+    Each row is scanned once: its alpha channel is sliced out and stripped of zeros
+    from either end, so no per-pixel work or transposed copy of the image is needed.
+    A fully transparent image returns the same inverted bounds as an empty crop.
+    """
+    left, top = (width, height)
+    right, bottom = (0, 0)
+
+    for y, row in enumerate(rows):
+        alphas = bytearray(row[3::4])
+        first_visible = len(alphas) - len(alphas.lstrip('\0'))
+        if first_visible == len(alphas):
+            continue
+        if top > y:
+            top = y
+        bottom = y + 1
+        left = min(left, first_visible)
+        right = max(right, len(alphas.rstrip('\0')))
+
+    return left, top, right, bottom
+
+
+def crop_bbox(png_path):
+    """
+    Return the (x, y, w, h) region of a png that PebbleBitmap keeps when cropping.
+
+    Rows are decoded and discarded one at a time, so this is cheap enough to run over
+    every bitmap resource of a project.
+    """
+    width, height, pixels, metadata = png.Reader(filename=png_path).asRGBA8()
+    left, top, right, bottom = alpha_bbox(pixels, width, height)
+    return left, top, right - left, bottom - top
+
+
 def cmd_pbi(args):
     pb = PebbleBitmap(args.input_png, bitmap_format=args.format,
-                      color_reduction_method=args.color_reduction_method, crop=not args.disable_crop)
+                      color_reduction_method=args.color_reduction_method, crop=not args.disable_crop,
+                      streaming=args.streaming)
     pb.convert_to_pbi(args.output_pbi)
 
 
 def cmd_header(args):
     pb = PebbleBitmap(args.input_png, bitmap_format=args.format,
-                      color_reduction_method=args.color_reduction_method, crop=not args.disable_crop)
+                      color_reduction_method=args.color_reduction_method, crop=not args.disable_crop,
+                      streaming=args.streaming)
     print pb.header()
 
 
 def cmd_white_trans_pbi(args):
-    pb = PebbleBitmap(args.input_png, WHITE_COLOR_MAP, crop=not args.disable_crop)
+    pb = PebbleBitmap(args.input_png, WHITE_COLOR_MAP, crop=not args.disable_crop,
+                      streaming=args.streaming)
     pb.convert_to_pbi(args.output_pbi)
 
 
 def cmd_black_trans_pbi(args):
-    pb = PebbleBitmap(args.input_png, BLACK_COLOR_MAP, crop=not args.disable_crop)
+    pb = PebbleBitmap(args.input_png, BLACK_COLOR_MAP, crop=not args.disable_crop,
+                      streaming=args.streaming)
     pb.convert_to_pbi(args.output_pbi)
 
 
+def cmd_atlas(args):
+    atlas = PebbleBitmapAtlas(os.path.basename(args.output_prefix), args.input_pngs,
+                              bitmap_format=args.atlas_format,
+                              color_reduction_method=args.color_reduction_method,
+                              crop=not args.disable_crop, streaming=args.streaming,
+                              sheet_width=args.sheet_width, max_colors=args.max_colors)
+    atlas.convert_to_pbi(args.output_prefix)
+    atlas.convert_to_h(args.output_prefix + '.h')
+
+
 def process_all_bitmaps():
     directory = "bitmaps"
     paths = []
@@ -347,18 +551,15 @@ def process_all_bitmaps():
         print>> f, "#include \"{0}\"".format(h)
     f.close()
 
-def grouper(iterable, n, fillvalue=None):
-    from itertools import izip_longest
-
-    args = [iter(iterable)] * n
-    return izip_longest(fillvalue=fillvalue, *args)
-
 def process_cmd_line_args():
     parser = argparse.ArgumentParser(description="Generate pebble-usable files from png images")
 
     parser_parent = argparse.ArgumentParser(add_help=False)
     parser_parent.add_argument('--disable_crop', required=False, action='store_true',
                                help='Disable transparent region cropping for PBI output')
+    parser_parent.add_argument('--streaming', required=False, action='store_true',
+                               help='Decode the png row by row on every pass instead of holding '
+                                    'it in memory, for very large images')
     parser_parent.add_argument('--color_reduction_method', metavar='method', required=False,
                                nargs=1, default=NEAREST, choices=COLOR_REDUCTION_CHOICES,
                                help="Method used to convert colors to Pebble's color palette, "
@@ -396,6 +597,22 @@ def process_cmd_line_args():
         black_pbi_parser.add_argument(**arg)
     black_pbi_parser.set_defaults(func=cmd_black_trans_pbi)
 
+    atlas_parser = subparsers.add_parser('atlas', parents=[parser_parent],
+                                         help="pack several pngs into shared .pbi sheets and a "
+                                              ".h of their sub-rects")
+    atlas_parser.add_argument('--format', dest='atlas_format', choices=FORMAT_CHOICES,
+                              default=DEFAULT_FORMAT, help="resulting GBitmap format of the sheets")
+    atlas_parser.add_argument('--sheet_width', type=int, required=False,
+                              help="Width of the sheets, defaults to roughly square sheets")
+    atlas_parser.add_argument('--max_colors', type=int, required=False,
+                              default=DEFAULT_ATLAS_MAX_COLORS,
+                              help="Most colors sprites may share on one color sheet")
+    atlas_parser.add_argument('output_prefix', metavar='OUTPUT_PREFIX',
+                              help="Writes OUTPUT_PREFIX_<n>.pbi sheets and OUTPUT_PREFIX.h")
+    atlas_parser.add_argument('input_pngs', metavar='INPUT_PNG', nargs='+',
+                              help="The png images to pack")
+    atlas_parser.set_defaults(func=cmd_atlas)
+
     args = parser.parse_args()
     args.func(args)
 
@@ -410,4 +627,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with build_trace.tool_phase('bitmapgen'):
+        main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+""" Records how long build tools take to run.
+
+When PEBBLE_BUILD_TRACE names a file, each traced phase appends one JSON
+record to it: name, category, start time and wall/CPU seconds. Tools run
+as separate processes in parallel, so every record is written with a
+single append. With the variable unset, phase() does nothing.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import sys
+import time
+
+TRACE_ENV_VAR = 'PEBBLE_BUILD_TRACE'
+
+
+def cpu_time():
+    """ User + system CPU seconds of this process and its waited-for children """
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+def append_record(path, record):
+    line = json.dumps(record) + '\n'
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def phase(name, category='tool', **args):
+    path = os.environ.get(TRACE_ENV_VAR)
+    if not path:
+        yield
+        return
+
+    start = time.time()
+    start_cpu = cpu_time()
+    try:
+        yield
+    finally:
+        append_record(path, {'name': name,
+                             'cat': category,
+                             'ts': start,
+                             'wall': time.time() - start,
+                             'cpu': cpu_time() - start_cpu,
+                             'pid': os.getpid(),
+                             'args': args})
+
+
+def tool_phase(tool, has_subcommand=True):
+    """ Trace a tool's command line invocation, named after the tool and (if
+    it has one) its subcommand, recording the last file it was given """
+    positional = [arg for arg in sys.argv[1:] if not arg.startswith('-')]
+    name = tool
+    if has_subcommand and positional:
+        name = '{} {}'.format(tool, positional[0])
+    return phase(name, file=os.path.basename(positional[-1]) if positional else '')
@@ -0,0 +1,652 @@
+"""
+Pure python reader for the parts of 32-bit ELF files the SDK tools need: the section
+headers, the symbol table and the DWARF (versions 2 to 5) line and declaration information.
+
+It gives the same symbol -> (section, size, file, line) answers as `nm -l -S` and
+`addr2line`, without needing the ARM toolchain and without a process per lookup.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+ELF_MAGIC = '\x7fELF'
+ELFCLASS32 = 1
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+EM_ARM = 40
+
+SHT_NOBITS = 8
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+
+STT_OBJECT = 1
+STT_FUNC = 2
+
+# DWARF constants, see http://dwarfstd.org/doc/DWARF5.pdf
+DW_TAG_compile_unit = 0x11
+DW_TAG_subprogram = 0x2e
+DW_TAG_variable = 0x34
+DW_AT_location = 0x02
+DW_AT_low_pc = 0x11
+DW_AT_stmt_list = 0x10
+DW_AT_comp_dir = 0x1b
+DW_AT_decl_file = 0x3a
+DW_AT_decl_line = 0x3b
+DW_AT_abstract_origin = 0x31
+DW_AT_specification = 0x47
+DW_OP_addr = 0x03
+DW_FORM_ref_addr = 0x10
+DW_FORM_implicit_const = 0x21
+
+DW_UT_type = 2
+DW_UT_skeleton = 4
+DW_UT_split_compile = 5
+DW_UT_split_type = 6
+
+DW_LNS_copy = 1
+DW_LNS_advance_pc = 2
+DW_LNS_advance_line = 3
+DW_LNS_set_file = 4
+DW_LNS_const_add_pc = 8
+DW_LNS_fixed_advance_pc = 9
+DW_LNE_end_sequence = 1
+DW_LNE_set_address = 2
+DW_LNE_define_file = 3
+DW_LNCT_path = 1
+DW_LNCT_directory_index = 2
+
+Section = namedtuple('Section', 'name type flags address offset size link')
+ElfSymbol = namedtuple('ElfSymbol', 'name address size type section')
+
+
+class ElfError(Exception):
+    pass
+
+
+class ElfReader(object):
+    """ A read-only, mmap backed view of an ELF file.
+
+        The symbol table is read on demand and the DWARF tables are only parsed the
+        first time a source location is asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ElfError("%s is empty" % path)
+
+        try:
+            self._read_section_headers()
+        except (struct.error, IndexError):
+            self.close()
+            raise ElfError("%s is truncated" % path)
+        except ElfError:
+            self.close()
+            raise
+
+        self._line_starts = None
+        self._line_sequences = None
+        self._declarations = None
+
+    def _read_section_headers(self):
+        if self._data[:4] != ELF_MAGIC:
+            raise ElfError("%s is not an ELF file" % self.path)
+        if ord(self._data[4]) != ELFCLASS32:
+            raise ElfError("%s: only 32-bit ELF files are supported" % self.path)
+        if ord(self._data[5]) == ELFDATA2MSB:
+            self.endian = '>'
+        elif ord(self._data[5]) == ELFDATA2LSB:
+            self.endian = '<'
+        else:
+            raise ElfError("%s: unknown data encoding" % self.path)
+
+        (self.type, self.machine, _, self.entry, _, shoff, _, _, _, _,
+         shentsize, shnum, shstrndx) = struct.unpack_from(self.endian + 'HHIIIIIHHHHHH',
+                                                          self._data, 16)
+
+        headers = [struct.unpack_from(self.endian + 'IIIIIII', self._data, shoff + i * shentsize)
+                   for i in xrange(shnum)]
+        names_offset = headers[shstrndx][4] if shnum else 0
+        self.sections = [Section(_cstring(self._data, names_offset + name), sh_type, flags,
+                                 address, offset, size, link)
+                         for (name, sh_type, flags, address, offset, size, link) in headers]
+        self._sections_by_name = dict((s.name, s) for s in self.sections)
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def section(self, name):
+        """ Returns the Section called name, or None. """
+        return self._sections_by_name.get(name)
+
+    def section_data(self, name):
+        """ Returns the contents of the named section as a string, empty for .bss style
+            sections and for sections the file does not have.
+        """
+        return str(self.section_buffer(name))
+
+    def section_buffer(self, name):
+        """ Like section_data(), but returns a read-only buffer straight onto the
+            mapped file instead of a copy. It is only valid until close().
+        """
+        section = self.section(name)
+        if section is None or section.type == SHT_NOBITS:
+            return buffer('')
+        return buffer(self._data, section.offset, section.size)
+
+    def section_letter(self, section):
+        """ Returns the `nm` style letter of an allocated section: 't' for code, 'r' for
+            read-only data, 'd' for data and 'b' for bss. None for everything else.
+        """
+        if not section.flags & SHF_ALLOC:
+            return None
+        if section.type == SHT_NOBITS:
+            return 'b'
+        if section.flags & SHF_EXECINSTR:
+            return 't'
+        if section.flags & SHF_WRITE:
+            return 'd'
+        return 'r'
+
+    def symbols(self):
+        """ Generates an ElfSymbol for every defined entry of the symbol table. """
+        symtab = self.section('.symtab')
+        if symtab is None:
+            return
+        strtab = self.sections[symtab.link]
+        entry = struct.Struct(self.endian + 'IIIBBH')
+        for offset in xrange(symtab.offset, symtab.offset + symtab.size, entry.size):
+            name, value, size, info, _, shndx = entry.unpack_from(self._data, offset)
+            if shndx == SHN_UNDEF or shndx >= SHN_LORESERVE:
+                continue
+            yield ElfSymbol(_cstring(self._data, strtab.offset + name), value, size, info & 0xf,
+                            self.sections[shndx])
+
+    def symbol_table(self):
+        """ Generates (address, section_letter, name, filename, line, size) for every
+            function and object symbol with a size, like `nm -l -S` does.
+
+            filename and line are None when there is no debug information for the symbol.
+        """
+        for symbol in self.symbols():
+            if symbol.type not in (STT_FUNC, STT_OBJECT) or symbol.size == 0:
+                continue
+            letter = self.section_letter(symbol.section)
+            if letter is None:
+                continue
+
+            address = symbol.address
+            if symbol.type == STT_FUNC and self.machine == EM_ARM:
+                address &= ~1  # clear the thumb bit
+            filename, line = self.declaration_line(address)
+            if filename is None and symbol.type == STT_FUNC:
+                filename, line = self.source_line(address)
+            yield (address, letter, symbol.name, filename, line, symbol.size)
+
+    def source_line(self, address):
+        """ Returns the (filename, line) the code at address was generated from, like
+            `addr2line`, or (None, None) when it is not covered by the line tables.
+        """
+        self._parse_dwarf()
+        index = bisect.bisect_right(self._line_starts, address) - 1
+        if index < 0:
+            return None, None
+        start, end, addresses, rows = self._line_sequences[index]
+        if address >= end:
+            return None, None
+        return rows[bisect.bisect_right(addresses, address) - 1]
+
+    def declaration_line(self, address):
+        """ Returns the (filename, line) where the function or variable starting at address
+            is declared, or (None, None).
+        """
+        self._parse_dwarf()
+        return self._declarations.get(address, (None, None))
+
+    ############################################################################
+    # DWARF
+    ############################################################################
+
+    def _parse_dwarf(self):
+        if self._line_sequences is not None:
+            return
+        strings = _DwarfStrings(self.section_data('.debug_str'),
+                                self.section_data('.debug_line_str'))
+        comp_dirs, declarations = self._parse_debug_info(strings)
+        file_tables = self._parse_line_programs(strings, comp_dirs)
+
+        self._declarations = {}
+        for address, (stmt_list, file_index, line) in declarations.iteritems():
+            filename = _index(file_tables.get(stmt_list, []), file_index)
+            if filename is not None:
+                self._declarations[address] = (filename, line)
+
+    def _parse_debug_info(self, strings):
+        """ Returns ({line program offset: compilation directory},
+                     {address: (line program offset, file index, line)}) for all the
+            compilation units, functions and statically allocated variables.
+        """
+        comp_dirs = {}
+        declarations = {}
+        decl_entries = {}  # .debug_info offset -> (line program offset, file index, line)
+        origins = []  # (address, .debug_info offset of the entry it was declared by)
+
+        info = bytearray(self.section_data('.debug_info'))
+        abbrev = bytearray(self.section_data('.debug_abbrev'))
+        offset = 0
+        while offset < len(info):
+            offset_size, unit_end, pos = _unit_header(self.endian, info, offset)
+            version = struct.unpack_from(self.endian + 'H', info, pos)[0]
+            pos += 2
+            if not 2 <= version <= 5:
+                offset = unit_end
+                continue
+            if version >= 5:
+                unit_type, address_size = info[pos], info[pos + 1]
+                abbrev_offset, pos = _read_offset(self.endian, info, pos + 2, offset_size)
+                if unit_type in (DW_UT_skeleton, DW_UT_split_compile):
+                    pos += 8
+                elif unit_type in (DW_UT_type, DW_UT_split_type):
+                    pos += 8 + offset_size
+            else:
+                abbrev_offset, pos = _read_offset(self.endian, info, pos, offset_size)
+                address_size = info[pos]
+                pos += 1
+
+            abbrevs = _parse_abbrevs(abbrev, abbrev_offset)
+            unit = _DwarfUnit(self.endian, version, offset_size, address_size, strings)
+            stmt_list = None
+            while pos < unit_end:
+                entry_offset = pos
+                code, pos = _uleb128(info, pos)
+                if code == 0:
+                    continue
+                tag, specs = abbrevs[code]
+                wanted = tag in (DW_TAG_compile_unit, DW_TAG_subprogram, DW_TAG_variable)
+                attributes = {}
+                for attribute, form, implicit_const in specs:
+                    if form == DW_FORM_implicit_const:
+                        value = implicit_const
+                    else:
+                        value, pos = unit.read_form(info, pos, form)
+                    if wanted:
+                        if (attribute in (DW_AT_abstract_origin, DW_AT_specification) and
+                                form != DW_FORM_ref_addr):
+                            value += offset  # the other reference forms are unit relative
+                        attributes[attribute] = value
+
+                if tag == DW_TAG_compile_unit:
+                    stmt_list = attributes.get(DW_AT_stmt_list)
+                    if stmt_list is not None:
+                        comp_dirs[stmt_list] = attributes.get(DW_AT_comp_dir)
+                elif wanted:
+                    address = None
+                    if tag == DW_TAG_subprogram:
+                        address = attributes.get(DW_AT_low_pc)
+                    else:
+                        location = attributes.get(DW_AT_location)
+                        if (isinstance(location, bytearray) and
+                                len(location) == 1 + address_size and location[0] == DW_OP_addr):
+                            address = unit.unpack_address(location, 1)
+
+                    if DW_AT_decl_file in attributes:
+                        declaration = (stmt_list, attributes[DW_AT_decl_file],
+                                       attributes.get(DW_AT_decl_line))
+                        decl_entries[entry_offset] = declaration
+                        if address is not None:
+                            declarations[address] = declaration
+                    elif address is not None:
+                        # out of line copies of inline functions and definitions of
+                        # declared variables point at the entry with the declaration
+                        origin = attributes.get(DW_AT_abstract_origin,
+                                                attributes.get(DW_AT_specification))
+                        if origin is not None:
+                            origins.append((address, origin))
+            offset = unit_end
+
+        for address, origin in origins:
+            if origin in decl_entries and address not in declarations:
+                declarations[address] = decl_entries[origin]
+        return comp_dirs, declarations
+
+    def _parse_line_programs(self, strings, comp_dirs):
+        """ Builds the address -> line lookup tables and returns the file table of every
+            line program: {line program offset: [filename, ...]}.
+        """
+        data = bytearray(self.section_data('.debug_line'))
+        file_tables = {}
+        sequences = []
+
+        offset = 0
+        while offset < len(data):
+            unit_offset = offset
+            offset_size, unit_end, pos = _unit_header(self.endian, data, offset)
+            version = struct.unpack_from(self.endian + 'H', data, pos)[0]
+            if not 2 <= version <= 5:
+                offset = unit_end
+                continue
+            address_size = 4
+            if version >= 5:
+                address_size = data[pos + 2]
+                pos += 2  # address_size and segment_selector_size
+            header_length, pos = _read_offset(self.endian, data, pos + 2, offset_size)
+            program_start = pos + header_length
+
+            min_instruction_length = data[pos]
+            pos += 2 if version >= 4 else 1  # skip maximum_operations_per_instruction
+            line_base = struct.unpack_from('b', data, pos + 1)[0]
+            line_range = data[pos + 2]
+            opcode_base = data[pos + 3]
+            opcode_lengths = data[pos + 4:pos + 3 + opcode_base]
+            pos += 3 + opcode_base
+
+            if version >= 5:
+                unit = _DwarfUnit(self.endian, version, offset_size, address_size, strings)
+                entries, pos = _read_entry_table(unit, data, pos)
+                comp_dir = entries[0].get(DW_LNCT_path) if entries else None
+                directories = [_join(comp_dir, entry.get(DW_LNCT_path)) for entry in entries]
+                entries, pos = _read_entry_table(unit, data, pos)
+                files = [_join(_index(directories, entry.get(DW_LNCT_directory_index, 0)),
+                               entry.get(DW_LNCT_path)) for entry in entries]
+            else:
+                comp_dir = comp_dirs.get(unit_offset)
+                directories = [comp_dir]
+                while data[pos]:
+                    directory = _cstring(data, pos)
+                    pos += len(directory) + 1
+                    directories.append(_join(comp_dir, directory))
+                pos += 1
+                files = [None]  # file numbers start at 1 before DWARF 5
+                while data[pos]:
+                    filename, pos = _file_entry(data, pos, directories)
+                    files.append(filename)
+            file_tables[unit_offset] = files
+
+            program = _LineProgram(self.endian, files, directories, min_instruction_length,
+                                   line_base, line_range, opcode_base, opcode_lengths)
+            sequences.extend(program.run(data, program_start, unit_end))
+            offset = unit_end
+
+        sequences.sort()
+        self._line_sequences = sequences
+        self._line_starts = [sequence[0] for sequence in sequences]
+        return file_tables
+
+
+class _DwarfStrings(object):
+    """ The .debug_str and .debug_line_str string sections. """
+
+    def __init__(self, strings, line_strings):
+        self.strings = strings
+        self.line_strings = line_strings
+
+
+class _DwarfUnit(object):
+    """ Decodes attribute values for one DWARF unit. """
+
+    FIXED_SIZES = {0x05: 2, 0x06: 4, 0x07: 8, 0x0b: 1, 0x0c: 1, 0x11: 1, 0x12: 2, 0x13: 4,
+                   0x14: 8, 0x1c: 4, 0x1e: 16, 0x20: 8, 0x24: 8, 0x25: 1, 0x26: 2, 0x27: 3,
+                   0x28: 4, 0x29: 1, 0x2a: 2, 0x2b: 3, 0x2c: 4}
+    CONSTANT_FORMATS = {0x05: 'H', 0x06: 'I', 0x07: 'Q', 0x0b: 'B',  # data2, 4, 8, data1
+                        0x11: 'B', 0x12: 'H', 0x13: 'I', 0x14: 'Q'}  # ref1, 2, 4, 8
+    ULEB_FORMS = (0x0f, 0x15, 0x1a, 0x1b, 0x22, 0x23)  # udata, ref_udata, strx, addrx, *listx
+    BLOCK_FORMATS = {0x0a: 'B', 0x03: 'H', 0x04: 'I'}  # block1, block2, block4
+
+    def __init__(self, endian, version, offset_size, address_size, strings):
+        self.endian = endian
+        self.version = version
+        self.offset_size = offset_size
+        self.address_size = address_size
+        self.strings = strings
+
+    def unpack_address(self, data, pos):
+        return struct.unpack_from(self.endian + ('I' if self.address_size == 4 else 'Q'),
+                                  data, pos)[0]
+
+    def read_form(self, data, pos, form):
+        """ Returns (value, new pos) of an attribute value. Values none of the readers use
+            are skipped and returned as None.
+        """
+        if form in self.CONSTANT_FORMATS:
+            return (struct.unpack_from(self.endian + self.CONSTANT_FORMATS[form], data, pos)[0],
+                    pos + self.FIXED_SIZES[form])
+        if form in self.FIXED_SIZES:
+            return None, pos + self.FIXED_SIZES[form]
+        if form in self.ULEB_FORMS:
+            return _uleb128(data, pos)
+        if form == 0x01:  # DW_FORM_addr
+            return self.unpack_address(data, pos), pos + self.address_size
+        if form == 0x08:  # DW_FORM_string
+            end = data.index('\0', pos)
+            return str(data[pos:end]), end + 1
+        if form in (0x0e, 0x1f):  # DW_FORM_strp, DW_FORM_line_strp
+            offset, pos = _read_offset(self.endian, data, pos, self.offset_size)
+            section = self.strings.strings if form == 0x0e else self.strings.line_strings
+            return _cstring(section, offset), pos
+        if form in (0x17, 0x1d):  # DW_FORM_sec_offset, DW_FORM_strp_sup
+            return _read_offset(self.endian, data, pos, self.offset_size)
+        if form == DW_FORM_ref_addr:
+            if self.version == 2:
+                return self.unpack_address(data, pos), pos + self.address_size
+            return _read_offset(self.endian, data, pos, self.offset_size)
+        if form == 0x0d:  # DW_FORM_sdata
+            return _sleb128(data, pos)
+        if form in (0x09, 0x18):  # DW_FORM_block, DW_FORM_exprloc
+            length, pos = _uleb128(data, pos)
+            return data[pos:pos + length], pos + length
+        if form in self.BLOCK_FORMATS:
+            length = struct.unpack_from(self.endian + self.BLOCK_FORMATS[form], data, pos)[0]
+            pos += struct.calcsize(self.BLOCK_FORMATS[form])
+            return data[pos:pos + length], pos + length
+        if form == 0x19:  # DW_FORM_flag_present
+            return True, pos
+        if form == 0x16:  # DW_FORM_indirect
+            form, pos = _uleb128(data, pos)
+            return self.read_form(data, pos, form)
+        raise ElfError("unsupported DWARF form 0x%x" % form)
+
+
+class _LineProgram(object):
+    """ The DWARF line number state machine for one line program. """
+
+    def __init__(self, endian, files, directories, min_instruction_length, line_base,
+                 line_range, opcode_base, opcode_lengths):
+        self.endian = endian
+        self.files = files
+        self.directories = directories
+        self.min_instruction_length = min_instruction_length
+        self.line_base = line_base
+        self.line_range = line_range
+        self.opcode_base = opcode_base
+        self.opcode_lengths = opcode_lengths
+
+    def run(self, data, pos, end):
+        """ Returns the sequences of the program as
+            (start address, end address, [row address, ...], [(filename, line), ...]).
+        """
+        files = self.files
+        sequences = []
+        addresses = []
+        rows = []
+        address, file_index, line = (0, 1, 1)
+
+        while pos < end:
+            opcode = data[pos]
+            pos += 1
+            emit = False
+            if opcode >= self.opcode_base:
+                adjusted = opcode - self.opcode_base
+                address += (adjusted // self.line_range) * self.min_instruction_length
+                line += self.line_base + adjusted % self.line_range
+                emit = True
+            elif opcode == 0:
+                length, pos = _uleb128(data, pos)
+                extended = data[pos]
+                if extended == DW_LNE_end_sequence:
+                    if addresses:
+                        sequences.append((addresses[0], address, addresses, rows))
+                    addresses = []
+                    rows = []
+                    address, file_index, line = (0, 1, 1)
+                elif extended == DW_LNE_set_address:
+                    address = struct.unpack_from(self.endian + ('I' if length == 5 else 'Q'),
+                                                 data, pos + 1)[0]
+                elif extended == DW_LNE_define_file:
+                    files.append(_file_entry(data, pos + 1, self.directories)[0])
+                pos += length
+            elif opcode == DW_LNS_copy:
+                emit = True
+            elif opcode == DW_LNS_advance_pc:
+                operand, pos = _uleb128(data, pos)
+                address += operand * self.min_instruction_length
+            elif opcode == DW_LNS_advance_line:
+                operand, pos = _sleb128(data, pos)
+                line += operand
+            elif opcode == DW_LNS_set_file:
+                file_index, pos = _uleb128(data, pos)
+            elif opcode == DW_LNS_const_add_pc:
+                address += (((255 - self.opcode_base) // self.line_range) *
+                            self.min_instruction_length)
+            elif opcode == DW_LNS_fixed_advance_pc:
+                address += struct.unpack_from(self.endian + 'H', data, pos)[0]
+                pos += 2
+            else:
+                # opcodes that only change state we do not track, skip their operands
+                for _ in xrange(self.opcode_lengths[opcode - 1]):
+                    _, pos = _uleb128(data, pos)
+
+            if emit:
+                row = (_index(files, file_index), line)
+                if addresses and addresses[-1] == address:
+                    # several rows for one address: the last one describes the code there
+                    rows[-1] = row
+                else:
+                    addresses.append(address)
+                    rows.append(row)
+
+        return sequences
+
+
+def _parse_abbrevs(data, offset):
+    """ Returns {code: (tag, [(attribute, form, implicit const), ...])} for the abbreviation
+        table at offset.
+    """
+    abbrevs = {}
+    while True:
+        code, offset = _uleb128(data, offset)
+        if code == 0:
+            return abbrevs
+        tag, offset = _uleb128(data, offset)
+        offset += 1  # has_children, the readers walk every entry in order regardless
+        specs = []
+        while True:
+            attribute, offset = _uleb128(data, offset)
+            form, offset = _uleb128(data, offset)
+            if attribute == 0 and form == 0:
+                break
+            implicit_const = None
+            if form == DW_FORM_implicit_const:
+                implicit_const, offset = _sleb128(data, offset)
+            specs.append((attribute, form, implicit_const))
+        abbrevs[code] = (tag, specs)
+
+
+def _read_entry_table(unit, data, pos):
+    """ Reads a DWARF 5 directory or file name table and returns
+        ([{content type: value}, ...], new pos).
+    """
+    format_count = data[pos]
+    pos += 1
+    formats = []
+    for _ in xrange(format_count):
+        content_type, pos = _uleb128(data, pos)
+        form, pos = _uleb128(data, pos)
+        formats.append((content_type, form))
+    count, pos = _uleb128(data, pos)
+    entries = []
+    for _ in xrange(count):
+        entry = {}
+        for content_type, form in formats:
+            entry[content_type], pos = unit.read_form(data, pos, form)
+        entries.append(entry)
+    return entries, pos
+
+
+def _file_entry(data, pos, directories):
+    """ Reads a DWARF 2 to 4 file entry and returns (full filename, new pos). """
+    filename = _cstring(data, pos)
+    pos += len(filename) + 1
+    directory_index, pos = _uleb128(data, pos)
+    _, pos = _uleb128(data, pos)  # modification time
+    _, pos = _uleb128(data, pos)  # file length
+    return _join(_index(directories, directory_index), filename), pos
+
+
+def _index(values, index):
+    return values[index] if 0 <= index < len(values) else None
+
+
+def _join(directory, path):
+    if path is None or not directory or os.path.isabs(path):
+        return path
+    return os.path.join(directory, path)
+
+
+def _unit_header(endian, data, offset):
+    """ Returns (offset size, unit end, offset past the length) of a DWARF unit header. """
+    unit_length = struct.unpack_from(endian + 'I', data, offset)[0]
+    if unit_length == 0xffffffff:
+        unit_length = struct.unpack_from(endian + 'Q', data, offset + 4)[0]
+        return 8, offset + 12 + unit_length, offset + 12
+    return 4, offset + 4 + unit_length, offset + 4
+
+
+def _read_offset(endian, data, pos, offset_size):
+    return (struct.unpack_from(endian + ('I' if offset_size == 4 else 'Q'), data, pos)[0],
+            pos + offset_size)
+
+
+def _cstring(data, offset):
+    end = data.find('\0', offset)
+    return str(data[offset:end])
+
+
+def _uleb128(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _sleb128(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            if byte & 0x40:
+                result -= 1 << shift
+            return result, pos
@@ -11,6 +11,7 @@ import json
 from math import ceil
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+import build_trace
 import generate_c_byte_array
 
 # Font
@@ -364,4 +365,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with build_trace.tool_phase('fontgen'):
+        main()
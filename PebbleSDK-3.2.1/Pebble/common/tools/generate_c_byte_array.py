@@ -1,8 +1,12 @@
+# "0x%02x, " for every possible byte value
+HEX_BYTES = ["0x%02x, " % byte for byte in xrange(256)]
 
 def write(output_file, bytes, var_name):
     output_file.write("static const uint8_t {var_name}[] = {{\n  ".format(var_name=var_name))
-    for byte, index in zip(bytes, xrange(0, len(bytes))):
-        if index != 0 and index % 16 == 0:
-            output_file.write("/* bytes {0} - {1} */\n  ".format(index - 16, index))
-        output_file.write("0x%02x, " % ord(byte))
+    data = bytearray(bytes)
+    for index in xrange(0, len(data), 16):
+        line = ''.join([HEX_BYTES[byte] for byte in data[index:index + 16]])
+        if index != 0:
+            line = "/* bytes {0} - {1} */\n  ".format(index - 16, index) + line
+        output_file.write(line)
     output_file.write("\n};\n")
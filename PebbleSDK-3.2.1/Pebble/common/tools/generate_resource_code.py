@@ -1,13 +1,44 @@
 #!/usr/bin/env python
 
 import argparse
+import json
 import os
+import re
 import struct
+from contextlib import contextmanager
+from cStringIO import StringIO
 
+import build_trace
 import stm32_crc
 
 import generate_c_byte_array
-
+import timeline_uri_index
+from pbpack import ResourcePack
+
+
+@contextmanager
+def generated_file(filename):
+    """ Collects what is written to the yielded file in memory and only writes filename
+        when that differs from what it already contains, so an unchanged output doesn't
+        make the build recompile everything that includes it.
+    """
+    output_file = StringIO()
+    yield output_file
+    write_if_changed(filename, output_file.getvalue())
+
+def write_if_changed(filename, content, binary=False):
+    """ Returns whether filename had to be (re)written. """
+    mode = 'b' if binary else ''
+    try:
+        if os.path.getsize(filename) == len(content):
+            with open(filename, 'r' + mode) as f:
+                if f.read() == content:
+                    return False
+    except (IOError, OSError):
+        pass
+    with open(filename, 'w' + mode) as f:
+        f.write(content)
+    return True
 
 def split_items(l, n):
     items = []
@@ -16,7 +47,7 @@ def split_items(l, n):
     return items
 
 def codegen_timeline_resource_table(filename, timeline_resources):
-    with open(filename, 'w') as output_file:
+    with generated_file(filename) as output_file:
         output_file.write("""
 //
 // AUTOGENERATED BY tools/generate_resource_code.py
@@ -39,7 +70,7 @@ const uint32_t g_timeline_resources[][3] = {
 """)
 
 def codegen_timeline_ids(filename, timeline_resources):
-    with open(filename, 'w') as output_file:
+    with generated_file(filename) as output_file:
         output_file.write("""
 #pragma once
 
@@ -58,9 +89,67 @@ typedef enum {
         output_file.write("""} TimelineResourceId;
 """)
 
+def codegen_timeline_uri_index(filename, layouts_filename):
+    """ Writes the system:// URI index of a layouts.json (see timeline_uri_index.py), which the
+        phonesim's timeline maps instead of using the layouts' 'resources' dict. """
+    with open(layouts_filename, 'rb') as f:
+        layouts = f.read()
+    resources = json.loads(layouts)["resources"]
+    write_if_changed(filename, timeline_uri_index.pack_index(resources, layouts), binary=True)
+
+def c_identifier(name):
+    return re.sub(r'[^0-9A-Za-z_]', '_', name).upper()
+
+def codegen_atlas_header(filename, atlas_name, num_sheets, sprites):
+    prefix = c_identifier(atlas_name)
+    names = {}
+    for sprite in sprites:
+        identifier = c_identifier(sprite["name"])
+        if identifier in names:
+            raise Exception("Sprites {} and {} of atlas {} would both be {}_{}".format(
+                names[identifier], sprite["name"], atlas_name, prefix, identifier))
+        names[identifier] = sprite["name"]
+    type_name = ''.join(part.capitalize() for part in prefix.split('_')) + 'SpriteId'
+    with generated_file(filename) as output_file:
+        output_file.write("""
+#pragma once
+
+//
+// AUTOGENERATED BY tools/generate_resource_code.py
+// DO NOT MODIFY
+//
+
+#include <pebble.h>
+
+#define {prefix}_NUM_SHEETS {num_sheets}
+
+typedef enum {{
+""".format(prefix=prefix, num_sheets=num_sheets))
+        for i, sprite in enumerate(sprites):
+            output_file.write("  {}_{} = {},\n".format(prefix, c_identifier(sprite["name"]), i))
+
+        output_file.write("  NUM_{}_SPRITES,\n".format(prefix))
+        output_file.write("""}} {type_name};
+
+// Sprite sub-rects within the sheet bitmaps, for gbitmap_create_as_sub_bitmap().
+// offset is where the cropped sprite sits within its original image.
+static const struct {{
+  uint8_t sheet;
+  GRect rect;
+  GPoint offset;
+}} s_{name}_sprites[] = {{
+""".format(type_name=type_name, name=prefix.lower()))
+        for sprite in sprites:
+            output_file.write("  [{}_{}] = {{ {}, {{ {{ {}, {} }}, {{ {}, {} }} }}, {{ {}, {} }} }},\n"
+                              .format(prefix, c_identifier(sprite["name"]), sprite["sheet"],
+                                      *(sprite["rect"] + sprite["offset"])))
+
+        output_file.write("""};
+""")
+
 ################################################################################################
 def cmd_resource_header(args):
-    with open(args.output_header, 'w') as output_file:
+    with generated_file(args.output_header) as output_file:
         output_file.write("""
 #pragma once
 
@@ -92,10 +181,21 @@ typedef enum {{
 
 ################################################################################################
 def cmd_resource_version(args):
-    with open(args.data_file, 'rb') as f:
-        crc = stm32_crc.crc32(f.read())
-
-    with open(args.output_header, 'w') as output_file:
+    # Build rules should pass --manifest. The process_resources rule packed into the SDK's waf
+    # still passes DATA_FILE, but it only generates this header for system resource packs
+    # (is_system), never for app builds.
+    if args.manifest:
+        # The manifest already has the CRC of the data, no need to read all of it again
+        with open(args.manifest, 'rb') as f:
+            num_files, crc, timestamp = ResourcePack.deserialize_manifest(
+                f.read(ResourcePack.MANIFEST_SIZE_BYTES))
+    elif args.data_file:
+        with open(args.data_file, 'rb') as f:
+            crc = stm32_crc.crc32(f.read())
+    else:
+        raise Exception("Either DATA_FILE or --manifest is needed for the CRC")
+
+    with generated_file(args.output_header) as output_file:
         output_file.write("""
 #pragma once
 
@@ -117,7 +217,7 @@ static const ResourceVersion {} = {{
 
 ################################################################################################
 def cmd_font_key_header(args):
-    with open(args.output_header, 'w') as output_file:
+    with generated_file(args.output_header) as output_file:
         output_file.write("""
 #pragma once
 
@@ -138,7 +238,7 @@ def cmd_font_key_header(args):
 
 ################################################################################################
 def cmd_font_key_table(args):
-    with open(args.output_code_file, 'w') as output_file:
+    with generated_file(args.output_code_file) as output_file:
         output_file.write("""
 //
 // AUTOGENERATED BY tools/generate_resource_code.py
@@ -169,7 +269,7 @@ def cmd_pfs_table_table(args):
     if (len(args.resource_data) % 4) is not 0:
         raise Exception ("resource_data must have a number of entries divisible by 4")
 
-    with open(args.output_code_file, 'w') as output_file:
+    with generated_file(args.output_code_file) as output_file:
         output_file.write("""
 //
 // AUTOGENERATED BY tools/generate_resource_code.py
@@ -205,7 +305,7 @@ def cmd_builtin_resources(args):
 
     items = split_items(args.resource_data, tuple_size)
 
-    with open(args.output_code_file, 'w') as output_file:
+    with generated_file(args.output_code_file) as output_file:
         output_file.write("\n//" \
                           "// AUTOGENERATED BY tools/generate_resource_code.py\n" \
                           "// DO NOT MODIFY\n"
@@ -238,6 +338,11 @@ def cmd_builtin_resources(args):
         output_file.write("};\n")
 
 
+def cmd_timeline_uri_index(args):
+    output_file = args.output_file or timeline_uri_index.index_path(args.layouts_file)
+    codegen_timeline_uri_index(output_file, args.layouts_file)
+
+
 ################################################################################################
 def main():
     parser = argparse.ArgumentParser(description="Generate the needed code to use resources")
@@ -268,7 +373,9 @@ def main():
     resource_version_parser.add_argument('resource_include', metavar="RESOURCE_INCLUDE",
         help="Include path to insert into the output file")
     resource_version_parser.add_argument('data_file', metavar="DATA_FILE",
-        help="The data chunk file")
+        help="The data chunk file, CRC'd in full; prefer --manifest", nargs="?")
+    resource_version_parser.add_argument('--manifest', metavar="MANIFEST_FILE",
+        help="Manifest chunk (or whole .pbpack) to take the data CRC from instead of DATA_FILE")
     resource_version_parser.set_defaults(func=cmd_resource_version)
 
     font_key_header_parser = subparsers.add_parser('font_key_header', help="Make the font key header file")
@@ -295,9 +402,18 @@ def main():
     builtin_parser.add_argument('resource_data', metavar="RESOURCE_DATA", help="groups of <input_path> <resource_id>", nargs="*")
     builtin_parser.set_defaults(func=cmd_builtin_resources)
 
+    timeline_index_parser = subparsers.add_parser('timeline_uri_index',
+        help="make the system:// URI to timeline resource id index of a layouts.json")
+    timeline_index_parser.add_argument('layouts_file', metavar="LAYOUTS_FILE",
+        help="layouts.json to index")
+    timeline_index_parser.add_argument('output_file', metavar="OUTPUT_FILE", nargs="?",
+        help="file to write to, by default the .uriidx next to LAYOUTS_FILE")
+    timeline_index_parser.set_defaults(func=cmd_timeline_uri_index)
+
     args = parser.parse_args()
     args.func(args)
 
 
 if __name__ == "__main__":
-    main()
+    with build_trace.tool_phase('generate_resource_code'):
+        main()
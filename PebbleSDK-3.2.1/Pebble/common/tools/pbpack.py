@@ -67,12 +67,16 @@ class ResourcePack(object):
     def serialize_content(self):
         return b"".join(self.contents)
 
+    @classmethod
+    def deserialize_manifest(cls, manifest):
+        """ Returns (num_files, crc, timestamp) from the manifest bytes. """
+        return struct.unpack(cls.MANIFEST_FMT, manifest[:cls.MANIFEST_SIZE_BYTES])
+
     @classmethod
     def deserialize(cls, f_in):
         # Parse manifest:
         manifest = f_in.read(cls.MANIFEST_SIZE_BYTES)
-        fmt = cls.MANIFEST_FMT
-        (num_files, crc, timestamp) = struct.unpack(fmt, manifest)
+        (num_files, crc, timestamp) = cls.deserialize_manifest(manifest)
 
         resource_pack = cls()
 
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
 import argparse
+
+import build_trace
 from pbpack import ResourcePack
 
 def cmd_manifest(args):
@@ -68,4 +70,5 @@ def main():
     args.func(args)
 
 if __name__ == "__main__":
-    main()
+    with build_trace.tool_phase('pbpack'):
+        main()
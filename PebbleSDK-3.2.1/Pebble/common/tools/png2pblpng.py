@@ -1,8 +1,17 @@
 #!/usr/bin/env python
 
 import png
+from array import array
+import hashlib
 import itertools
+import json
+import os
+import StringIO
+import time
+import zlib
+from collections import namedtuple
 
+import build_trace
 from pebble_image_routines import num_colors_to_bitdepth, \
     pebble_nearest_color_to_pebble_palette, pebble_truncate_color_to_pebble_palette
 
@@ -12,20 +21,31 @@ NEAREST = "nearest"
 COLOR_REDUCTION_CHOICES = [TRUNCATE, NEAREST]
 DEFAULT_COLOR_REDUCTION = NEAREST
 
+# zlib compression levels
+DEFAULT_COMPRESSION = 9
+FAST_COMPRESSION = 1  # for development builds where build time matters more than size
+
+# PNG scanline filter types, see http://www.w3.org/TR/PNG/#9Filters
+FILTER_NONE = 0
+FILTER_SUB = 1
+FILTER_UP = 2
+FILTER_AVERAGE = 3
+FILTER_PAETH = 4
+FILTER_NAMES = ['none', 'sub', 'up', 'average', 'paeth']
+
+# (filter_type, compression) combinations tried when tuning output size
+DEFAULT_TUNE_FILTERS = [FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE, FILTER_PAETH]
+DEFAULT_TUNE_COMPRESSIONS = [6, 9]
+DEFAULT_TUNE_CANDIDATES = [(f, c) for c in DEFAULT_TUNE_COMPRESSIONS for f in DEFAULT_TUNE_FILTERS]
+
+TuneResult = namedtuple('TuneResult', 'filter_type compression size seconds')
+
 #public APIs
 def convert_png_to_pebble_png(input_filename, output_filename,
-                              color_reduction_method=DEFAULT_COLOR_REDUCTION):
+                              color_reduction_method=DEFAULT_COLOR_REDUCTION, streaming=False,
+                              compression=DEFAULT_COMPRESSION):
     with open(output_filename, 'wb') as output_file:
-        input_png = png.Reader(filename=input_filename)
-
-        # sbit breaks pypngs convert_rgb_to_rgba routine
-        # and is unnecessary, as it is only an optional optimization
-        # so disable it by loading the PNG pre-data and disabling sbit
-        input_png.preamble()
-        input_png.sbit = None
-
-        #open as RGBA 32-bit (allows for simpler parsing cases)
-        width, height, pixels, metadata = input_png.asRGBA8()
+        width, height, pixels, metadata = _read_rgba8(input_filename)
 
         palette = []  # rgba32 image palette
         is_grey = True  # does the image only contain greyscale pixels (and only full or opaque)
@@ -36,7 +56,12 @@ def convert_png_to_pebble_png(input_filename, output_filename,
         # to be able to parse the data twice (we do not modify the pixel data itself)
         # once to generate the palette
         # once to output the final pixel data as greyscale or palette indexes
-        pixels, pixels2 = itertools.tee(pixels)
+        # tee() buffers every row until the second pass reads it, so in streaming mode
+        # the png is decoded a second time instead
+        if streaming:
+            pixels2 = pixels
+        else:
+            pixels, pixels2 = itertools.tee(pixels)
 
         #convert RGBA 32-bit image colors to pebble color table
         for (r, g, b, a) in grouper(itertools.chain.from_iterable(pixels2), 4):
@@ -89,8 +114,8 @@ def convert_png_to_pebble_png(input_filename, output_filename,
             # get the bitdepth for the number of colors
             bitdepth = num_colors_to_bitdepth(len(palette))
 
-        #convert RGBA 32-bit boxed rows to list for output
-        rgba32_list = grouper(itertools.chain.from_iterable(pixels), 4)
+        if streaming:
+            width, height, pixels, metadata = _read_rgba8(input_filename)
 
         # update data for RGB output format
         if not is_grey and not has_alpha:
@@ -98,36 +123,168 @@ def convert_png_to_pebble_png(input_filename, output_filename,
             palette = [(p_r, p_g, p_b) for p_r, p_g, p_b, p_a in palette]
 
         # second pass of pixel data, converts rgba32 pixels to greyscale or palettized output
-        image = []
-        for (r, g, b, a) in rgba32_list:
-            # operating on original pixel values, need to do the same color reduction
-            # as when the palette was generated
-            if color_reduction_method == NEAREST:
-                (r, g, b, a) = pebble_nearest_color_to_pebble_palette(r, g, b, a)
-            else:
-                (r, g, b, a) = pebble_truncate_color_to_pebble_palette(r, g, b, a)
+        def image_rows():
+            for row in pixels:
+                image_row = []
+                for (r, g, b, a) in grouper(row, 4):
+                    # operating on original pixel values, need to do the same color reduction
+                    # as when the palette was generated
+                    if color_reduction_method == NEAREST:
+                        (r, g, b, a) = pebble_nearest_color_to_pebble_palette(r, g, b, a)
+                    else:
+                        (r, g, b, a) = pebble_truncate_color_to_pebble_palette(r, g, b, a)
 
-            if is_grey:
-                # convert red channel (as luminosity value) to a greyscale at bitdepth
-                # if transparent, output the transparent_grey value for that bitdepth
-                if a == 0:
-                  image.append(transparent_grey)
-                else:
-                  image.append(r >> (8 - bitdepth))
-            elif has_alpha:
-                # append the palette index for output
-                image.append(palette.index((r, g, b, a)))
-            else:
-                # append the palette index for output
-                image.append(palette.index((r, g, b)))
+                    if is_grey:
+                        # convert red channel (as luminosity value) to a greyscale at bitdepth
+                        # if transparent, output the transparent_grey value for that bitdepth
+                        if a == 0:
+                          image_row.append(transparent_grey)
+                        else:
+                          image_row.append(r >> (8 - bitdepth))
+                    elif has_alpha:
+                        # append the palette index for output
+                        image_row.append(palette.index((r, g, b, a)))
+                    else:
+                        # append the palette index for output
+                        image_row.append(palette.index((r, g, b)))
+                yield image_row
 
         if is_grey:
           # remove the palette for greyscale output with writer
           palette = None
 
-        output_png = png.Writer(width=width, height=height, compression=9, bitdepth=bitdepth,
+        output_png = png.Writer(width=width, height=height, compression=compression, bitdepth=bitdepth,
                                 palette=palette, greyscale=is_grey, transparent=transparent_grey)
-        output_png.write_array(output_file, image)
+        # rows are converted as the writer compresses them
+        output_png.write(output_file, image_rows())
+
+
+def tune_cache_key(input_filename, color_reduction_method=DEFAULT_COLOR_REDUCTION):
+    """The key tuning results for the png converted from input_filename are cached under."""
+    with open(input_filename, 'rb') as f:
+        source_hash = hashlib.sha1(f.read()).hexdigest()
+    return '{}:{}'.format(source_hash, color_reduction_method)
+
+
+def tune_png_compression(filename, candidates=DEFAULT_TUNE_CANDIDATES, cache_filename=None,
+                         processes=1, cache_key=None):
+    """
+    Rewrite the png at filename with whichever (filter_type, compression) candidate
+    gives the smallest file.
+
+    Candidates are tried in order and the first of equally small results wins, so the
+    output only depends on the image and the candidate list. When cache_filename is
+    given, the winning parameters are stored in it against cache_key (see
+    tune_cache_key(), by default the sha1 of the png itself) and reused on later runs
+    instead of trying every candidate again.
+
+    Returns (best, results) where results holds a TuneResult for every candidate tried.
+    """
+    with open(filename, 'rb') as f:
+        png_data = f.read()
+    if cache_key is None:
+        cache_key = hashlib.sha1(png_data).hexdigest()
+
+    cache = _load_tune_cache(cache_filename)
+    if cache_key in cache:
+        candidates = [tuple(cache[cache_key])]
+
+    jobs = [(png_data, filter_type, compression) for filter_type, compression in candidates]
+    if processes > 1 and len(jobs) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            encoded = pool.map(_encode_candidate, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        encoded = map(_encode_candidate, jobs)
+
+    results = [result for result, data in encoded]
+    best_index = min(xrange(len(results)), key=lambda i: results[i].size)
+    best = results[best_index]
+
+    with open(filename, 'wb') as f:
+        f.write(encoded[best_index][1])
+
+    if cache_filename is not None and cache.get(cache_key) != [best.filter_type, best.compression]:
+        cache[cache_key] = [best.filter_type, best.compression]
+        with open(cache_filename, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+
+    return best, results
+
+
+def refilter_png(png_data, filter_type, compression):
+    """
+    Return png_data with every scanline run through filter_type and the image data
+    recompressed at the given zlib compression level.
+
+    Only non-interlaced images are supported, which is all png.Writer produces here.
+    """
+    chunks = list(png.Reader(bytes=png_data).chunks())
+
+    decoder = png.Reader(bytes=png_data)
+    decoder.preamble()
+    if decoder.interlace:
+        raise ValueError("interlaced images can not be refiltered")
+    # filter offset is the size of a pixel in bytes, but at least 1
+    filter_offset = max(1, int(decoder.psize))
+
+    image_data = zlib.decompress(''.join(chunk_data for chunk_type, chunk_data in chunks
+                                         if chunk_type == 'IDAT'))
+
+    # undo whatever filters the source used, then filter every row with filter_type
+    filtered = []
+    previous = None
+    for scanline in decoder.iterstraight([array('B', image_data)]):
+        filtered.append(png.filter_scanline(filter_type, scanline, filter_offset, previous).tostring())
+        previous = scanline
+
+    compressor = zlib.compressobj(compression)
+    image_data = compressor.compress(''.join(filtered)) + compressor.flush()
+
+    output_chunks = []
+    for chunk_type, chunk_data in chunks:
+        if chunk_type == 'IDAT':
+            if image_data is not None:
+                output_chunks.append(('IDAT', image_data))
+                image_data = None
+        else:
+            output_chunks.append((chunk_type, chunk_data))
+
+    output = StringIO.StringIO()
+    png.write_chunks(output, output_chunks)
+    return output.getvalue()
+
+
+def _encode_candidate(job):
+    png_data, filter_type, compression = job
+    start = time.time()
+    data = refilter_png(png_data, filter_type, compression)
+    return TuneResult(filter_type, compression, len(data), time.time() - start), data
+
+
+def _load_tune_cache(cache_filename):
+    if cache_filename is None or not os.path.exists(cache_filename):
+        return {}
+    with open(cache_filename) as f:
+        return json.load(f)
+
+
+def _read_rgba8(input_filename):
+    """Open a png for row by row reading as RGBA 32-bit."""
+    input_png = png.Reader(filename=input_filename)
+
+    # sbit breaks pypngs convert_rgb_to_rgba routine
+    # and is unnecessary, as it is only an optional optimization
+    # so disable it by loading the PNG pre-data and disabling sbit
+    input_png.preamble()
+    input_png.sbit = None
+
+    #open as RGBA 32-bit (allows for simpler parsing cases)
+    return input_png.asRGBA8()
 
 
 def grouper(iterable, n, fillvalue=None):
@@ -148,9 +305,54 @@ def main():
                         nargs=1, default=NEAREST, choices=COLOR_REDUCTION_CHOICES,
                         help="Method used to convert colors to Pebble's color palette, "
                              "options are [{}, {}]".format(NEAREST, TRUNCATE))
+    parser.add_argument('--streaming', required=False, action='store_true',
+                        help='Decode the png twice instead of buffering it between passes, '
+                             'for very large images')
+    parser.add_argument('--compression', type=int, required=False, default=DEFAULT_COMPRESSION,
+                        choices=range(10), help='zlib compression level of the output')
+    parser.add_argument('--fast', required=False, action='store_true',
+                        help='Compress at level {} and skip tuning, for development '
+                             'builds'.format(FAST_COMPRESSION))
+    parser.add_argument('--tune', required=False, action='store_true',
+                        help='Try every combination of --tune_filters and --tune_compressions '
+                             'and keep the smallest output')
+    parser.add_argument('--tune_filters', type=int_list, required=False,
+                        default=DEFAULT_TUNE_FILTERS,
+                        help='Comma separated png filter types to try, '
+                             '0-4 for [{}]'.format(', '.join(FILTER_NAMES)))
+    parser.add_argument('--tune_compressions', type=int_list, required=False,
+                        default=DEFAULT_TUNE_COMPRESSIONS,
+                        help='Comma separated zlib compression levels to try')
+    parser.add_argument('--tune_cache', metavar='CACHE_FILE', required=False,
+                        help='JSON file remembering the winning parameters of each image')
+    parser.add_argument('--jobs', type=int, required=False, default=1,
+                        help='Number of processes used to try tuning candidates')
     args = parser.parse_args()
-    convert_png_to_pebble_png(args.input_filename, args.output_filename, args.color_reduction_method)
+
+    tune = args.tune and not args.fast
+    # Tuning recompresses the image data anyway, so don't spend time compressing it well first
+    compression = FAST_COMPRESSION if args.fast or tune else args.compression
+    start = time.time()
+    convert_png_to_pebble_png(args.input_filename, args.output_filename, args.color_reduction_method,
+                              streaming=args.streaming, compression=compression)
+
+    if tune:
+        print "{}: converted in {:.1f} ms".format(args.output_filename, (time.time() - start) * 1000)
+        candidates = [(f, c) for c in args.tune_compressions for f in args.tune_filters]
+        cache_key = tune_cache_key(args.input_filename, args.color_reduction_method)
+        best, results = tune_png_compression(args.output_filename, candidates,
+                                             cache_filename=args.tune_cache, processes=args.jobs,
+                                             cache_key=cache_key)
+        for result in results:
+            print "{} filter {}, compression {}: {} bytes in {:.1f} ms".format(
+                '*' if result is best else ' ', FILTER_NAMES[result.filter_type],
+                result.compression, result.size, result.seconds * 1000)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
 
 
 if __name__ == '__main__':
-    main()
+    with build_trace.tool_phase('png2pblpng', has_subcommand=False):
+        main()
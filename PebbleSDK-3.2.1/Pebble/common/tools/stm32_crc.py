@@ -1,3 +1,6 @@
+import array
+import zlib
+
 CRC_POLY = 0x04C11DB7
 
 def precompute_table(bits):
@@ -14,6 +17,15 @@ def precompute_table(bits):
 
 lookup_table = precompute_table(8)
 
+# The STM32 CRC is the plain (MSB first) CRC-32 of the buffer's little endian words. zlib
+# implements the same polynomial LSB first, so feeding it the words' bytes in MSB first
+# order with every byte's bits reversed gives the bit reversed STM32 register.
+BIT_REVERSED_BYTES = ''.join(chr(int('{:08b}'.format(i)[::-1], 2)) for i in xrange(256))
+
+
+def reverse_bits(value):
+    return int('{:032b}'.format(value)[::-1], 2)
+
 def process_word(data, crc=0xffffffff):
     if (len(data) < 4):
         # The CRC data is "padded" in a very unique and confusing fashion.
@@ -25,12 +37,18 @@ def process_word(data, crc=0xffffffff):
     return crc
 
 def process_buffer(buf, c=0xffffffff):
-    word_count = (len(buf) + 3) / 4
+    """ Returns the CRC of buf, which can be a string or any other buffer. """
+    tail_length = len(buf) % 4
+    words = array.array('I')
+    words.fromstring(buffer(buf, 0, len(buf) - tail_length))
+    words.byteswap()
+    data = words.tostring()
+    if tail_length:
+        # The CRC data is "padded" in a very unique and confusing fashion.
+        data += '\0' * (4 - tail_length) + str(buffer(buf, len(buf) - tail_length))
 
-    crc = c
-    for i in xrange(word_count):
-        crc = process_word(buf[i * 4 : (i + 1) * 4], crc)
-    return crc
+    crc = zlib.crc32(data.translate(BIT_REVERSED_BYTES), reverse_bits(c) ^ 0xffffffff)
+    return reverse_bits((crc & 0xffffffff) ^ 0xffffffff)
 
 def crc32(data):
     return process_buffer(data)
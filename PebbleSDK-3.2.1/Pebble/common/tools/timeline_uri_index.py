@@ -0,0 +1,114 @@
+"""
+The binary system:// URI -> timeline resource id index.
+
+generate_resource_code.py writes it next to a layouts.json and the phonesim's timeline
+maps it with one mmap instead of building the mapping itself. All little endian:
+  header: magic, version, bucket count (a power of two), entry count,
+          size and CRC32 of the layouts.json it was made from
+  buckets: a hash table keyed by the CRC32 of the URI, linearly probed. Each bucket is
+           the offset of its URI from the start of the file, the URI length and the
+           resource id; empty buckets have a URI length of 0.
+  the UTF-8 URIs, back to back
+"""
+
+import mmap
+import os
+import struct
+import zlib
+
+MAGIC = 'TLRI'
+VERSION = 2
+HEADER = struct.Struct('<4sHHHII')
+BUCKET = struct.Struct('<IHH')
+
+
+def index_path(layouts_path):
+    """The index that goes with a layouts.json."""
+    return os.path.splitext(layouts_path)[0] + '.uriidx'
+
+
+def source_stamp(source):
+    """The (size, CRC32) an index records of the layouts.json contents it was made from."""
+    return len(source), zlib.crc32(source) & 0xFFFFFFFF
+
+
+def _bucket_of(uri, mask):
+    return zlib.crc32(uri) & mask
+
+
+def pack_index(mapping, source):
+    """Return the index of mapping ({URI: resource id}), made from the layouts.json source."""
+    items = sorted((uri.encode('utf-8'), res_id) for uri, res_id in mapping.iteritems())
+    bucket_count = 1
+    while bucket_count < len(items) * 2:
+        bucket_count *= 2
+    mask = bucket_count - 1
+
+    uri_offset = HEADER.size + BUCKET.size * bucket_count
+    index = bytearray(uri_offset + sum(len(uri) for uri, _ in items))
+    HEADER.pack_into(index, 0, MAGIC, VERSION, bucket_count, len(items), *source_stamp(source))
+    used = [False] * bucket_count
+    for uri, res_id in items:
+        bucket = _bucket_of(uri, mask)
+        while used[bucket]:
+            bucket = (bucket + 1) & mask
+        used[bucket] = True
+        BUCKET.pack_into(index, HEADER.size + bucket * BUCKET.size, uri_offset, len(uri), res_id)
+        index[uri_offset:uri_offset + len(uri)] = uri
+        uri_offset += len(uri)
+    return str(index)
+
+
+class TimelineUriIndex(object):
+    """
+    A read-only {URI: resource id} mapping looked up straight out of an mmap'd index
+    file. Supports the dict operations the timeline uses on layouts.json's 'resources'.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("{} is empty".format(path))
+        if len(self._data) < HEADER.size:
+            self.close()
+            raise ValueError("{} is too short to be a timeline URI index".format(path))
+        (magic, version, bucket_count, self._count,
+         self.source_size, self.source_crc) = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("{} is not a version {} timeline URI index".format(path, VERSION))
+        self._mask = bucket_count - 1
+
+    def made_from(self, source):
+        """Whether the index was made from the layouts.json contents source."""
+        return (self.source_size, self.source_crc) == source_stamp(source)
+
+    def get(self, uri, default=None):
+        if isinstance(uri, unicode):
+            uri = uri.encode('utf-8')
+        data = self._data
+        bucket = _bucket_of(uri, self._mask)
+        while True:
+            offset, length, res_id = BUCKET.unpack_from(data, HEADER.size + bucket * BUCKET.size)
+            if length == 0:
+                return default
+            if length == len(uri) and data[offset:offset + length] == uri:
+                return res_id
+            bucket = (bucket + 1) & self._mask
+
+    def __getitem__(self, uri):
+        res_id = self.get(uri)
+        if res_id is None:
+            raise KeyError(uri)
+        return res_id
+
+    def __contains__(self, uri):
+        return self.get(uri) is not None
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._data.close()
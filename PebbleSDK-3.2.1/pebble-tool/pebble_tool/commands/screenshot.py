@@ -3,24 +3,113 @@ __author__ = 'katharine'
 
 from six.moves import range
 
+import binascii
 import datetime
-import itertools
+import json
 import png
 import os.path
 from progressbar import ProgressBar, Bar, ReverseBar, FileTransferSpeed, Timer, Percentage
 import subprocess
 import sys
+import time
 
 from libpebble2.exceptions import ScreenshotError
 from libpebble2.services.screenshot import Screenshot
 
 from .base import PebbleCommand
 from pebble_tool.exceptions import ToolError
+from pebble_tool.util.recording import APNGWriter, FrameRecorder, PNGSequenceWriter
+
+
+# The colour the watch's display actually shows for each of its 64 colours,
+# indexed by 0bRRGGBB (each channel is 0, 85, 170 or 255 in screenshots)
+CORRECTED_COLOURS = [
+    (0, 0, 0),  # (0, 0, 0)
+    (0, 30, 65),  # (0, 0, 85)
+    (0, 67, 135),  # (0, 0, 170)
+    (0, 104, 202),  # (0, 0, 255)
+    (43, 74, 44),  # (0, 85, 0)
+    (39, 81, 79),  # (0, 85, 85)
+    (22, 99, 141),  # (0, 85, 170)
+    (0, 125, 206),  # (0, 85, 255)
+    (94, 152, 96),  # (0, 170, 0)
+    (92, 155, 114),  # (0, 170, 85)
+    (87, 165, 162),  # (0, 170, 170)
+    (76, 180, 219),  # (0, 170, 255)
+    (142, 227, 145),  # (0, 255, 0)
+    (142, 230, 158),  # (0, 255, 85)
+    (138, 235, 192),  # (0, 255, 170)
+    (132, 245, 241),  # (0, 255, 255)
+    (74, 22, 27),  # (85, 0, 0)
+    (72, 39, 72),  # (85, 0, 85)
+    (64, 72, 138),  # (85, 0, 170)
+    (47, 107, 204),  # (85, 0, 255)
+    (86, 78, 54),  # (85, 85, 0)
+    (84, 84, 84),  # (85, 85, 85)
+    (79, 103, 144),  # (85, 85, 170)
+    (65, 128, 208),  # (85, 85, 255)
+    (117, 154, 100),  # (85, 170, 0)
+    (117, 157, 118),  # (85, 170, 85)
+    (113, 166, 164),  # (85, 170, 170)
+    (105, 181, 221),  # (85, 170, 255)
+    (158, 229, 148),  # (85, 255, 0)
+    (157, 231, 160),  # (85, 255, 85)
+    (155, 236, 194),  # (85, 255, 170)
+    (149, 246, 242),  # (85, 255, 255)
+    (153, 53, 63),  # (170, 0, 0)
+    (152, 62, 90),  # (170, 0, 85)
+    (149, 86, 148),  # (170, 0, 170)
+    (143, 116, 210),  # (170, 0, 255)
+    (157, 91, 77),  # (170, 85, 0)
+    (157, 96, 100),  # (170, 85, 85)
+    (154, 112, 153),  # (170, 85, 170)
+    (149, 135, 213),  # (170, 85, 255)
+    (175, 160, 114),  # (170, 170, 0)
+    (174, 163, 130),  # (170, 170, 85)
+    (171, 171, 171),  # (170, 170, 170)
+    (167, 186, 226),  # (170, 170, 255)
+    (201, 232, 157),  # (170, 255, 0)
+    (201, 234, 167),  # (170, 255, 85)
+    (199, 240, 200),  # (170, 255, 170)
+    (195, 249, 247),  # (170, 255, 255)
+    (227, 84, 98),  # (255, 0, 0)
+    (226, 88, 116),  # (255, 0, 85)
+    (225, 106, 163),  # (255, 0, 170)
+    (222, 131, 220),  # (255, 0, 255)
+    (230, 110, 107),  # (255, 85, 0)
+    (230, 114, 124),  # (255, 85, 85)
+    (227, 127, 167),  # (255, 85, 170)
+    (225, 148, 223),  # (255, 85, 255)
+    (241, 170, 134),  # (255, 170, 0)
+    (241, 173, 147),  # (255, 170, 85)
+    (239, 181, 184),  # (255, 170, 170)
+    (236, 195, 235),  # (255, 170, 255)
+    (255, 238, 171),  # (255, 255, 0)
+    (255, 241, 181),  # (255, 255, 85)
+    (255, 246, 211),  # (255, 255, 170)
+    (255, 255, 255),  # (255, 255, 255)
+]
+
+
+def _channel_table(shift):
+    # Takes a 0, 85, 170 or 255 channel value to its bits in a 0bRRGGBB index
+    return bytes(bytearray((value >> 6) << shift for value in range(256)))
+
+
+def _corrected_channel_table(channel):
+    # Takes a 0bRRGGBB index to one channel of its corrected colour
+    return bytes(bytearray([colour[channel] for colour in CORRECTED_COLOURS] + [0] * (256 - 64)))
+
+
+INDEX_TABLES = [_channel_table(shift) for shift in (4, 2, 0)]
+CORRECTED_TABLES = [_corrected_channel_table(channel) for channel in range(3)]
 
 
 class ScreenshotCommand(PebbleCommand):
     """Takes a screenshot from the watch."""
     command = 'screenshot'
+    # A recording gives up after this many screenshots in a row have failed
+    MAX_GRAB_FAILURES = 5
 
     def __init__(self):
         self.progress_bar = ProgressBar(widgets=[Percentage(), Bar(marker='=', left='[', right=']'), ' ',
@@ -30,17 +119,16 @@ class ScreenshotCommand(PebbleCommand):
     def __call__(self, args):
         super(ScreenshotCommand, self).__call__(args)
         screenshot = Screenshot(self.pebble)
+        if args.record:
+            self._record(screenshot, args)
+            return
         screenshot.register_handler("progress", self._handle_progress)
 
         self.progress_bar.start()
         try:
             image = screenshot.grab_image()
         except ScreenshotError as e:
-            if self.pebble.firmware_version.major == 3 and self.pebble.firmware_version.minor == 2:
-                # PBL-21154: Screenshots failing with error code 2 (out of memory)
-                raise ToolError(str(e) + " (screenshots are known to be broken using firmware 3.2; try the emulator.)")
-            else:
-                raise ToolError(str(e) + " (try rebooting the watch)")
+            raise self._screenshot_error(e)
         if not args.no_correction:
             image = self._correct_colours(image)
         self.progress_bar.finish()
@@ -51,85 +139,90 @@ class ScreenshotCommand(PebbleCommand):
         if not args.no_open:
             self._open(os.path.abspath(filename))
 
+    def _screenshot_error(self, e):
+        if self.pebble.firmware_version.major == 3 and self.pebble.firmware_version.minor == 2:
+            # PBL-21154: Screenshots failing with error code 2 (out of memory)
+            return ToolError(str(e) + " (screenshots are known to be broken using firmware 3.2; try the emulator.)")
+        else:
+            return ToolError(str(e) + " (try rebooting the watch)")
+
+    def _record(self, screenshot, args):
+        path = self._generate_recording_name(args.apng) if args.filename is None else args.filename
+        writer = APNGWriter(path) if args.apng else PNGSequenceWriter(path)
+        recorder = FrameRecorder(writer, None if args.no_correction else self._correct_colours)
+        recorder.start()
+        print("Recording to {}; press Ctrl-C to stop.".format(path))
+
+        start = time.time()
+        captured = 0
+        failures = 0
+        try:
+            while not recorder.failed and (args.duration is None or time.time() - start < args.duration):
+                try:
+                    image = screenshot.grab_image()
+                except ScreenshotError as e:
+                    failures += 1
+                    if captured == 0 or failures >= self.MAX_GRAB_FAILURES:
+                        raise self._screenshot_error(e)
+                    recorder.drop_frame(str(e))
+                    continue
+                captured += 1
+                failures = 0
+                recorder.add_frame(image, time.time() - start)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            recorder.finish()
+        elapsed = time.time() - start
+
+        if args.apng:
+            frames = [{'timestamp': timestamp} for timestamp in recorder.timestamps]
+            timestamps_path = os.path.splitext(path)[0] + '.json'
+        else:
+            frames = [{'timestamp': timestamp, 'filename': filename}
+                      for timestamp, filename in zip(recorder.timestamps, writer.filenames)]
+            timestamps_path = os.path.join(path, 'frames.json')
+        with open(timestamps_path, 'w') as f:
+            json.dump({'frames': frames, 'dropped': recorder.dropped, 'duration': elapsed}, f, indent=2)
+
+        print("Recorded {} frames in {:.1f}s ({:.1f} fps), {} dropped.".format(
+            len(frames), elapsed, len(frames) / elapsed if elapsed else 0, recorder.dropped))
+        print("Saved recording to {}; frame timestamps are in {}".format(path, timestamps_path))
+
     def _handle_progress(self, progress, total):
         if not self.started:
             self.progress_bar.maxval = total
             self.started = True
         self.progress_bar.update(progress)
 
-    def _correct_colours(self, image):
-        mapping = {
-            (0, 0, 0): (0, 0, 0),
-            (0, 0, 85): (0, 30, 65),
-            (0, 0, 170): (0, 67, 135),
-            (0, 0, 255): (0, 104, 202),
-            (0, 85, 0): (43, 74, 44),
-            (0, 85, 85): (39, 81, 79),
-            (0, 85, 170): (22, 99, 141),
-            (0, 85, 255): (0, 125, 206),
-            (0, 170, 0): (94, 152, 96),
-            (0, 170, 85): (92, 155, 114),
-            (0, 170, 170): (87, 165, 162),
-            (0, 170, 255): (76, 180, 219),
-            (0, 255, 0): (142, 227, 145),
-            (0, 255, 85): (142, 230, 158),
-            (0, 255, 170): (138, 235, 192),
-            (0, 255, 255): (132, 245, 241),
-            (85, 0, 0): (74, 22, 27),
-            (85, 0, 85): (72, 39, 72),
-            (85, 0, 170): (64, 72, 138),
-            (85, 0, 255): (47, 107, 204),
-            (85, 85, 0): (86, 78, 54),
-            (85, 85, 85): (84, 84, 84),
-            (85, 85, 170): (79, 103, 144),
-            (85, 85, 255): (65, 128, 208),
-            (85, 170, 0): (117, 154, 100),
-            (85, 170, 85): (117, 157, 118),
-            (85, 170, 170): (113, 166, 164),
-            (85, 170, 255): (105, 181, 221),
-            (85, 255, 0): (158, 229, 148),
-            (85, 255, 85): (157, 231, 160),
-            (85, 255, 170): (155, 236, 194),
-            (85, 255, 255): (149, 246, 242),
-            (170, 0, 0): (153, 53, 63),
-            (170, 0, 85): (152, 62, 90),
-            (170, 0, 170): (149, 86, 148),
-            (170, 0, 255): (143, 116, 210),
-            (170, 85, 0): (157, 91, 77),
-            (170, 85, 85): (157, 96, 100),
-            (170, 85, 170): (154, 112, 153),
-            (170, 85, 255): (149, 135, 213),
-            (170, 170, 0): (175, 160, 114),
-            (170, 170, 85): (174, 163, 130),
-            (170, 170, 170): (171, 171, 171),
-            (170, 170, 255): (167, 186, 226),
-            (170, 255, 0): (201, 232, 157),
-            (170, 255, 85): (201, 234, 167),
-            (170, 255, 170): (199, 240, 200),
-            (170, 255, 255): (195, 249, 247),
-            (255, 0, 0): (227, 84, 98),
-            (255, 0, 85): (226, 88, 116),
-            (255, 0, 170): (225, 106, 163),
-            (255, 0, 255): (222, 131, 220),
-            (255, 85, 0): (230, 110, 107),
-            (255, 85, 85): (230, 114, 124),
-            (255, 85, 170): (227, 127, 167),
-            (255, 85, 255): (225, 148, 223),
-            (255, 170, 0): (241, 170, 134),
-            (255, 170, 85): (241, 173, 147),
-            (255, 170, 170): (239, 181, 184),
-            (255, 170, 255): (236, 195, 235),
-            (255, 255, 0): (255, 238, 171),
-            (255, 255, 85): (255, 241, 181),
-            (255, 255, 170): (255, 246, 211),
-            (255, 255, 255): (255, 255, 255),
-        }
-        return [list(itertools.chain(*[mapping[y[x], y[x+1], y[x+2]] for x in range(0, len(y), 3)])) for y in image]
+    @classmethod
+    def _correct_colours(cls, image):
+        # Works on the whole image at once rather than pixel by pixel: each
+        # channel is translated to its bits of the colour index, the three are
+        # combined by OR-ing them as big integers (the bits never overlap), and
+        # the index is translated to each corrected channel.
+        if not image:
+            return image
+        rgb = bytearray().join(map(bytearray, image))
+        pixels = len(rgb) // 3
+        index = 0
+        for channel, table in enumerate(INDEX_TABLES):
+            index |= int(binascii.hexlify(bytes(rgb[channel::3]).translate(table)), 16)
+        index = binascii.unhexlify('%0*x' % (pixels * 2, index))
+        for channel, table in enumerate(CORRECTED_TABLES):
+            rgb[channel::3] = index.translate(table)
+        row_len = len(rgb) // len(image)
+        return [rgb[i:i + row_len] for i in range(0, len(rgb), row_len)]
 
     @classmethod
     def _generate_filename(cls):
         return datetime.datetime.now().strftime("pebble_screenshot_%Y-%m-%d_%H-%M-%S.png")
 
+    @classmethod
+    def _generate_recording_name(cls, apng):
+        name = datetime.datetime.now().strftime("pebble_recording_%Y-%m-%d_%H-%M-%S")
+        return name + '.png' if apng else name
+
     @classmethod
     def _open(cls, path):
         if sys.platform == 'darwin':
@@ -141,4 +234,9 @@ class ScreenshotCommand(PebbleCommand):
         parser.add_argument('filename', nargs='?', type=str, help="Filename of screenshot")
         parser.add_argument('--no-correction', action="store_true", help="Disable colour correction.")
         parser.add_argument('--no-open', action="store_true", help="Disable automatic opening of image.")
+        parser.add_argument('--record', action="store_true",
+                            help="Keep taking screenshots as fast as possible until interrupted, saving them as a "
+                                 "directory of PNGs (or an APNG with --apng) along with their timestamps.")
+        parser.add_argument('--apng', action="store_true", help="Save a recording as a single animated PNG.")
+        parser.add_argument('--duration', type=float, metavar='SECONDS', help="Stop recording after this long.")
         return parser
@@ -35,12 +35,42 @@ class AnalyseSizeCommand(SDKCommand):
         # This is Super Special Magic of some form that comes from the SDK.
         import binutils
 
+        budgets = [binutils.parse_size_budget(x) for x in args.budget]
+        baseline = None
+        if args.compare is not None:
+            baseline = binutils.read_size_snapshot(args.compare)
+        elif budgets:
+            raise ToolError("--budget needs a snapshot to --compare against.")
+
+        builds = {}
+        violations = []
         for path in paths:
             print("\n======{}======".format(path))
-            sections = binutils.analyze_elf(path, 'bdt', use_fast_nm=True)
+            table = binutils.symbol_table(path, use_fast_nm=True)
+            sections = table.section_infos('bdt')
+            builds[path] = sections
+            if args.top:
+                table.pprint_largest(args.top, 'tdb')
+
+            if baseline is None:
+                for s in sections.itervalues():
+                    s.pprint(args.summary, args.verbose)
+                continue
+
+            try:
+                old_sections = binutils.snapshot_sections_for(baseline, path, args.compare)
+            except Exception as e:
+                raise ToolError(str(e))
+            diffs = binutils.diff_sections(old_sections, sections)
+            for d in diffs.itervalues():
+                d.pprint(args.summary, args.verbose)
+            violations.extend("{}: {}".format(path, x)
+                              for x in binutils.size_budget_violations(diffs, budgets))
 
-            for s in sections.itervalues():
-                s.pprint(args.summary, args.verbose)
+        if args.snapshot is not None:
+            binutils.write_size_snapshot(args.snapshot, builds)
+        if violations:
+            raise ToolError("Size budget exceeded:\n" + "\n".join(violations))
 
     @classmethod
     def add_parser(cls, parser):
@@ -48,4 +78,11 @@ class AnalyseSizeCommand(SDKCommand):
         parser.add_argument('elf_path', type=str, nargs='?', help='Path to the elf file to analyze')
         parser.add_argument('--summary', action='store_true', help='Disable a single line per section')
         parser.add_argument('--verbose', action='store_true', help='Disable a per-symbol breakdown')
+        parser.add_argument('--top', type=int, default=0, metavar='N',
+                            help='Also list the N largest symbols of each section')
+        parser.add_argument('--snapshot', type=str, help='Save the sizes to this file, to --compare against later')
+        parser.add_argument('--compare', type=str, help='Show the changes since the sizes saved in this snapshot')
+        parser.add_argument('--budget', type=str, action='append', default=[],
+                            help='Fail if a section grew more than allowed since the --compare snapshot, '
+                                 'e.g. text=512 or bss=2%%. May be given once per section.')
         return parser
@@ -6,7 +6,6 @@ import logging
 import os
 import os.path
 import re
-import subprocess
 import time
 import uuid
 import sys
@@ -17,13 +16,21 @@ from libpebble2.communication.transports.websocket import MessageTargetPhone
 from libpebble2.communication.transports.websocket.protocol import WebSocketPhoneAppLog, WebSocketConnectionStatusUpdate
 
 from pebble_tool.exceptions import PebbleProjectException, MissingSDK
-from pebble_tool.sdk import get_arm_tools_path
+from pebble_tool.sdk import get_arm_tools_path, sdk_path
 from pebble_tool.sdk.project import PebbleProject
 from colorama import Fore, Back, Style
 
 
 logger = logging.getLogger("pebble_tool.util.logs")
 
+# The SDK's tools hold binutils, which symbolizes crash addresses.
+try:
+    _sdk_tools_path = os.path.join(sdk_path(), 'Pebble', 'common', 'tools')
+    if _sdk_tools_path not in sys.path:
+        sys.path.append(_sdk_tools_path)
+except MissingSDK:
+    pass
+
 
 class PebbleLogPrinter(object):
     colour_scheme = OrderedDict([
@@ -55,6 +62,7 @@ class PebbleLogPrinter(object):
                                                                self.handle_phone_log))
         self.handles.append(pebble.register_transport_endpoint(MessageTargetPhone, WebSocketConnectionStatusUpdate,
                                                                self.handle_connection))
+        self.symbolizer = None
         try:
             os.environ['PATH'] += ":{}".format(get_arm_tools_path())
         except MissingSDK:
@@ -91,6 +99,8 @@ class PebbleLogPrinter(object):
         for handle in self.handles:
             self.pebble.unregister_endpoint(handle)
         self.pebble.send_packet(AppLogShippingControl(enable=False))
+        if self.symbolizer is not None:
+            self.symbolizer.close()
 
     def handle_watch_log(self, packet):
         assert isinstance(packet, AppLogMessage)
@@ -153,10 +163,17 @@ class PebbleLogPrinter(object):
                 result = '???'
             else:
                 try:
-                    result = subprocess.check_output(["arm-none-eabi-addr2line", address_str, "--exe",
-                                                      elf_path]).strip()
+                    result = self._get_symbolizer().lookup(elf_path, address)
+                except ImportError:
+                    return "(lookup failed: SDK not found)"
                 except OSError:
                     return "(lookup failed: toolchain not found)"
-                except subprocess.CalledProcessError:
-                    return "???"
         return "{:24}: {:10} {}".format(name, address_str, result)
+
+    def _get_symbolizer(self):
+        # One symbolizer for the whole session, so a burst of crashes reuses the parsed .elf
+        # (or the running addr2line) instead of starting a process per register.
+        if self.symbolizer is None:
+            import binutils  # from the SDK's tools, see the top of this module
+            self.symbolizer = binutils.Symbolizer()
+        return self.symbolizer
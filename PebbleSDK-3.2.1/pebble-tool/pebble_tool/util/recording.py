@@ -0,0 +1,162 @@
+from __future__ import absolute_import, division
+
+import six
+from six.moves import queue
+
+import logging
+import os
+import struct
+import sys
+import threading
+import zlib
+
+import png
+
+logger = logging.getLogger("pebble_tool.util.recording")
+
+
+class PNGSequenceWriter(object):
+    """Writes each frame to its own PNG in a directory."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.filenames = []
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def add_frame(self, rows, timestamp):
+        filename = "frame_{:05d}.png".format(len(self.filenames))
+        png.from_array(rows, mode='RGB;8').save(os.path.join(self.directory, filename))
+        self.filenames.append(filename)
+
+    def close(self, last_delay=None):
+        pass
+
+
+class APNGWriter(object):
+    """
+    Writes frames to an animated PNG as they arrive. A frame is shown until the next frame's timestamp, so each one is
+    written out when the next arrives.
+    """
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+    MAX_DELAY_MS = 0xFFFF
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._frames = 0
+        self._sequence = 0
+        self._pending = None
+
+    def _start(self, width, height):
+        self.width = width
+        self.height = height
+        self._file = open(self.path, 'wb')
+        self._file.write(self.SIGNATURE)
+        self._chunk(b'IHDR', struct.pack('!IIBBBBB', width, height, 8, 2, 0, 0, 0))  # 8-bit RGB
+        # The frame count is filled in by close()
+        self._actl_offset = self._file.tell()
+        self._chunk(b'acTL', struct.pack('!II', 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack('!I', len(data)) + kind + data)
+        self._file.write(struct.pack('!I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    def add_frame(self, rows, timestamp):
+        if self._file is None:
+            self._start(len(rows[0]) // 3, len(rows))
+        # Filter type 0 (none) for every scanline
+        data = zlib.compress(b''.join(b'\x00' + bytes(bytearray(row)) for row in rows))
+        if self._pending is not None:
+            pending_data, pending_timestamp = self._pending
+            self._write_frame(pending_data, timestamp - pending_timestamp)
+        self._pending = (data, timestamp)
+
+    def _write_frame(self, data, delay):
+        delay_ms = min(int(round(delay * 1000)), self.MAX_DELAY_MS)
+        self._chunk(b'fcTL', struct.pack('!IIIIIHHBB', self._sequence, self.width, self.height, 0, 0,
+                                         delay_ms, 1000, 0, 0))
+        self._sequence += 1
+        if self._frames == 0:
+            # The first frame doubles as the still image shown by viewers without APNG support
+            self._chunk(b'IDAT', data)
+        else:
+            self._chunk(b'fdAT', struct.pack('!I', self._sequence) + data)
+            self._sequence += 1
+        self._frames += 1
+
+    def close(self, last_delay=None):
+        if self._file is None:
+            return
+        if self._pending is not None:
+            self._write_frame(self._pending[0], 0.1 if last_delay is None else last_delay)
+            self._pending = None
+        self._chunk(b'IEND', b'')
+        self._file.seek(self._actl_offset)
+        self._chunk(b'acTL', struct.pack('!II', self._frames, 0))  # 0 plays: loop forever
+        self._file.close()
+
+
+class FrameRecorder(threading.Thread):
+    """
+    Processes and writes frames on its own thread, so capturing the next frame never waits for encoding or the disk.
+    A frame that arrives while max_pending frames are already waiting is dropped rather than stalling the capture.
+    If processing or writing a frame fails, the recorder stops and finish() raises the error.
+    """
+    def __init__(self, writer, process=None, max_pending=8):
+        self.writer = writer
+        self.process = process
+        self.timestamps = []
+        self.dropped = 0
+        self._queue = queue.Queue(max_pending)
+        self._exc_info = None
+        super(FrameRecorder, self).__init__()
+        self.daemon = True
+
+    @property
+    def failed(self):
+        return self._exc_info is not None
+
+    def add_frame(self, image, timestamp):
+        if self.failed:
+            self.drop_frame("writer failed")
+            return
+        try:
+            self._queue.put_nowait((image, timestamp))
+        except queue.Full:
+            self.drop_frame("writer is behind")
+
+    def drop_frame(self, reason):
+        self.dropped += 1
+        logger.debug("Dropped a frame: %s", reason)
+
+    def run(self):
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is None:
+                    break
+                image, timestamp = frame
+                if self.process is not None:
+                    image = self.process(image)
+                self.writer.add_frame(image, timestamp)
+                self.timestamps.append(timestamp)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def finish(self):
+        """Waits for the pending frames to be written and closes the writer."""
+        # Only wait for room in the queue while there's a thread to make it
+        while self.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.join()
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        last_delay = None
+        if len(self.timestamps) > 1:
+            # Show the last frame for as long as the average frame
+            last_delay = (self.timestamps[-1] - self.timestamps[0]) / (len(self.timestamps) - 1)
+        self.writer.close(last_delay)
@@ -0,0 +1,158 @@
+from __future__ import absolute_import, division
+
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+import zlib
+
+from pebble_tool.util.recording import APNGWriter, FrameRecorder
+
+
+def read_chunks(path):
+    """Returns the (type, data) of each chunk in a PNG, checking the signature and CRCs."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    assert content[:8] == APNGWriter.SIGNATURE
+    chunks = []
+    offset = 8
+    while offset < len(content):
+        length, = struct.unpack_from('!I', content, offset)
+        kind = content[offset + 4:offset + 8]
+        data = content[offset + 8:offset + 8 + length]
+        crc, = struct.unpack_from('!I', content, offset + 8 + length)
+        assert crc == zlib.crc32(kind + data) & 0xFFFFFFFF
+        chunks.append((kind, data))
+        offset += 12 + length
+    return chunks
+
+
+def solid_frame(width, height, value):
+    return [[value] * (width * 3) for _ in range(height)]
+
+
+class ListWriter(object):
+    def __init__(self):
+        self.frames = []
+        self.closed_with = None
+
+    def add_frame(self, rows, timestamp):
+        self.frames.append((rows, timestamp))
+
+    def close(self, last_delay=None):
+        self.closed_with = last_delay
+
+
+class FailingWriter(ListWriter):
+    def __init__(self, release=None):
+        super(FailingWriter, self).__init__()
+        self.release = release
+
+    def add_frame(self, rows, timestamp):
+        if self.release is not None:
+            self.release.wait()
+        raise IOError("disk full")
+
+
+class TestAPNGWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recording.png')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_chunks(self):
+        writer = APNGWriter(self.path)
+        writer.add_frame(solid_frame(2, 1, 10), 0)
+        writer.add_frame(solid_frame(2, 1, 20), 0.5)
+        writer.add_frame(solid_frame(2, 1, 30), 1.5)
+        writer.close(last_delay=0.25)
+
+        chunks = read_chunks(self.path)
+        self.assertEqual([kind for kind, _ in chunks],
+                         [b'IHDR', b'acTL', b'fcTL', b'IDAT', b'fcTL', b'fdAT', b'fcTL', b'fdAT', b'IEND'])
+        self.assertEqual(struct.unpack('!IIBBBBB', chunks[0][1]), (2, 1, 8, 2, 0, 0, 0))
+        # close() fills in the frame count
+        self.assertEqual(struct.unpack('!II', chunks[1][1]), (3, 0))
+
+        controls = [struct.unpack('!IIIIIHHBB', data) for kind, data in chunks if kind == b'fcTL']
+        self.assertEqual([control[0] for control in controls], [0, 1, 3])
+        self.assertEqual([control[5] for control in controls], [500, 1000, 250])
+        self.assertEqual([struct.unpack_from('!I', data)[0] for kind, data in chunks if kind == b'fdAT'], [2, 4])
+
+        self.assertEqual(zlib.decompress(chunks[3][1]), b'\x00' + bytes(bytearray([10] * 6)))
+        self.assertEqual(zlib.decompress(chunks[7][1][4:]), b'\x00' + bytes(bytearray([30] * 6)))
+
+    def test_long_delay_is_clamped(self):
+        writer = APNGWriter(self.path)
+        writer.add_frame(solid_frame(1, 1, 0), 0)
+        writer.add_frame(solid_frame(1, 1, 0), 3600)
+        writer.close()
+        controls = [struct.unpack('!IIIIIHHBB', data) for kind, data in read_chunks(self.path) if kind == b'fcTL']
+        self.assertEqual([control[5] for control in controls], [APNGWriter.MAX_DELAY_MS, 100])
+
+    def test_no_frames(self):
+        APNGWriter(self.path).close()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestFrameRecorder(unittest.TestCase):
+    def test_writes_processed_frames_in_order(self):
+        writer = ListWriter()
+        recorder = FrameRecorder(writer, process=lambda image: image * 2)
+        recorder.start()
+        for timestamp in (0, 1, 3):
+            recorder.add_frame([timestamp], timestamp)
+        recorder.finish()
+        self.assertEqual(writer.frames, [([0, 0], 0), ([1, 1], 1), ([3, 3], 3)])
+        self.assertEqual(recorder.timestamps, [0, 1, 3])
+        # The last frame is shown for as long as the average frame
+        self.assertEqual(writer.closed_with, 1.5)
+        self.assertEqual(recorder.dropped, 0)
+
+    def test_drops_frames_when_behind(self):
+        release = threading.Event()
+        writer = ListWriter()
+        recorder = FrameRecorder(writer, process=lambda image: release.wait() or image, max_pending=1)
+        recorder.start()
+        recorder.add_frame([0], 0)
+        while not recorder._queue.empty():
+            pass  # until the worker is busy with the first frame
+        recorder.add_frame([1], 1)
+        recorder.add_frame([2], 2)
+        self.assertEqual(recorder.dropped, 1)
+        release.set()
+        recorder.finish()
+        self.assertEqual(recorder.timestamps, [0, 1])
+
+    def test_writer_error_is_raised_by_finish(self):
+        writer = FailingWriter()
+        recorder = FrameRecorder(writer)
+        recorder.start()
+        recorder.add_frame([0], 0)
+        recorder.join(5)
+        self.assertTrue(recorder.failed)
+        recorder.add_frame([1], 1)
+        self.assertEqual(recorder.dropped, 1)
+        self.assertRaises(IOError, recorder.finish)
+        self.assertIsNone(writer.closed_with)
+
+    def test_finish_with_full_queue_and_dead_worker(self):
+        release = threading.Event()
+        recorder = FrameRecorder(FailingWriter(release), max_pending=1)
+        recorder.start()
+        recorder.add_frame([0], 0)
+        while not recorder._queue.empty():
+            pass
+        recorder.add_frame([1], 1)
+        release.set()
+        recorder.join(5)
+        self.assertTrue(recorder._queue.full())
+        self.assertRaises(IOError, recorder.finish)
+
+
+if __name__ == '__main__':
+    unittest.main()